@@ -0,0 +1,343 @@
+"""
+End to end benchmark of dispatching throughput and latency.
+
+For each scenario and each 'threads' setting a fresh process builds temporary
+    sources and destinations, renders the configuration template, starts a
+    FileObserver and feeds its sources with a synthetic producer.
+Latency of a file goes from the moment its producer closed it to the end of its
+    dispatching (StageHooks.DISPATCH), so it includes event delivery, transfer
+    completion checks, queueing and copies.
+
+Usage (from project root):
+    python benchmarks/benchmark.py
+    python benchmarks/benchmark.py --threads 1 4 --scenarios small mixed --output results.json
+    python benchmarks/benchmark.py --set DISPATCHER:sources.backend=inotify --compare results.json
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import statistics
+import string
+import sys
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Tuple
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "src"))
+
+DEFAULT_TEMPLATE = os.path.join(PROJECT_ROOT, "benchmarks", "conf.ini.template")
+DEFAULT_THREADS = [1, 2, 4, 8]
+KIB = 1024
+MIB = 1024 * KIB
+
+
+class Scenario(ABC):
+    """
+    Layout of sources, destinations and rules, and files to produce
+    """
+
+    def __init__(self, name: str, description: str, sources: int, destinations: int,
+                 formats: Dict[str, List[str]], rules: List[Tuple[str, List[int], List[int]]]):
+        """
+
+        :param formats: format name -> extensions
+        :param rules: (format name, sources indexes, destinations indexes) for each rule
+        """
+        self.name = name
+        self.description = description
+        self.sources = sources
+        self.destinations = destinations
+        self.formats = formats
+        self.rules = rules
+
+    def render(self, template: str, root: str, threads: int, options: Dict[str, List[str]]) -> str:
+        formats = {name: extensions for name, extensions in self.formats.items()}
+        sources = {f"S{i}": f"{root}/S{i}" for i in range(self.sources)}
+        destinations = {f"D{i}": f"{root}/D{i}" for i in range(self.destinations)}
+        rules = {
+            f"R{i}": {
+                "formats": [fmt],
+                "sources": [f"S{s}" for s in srcs],
+                "destinations": [f"D{d}" for d in dsts]
+            } for i, (fmt, srcs, dsts) in enumerate(self.rules)
+        }
+        return string.Template(template).safe_substitute(
+            root=root,
+            threads=threads,
+            general="\n".join(options.get("GENERAL", [])),
+            dispatcher="\n".join(options.get("DISPATCHER", [])),
+            formats=json.dumps(formats),
+            sources=json.dumps(sources),
+            destinations=json.dumps(destinations),
+            rules=json.dumps(rules)
+        )
+
+    @abstractmethod
+    def files(self, args: argparse.Namespace, rnd: random.Random) -> List[Tuple[int, str, int]]:
+        """
+        :return: (source index, file name, size) of files to produce
+        """
+        raise NotImplementedError
+
+
+class SmallFilesStorm(Scenario):
+    def __init__(self):
+        super().__init__(
+            "small", "storm of small files, written as fast as possible",
+            2, 1, {"F0": [".txt"]}, [("F0", [0, 1], [0])]
+        )
+
+    def files(self, args, rnd):
+        return [(i % self.sources, f"small{i}.txt", args.small_size) for i in range(args.files)]
+
+
+class LargeSlowFiles(Scenario):
+    def __init__(self):
+        super().__init__(
+            "large", "large files written slowly, in chunks",
+            1, 2, {"F0": [".bin"]}, [("F0", [0], [0, 1])]
+        )
+
+    def files(self, args, rnd):
+        return [(0, f"large{i}.bin", args.large_size) for i in range(args.large_files)]
+
+
+class MixedExtensions(Scenario):
+    FORMATS = 20
+    EXTENSIONS = 3
+
+    def __init__(self):
+        formats = {
+            f"F{i}": [f".e{i}x{j}" for j in range(MixedExtensions.EXTENSIONS)]
+            for i in range(MixedExtensions.FORMATS)
+        }
+        # each format from a couple of sources to one or two destinations
+        rules = [
+            (f"F{i}", [i % 4, (i + 1) % 4], [i % 6] if i % 3 else [i % 6, (i + 3) % 6])
+            for i in range(MixedExtensions.FORMATS)
+        ]
+        super().__init__(
+            "mixed", f"mixed extensions across {MixedExtensions.FORMATS} rules, 4 sources and 6 destinations",
+            4, 6, formats, rules
+        )
+
+    def files(self, args, rnd):
+        files = []
+        for i in range(args.files):
+            fmt, sources, _ = self.rules[rnd.randrange(len(self.rules))]
+            extension = rnd.choice(self.formats[fmt])
+            size = rnd.randint(KIB, args.mixed_size)
+            files.append((rnd.choice(sources), f"mixed{i}{extension}", size))
+        return files
+
+
+SCENARIOS = {scenario.name: scenario for scenario in (SmallFilesStorm(), LargeSlowFiles(), MixedExtensions())}
+
+
+def percentile(values: List[float], percent: float) -> float:
+    if len(values) == 0:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(percent / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def produce(root: str, files: List[Tuple[int, str, int]], chunk: int, pause: float,
+            produced: Dict[str, float]) -> None:
+    """
+    Write files, recording when each one was closed
+    """
+    for source, name, size in files:
+        filename = f"{root}/S{source}/{name}"
+        data = os.urandom(min(size, chunk))
+        with open(filename, "wb") as f:
+            written = 0
+            while written < size:
+                written += f.write(data[:size - written])
+                if pause > 0 and written < size:
+                    f.flush()
+                    time.sleep(pause)
+        produced[filename] = time.perf_counter()
+
+
+def run_case(scenario_name: str, threads: int, args: argparse.Namespace, template: str) -> Dict[str, object]:
+    """
+    Run a scenario in the current (fresh) process
+    """
+    from control import FileObserver
+    from model import DispatcherConfig
+    from util import StageHooks
+
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    scenario = SCENARIOS[scenario_name]
+    rnd = random.Random(args.seed)
+    files = scenario.files(args, rnd)
+    root = os.path.realpath(tempfile.mkdtemp(prefix=f"dispatcher-bench-{scenario.name}-", dir=args.dir))
+    try:
+        for i in range(scenario.sources):
+            os.makedirs(f"{root}/S{i}")
+        for i in range(scenario.destinations):
+            os.makedirs(f"{root}/D{i}")
+        os.makedirs(f"{root}/tmp")
+        config_file = f"{root}/conf.ini"
+        with open(config_file, "w") as f:
+            f.write(scenario.render(template, root, threads, args.options))
+
+        produced = {}
+        dispatched = {}
+        errors = []
+        done = threading.Event()
+
+        def on_stage(context: StageHooks.Context) -> None:
+            if context.stage != StageHooks.DISPATCH:
+                return
+            dispatched[context.filename] = context.start + context.elapsed
+            if context.error is not None:
+                errors.append(f"{context.filename}: {context.error}")
+            if len(dispatched) >= len(files):
+                done.set()
+
+        StageHooks.register(on_stage)
+        dispatcher_config = DispatcherConfig.get_instance()
+        dispatcher_config.load_from(config_file)
+        observer = FileObserver(dispatcher_config)
+        threading.Thread(target=observer.start, name="FileObserver", daemon=True).start()
+        # observers scheduled
+        time.sleep(args.warmup)
+
+        pause = args.large_pause if scenario is SCENARIOS["large"] else 0
+        start = time.perf_counter()
+        produce(root, files, args.chunk, pause, produced)
+        finished = done.wait(args.timeout)
+        observer.stop()
+
+        latencies = [dispatched[name] - closed for name, closed in produced.items() if name in dispatched]
+        end = max(dispatched.values()) if len(dispatched) > 0 else time.perf_counter()
+        elapsed = end - start
+        size = sum(size for _, _, size in files)
+        return {
+            "scenario": scenario.name,
+            "threads": threads,
+            "files": len(files),
+            "dispatched": len(latencies),
+            "errors": len(errors),
+            "timed_out": not finished,
+            "bytes": size,
+            "seconds": round(elapsed, 6),
+            "files_per_s": round(len(latencies) / elapsed, 3) if elapsed > 0 else 0,
+            "mb_per_s": round(size / MIB / elapsed, 3) if elapsed > 0 else 0,
+            "latency_p50": round(percentile(latencies, 50), 6),
+            "latency_p99": round(percentile(latencies, 99), 6),
+            "latency_max": round(max(latencies), 6) if len(latencies) > 0 else 0,
+            "latency_mean": round(statistics.mean(latencies), 6) if len(latencies) > 0 else 0
+        }
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def compare(results: List[Dict[str, object]], baseline_file: str) -> None:
+    with open(baseline_file) as f:
+        baseline = {(r["scenario"], r["threads"]): r for r in json.load(f)["results"]}
+    print(f"\nCompared to '{baseline_file}' (negative is better for latency, positive for throughput)")
+    for result in results:
+        previous = baseline.get((result["scenario"], result["threads"]))
+        if previous is None:
+            continue
+        deltas = []
+        for key in ("files_per_s", "latency_p50", "latency_p99"):
+            before, after = previous[key], result[key]
+            deltas.append(f"{key} {(after - before) / before * 100:+.1f}%" if before else f"{key} n/a")
+        print(f"  {result['scenario']:<6} threads={result['threads']:<3} " + "  ".join(deltas))
+
+
+def parse_options(values: List[str]) -> Dict[str, List[str]]:
+    options = {}
+    for value in values:
+        section, _, option = value.partition(":")
+        key, equal, setting = option.partition("=")
+        if section.upper() not in ("GENERAL", "DISPATCHER") or not equal:
+            raise argparse.ArgumentTypeError(f"Option '{value}' must be 'SECTION:key=value' (GENERAL or DISPATCHER)")
+        options.setdefault(section.upper(), []).append(f"{key.strip()} = {setting.strip()}")
+    return options
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="End to end benchmark of dispatching throughput and latency")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--threads", nargs="+", type=int, default=DEFAULT_THREADS, help="'threads' settings to compare")
+    parser.add_argument("--template", default=DEFAULT_TEMPLATE, help="configuration template")
+    parser.add_argument("--set", dest="sets", action="append", default=[], metavar="SECTION:key=value",
+                        help="option added to the configuration, e.g. DISPATCHER:sources.backend=inotify")
+    parser.add_argument("--files", type=int, default=2000, help="files of small and mixed scenarios")
+    parser.add_argument("--small-size", type=int, default=4 * KIB, help="bytes of small files")
+    parser.add_argument("--mixed-size", type=int, default=256 * KIB, help="maximum bytes of mixed files")
+    parser.add_argument("--large-files", type=int, default=4, help="files of large scenario")
+    parser.add_argument("--large-size", type=int, default=64 * MIB, help="bytes of large files")
+    parser.add_argument("--large-pause", type=float, default=0.01, help="pause (seconds) between chunks of large files")
+    parser.add_argument("--chunk", type=int, default=MIB, help="bytes written at once")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--warmup", type=float, default=1, help="seconds waited for observers before producing")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds waited for dispatching of a run")
+    parser.add_argument("--dir", default=None, help="directory of temporary trees (default: system one)")
+    parser.add_argument("--keep", action="store_true", help="keep temporary trees")
+    parser.add_argument("--verbose", action="store_true", help="keep dispatcher logging")
+    parser.add_argument("--output", default=None, help="JSON file of results")
+    parser.add_argument("--compare", default=None, help="JSON file of previous results to compare with")
+    args = parser.parse_args()
+    args.options = parse_options(args.sets)
+
+    with open(args.template) as f:
+        template = f.read()
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    print(f"{'scenario':<8} {'threads':>7} {'files':>6} {'files/s':>9} {'MB/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for scenario in args.scenarios:
+        for threads in args.threads:
+            # every run in a fresh process: configuration, loggers and metrics are process wide
+            with context.Pool(1) as pool:
+                result = pool.apply(run_case, (scenario, threads, args, template))
+            results.append(result)
+            print(
+                f"{result['scenario']:<8} {result['threads']:>7} {result['dispatched']:>6} "
+                f"{result['files_per_s']:>9.1f} {result['mb_per_s']:>8.1f} {result['latency_p50'] * 1000:>8.1f} "
+                f"{result['latency_p99'] * 1000:>8.1f} {result['latency_max'] * 1000:>8.1f}"
+                + (" TIMED OUT" if result["timed_out"] else "")
+                + (f" {result['errors']} ERRORS" if result["errors"] else "")
+            )
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "options": args.sets,
+        "parameters": {
+            key: getattr(args, key) for key in (
+                "files", "small_size", "mixed_size", "large_files", "large_size", "large_pause", "chunk", "seed"
+            )
+        },
+        "results": results
+    }
+    if args.compare is not None:
+        compare(results, args.compare)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to '{args.output}'")
+
+
+if __name__ == '__main__':
+    main()
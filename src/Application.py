@@ -1,7 +1,7 @@
 import atexit
 import sys
 
-from control import FileObserver
+from control import FileObserver, ShardSupervisor
 from model import DispatcherConfig
 from util import Validation
 from util.Common import Common
@@ -39,7 +39,10 @@ class Application(object):
             dispatcher_config = DispatcherConfig.get_instance()
             dispatcher_config.load_from(config_file)
 
-            self.__file_observer = FileObserver(dispatcher_config)
+            if dispatcher_config.general_processes > 1:
+                self.__file_observer = ShardSupervisor(config_file, dispatcher_config)
+            else:
+                self.__file_observer = FileObserver(dispatcher_config)
             atexit.register(self.stop)
             # Blocking call
             self.__file_observer.start()
@@ -0,0 +1,126 @@
+import asyncio
+import threading
+from concurrent.futures.thread import ThreadPoolExecutor
+from typing import Callable, Dict
+
+from control.FileStabilizer import FileStabilizer
+from model import File
+from util import LogManager
+
+
+class AsyncioEngine(object):
+    """
+    asyncio based alternative to FileStabilizer plus thread pool.
+
+    An event loop runs in a dedicated thread: files coming from observer threads are
+        bridged into the loop, waits for transfer completion are loop timers and only
+        blocking operations (dispatching: copy/unlink) run on a small bounded executor.
+    So a waiting file costs a timer handle instead of a thread.
+    """
+
+    __LOG = None
+
+    def __init__(self, execute: Callable[[File], None],
+                 sources_poll: Dict[str, float] = None, max_threads: int = 2,
+                 poll: float = FileStabilizer.DEFAULT_POLL, on_drop: Callable[[File], None] = None):
+        """
+
+        :param execute: blocking function dispatching a stable file, run on the executor
+        :param sources_poll: base poll time for each source directory
+        :param max_threads: threads of the executor
+        :param poll: base poll time for sources not in sources_poll
+        :param on_drop: called, from the loop thread, if a file is removed while waiting
+        """
+        super().__init__()
+
+        AsyncioEngine.__LOG = LogManager.get_instance().get(LogManager.Logger.OBSERVER)
+        self.__execute = execute
+        self.__on_drop = on_drop
+        self.__poll = poll
+        self.__sources_poll = FileStabilizer.sources_trie(sources_poll)
+
+        self.__pending = 0
+        self.__running = True
+        self.__executor = ThreadPoolExecutor(max_workers=max_threads)
+        self.__loop = asyncio.new_event_loop()
+        self.__loop.set_default_executor(self.__executor)
+        self.__thread = threading.Thread(target=self.__run, name=self.__class__.__name__, daemon=True)
+        self.__thread.start()
+
+    def __run(self) -> None:
+        asyncio.set_event_loop(self.__loop)
+        self.__loop.run_forever()
+
+    def set_sources_poll(self, sources_poll: Dict[str, float] = None) -> None:
+        """
+        Replace poll times, for files added from now on
+        """
+        self.__sources_poll = FileStabilizer.sources_trie(sources_poll)
+
+    def add(self, file: File) -> None:
+        """
+        Thread safe: may be called from any thread
+        """
+        poll = self.__sources_poll.get(file.source, self.__poll)
+        self.__loop.call_soon_threadsafe(self.__admit, FileStabilizer.Entry(file, poll))
+
+    def ready(self, file: File) -> None:
+        """
+        Thread safe: dispatch a file already known to be completely transferred, without waiting
+        """
+        self.__loop.call_soon_threadsafe(self.__ready, file)
+
+    def __ready(self, file: File) -> None:
+        if self.__running:
+            self.__loop.create_task(self.__dispatch(file))
+
+    def __admit(self, entry: FileStabilizer.Entry) -> None:
+        self.__pending += 1
+        self.__check(entry)
+
+    def __check(self, entry: FileStabilizer.Entry) -> None:
+        if not self.__running:
+            return
+
+        try:
+            delay = entry.observe()
+        except FileNotFoundError:
+            self.__pending -= 1
+            AsyncioEngine.__LOG.debug("[SKIPPING] file '%s': removed while waiting", entry.file.filename)
+            if self.__on_drop is not None:
+                self.__on_drop(entry.file)
+            return
+
+        if delay is None:
+            self.__pending -= 1
+            self.__loop.create_task(self.__dispatch(entry.file))
+        else:
+            self.__loop.call_later(delay, self.__check, entry)
+
+    async def __dispatch(self, file: File) -> None:
+        file.stabilized()
+        try:
+            await self.__loop.run_in_executor(None, self.__execute, file)
+        except Exception as e:
+            AsyncioEngine.__LOG.warning("[ENGINE ERROR] '%s': %s", file.filename, e)
+            AsyncioEngine.__LOG.debug("[ENGINE ERROR]", exc_info=True)
+
+    async def __shutdown(self) -> None:
+        # files being dispatched are completed, files waiting for transfer completion are discarded
+        self.__running = False
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self) -> None:
+        asyncio.run_coroutine_threadsafe(self.__shutdown(), self.__loop).result()
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.__thread.join()
+        self.__loop.close()
+        self.__executor.shutdown(wait=True)
+
+        if self.__pending > 0:
+            AsyncioEngine.__LOG.debug("Discarded %s files waiting for transfer completion", self.__pending)
+
+    @property
+    def pending(self) -> int:
+        return self.__pending
@@ -0,0 +1,112 @@
+import threading
+import time
+from typing import Callable, Hashable, List
+
+from model import File
+from util import LogManager, Metrics
+
+
+class DispatchBatcher(object):
+    """
+    This class collects files ready to be dispatched into batches, so the per destination
+        work of many small files (opening and syncing destination directories) is shared.
+
+    A batch is closed window seconds after its first file, or as soon as it holds size files.
+    Files of a batch are grouped by key (their destinations) and each group is handed,
+        split in at most parallelism parts, to on_batch by a single timer thread.
+    """
+
+    __LOG = None
+
+    DEFAULT_WINDOW = 0
+    DEFAULT_SIZE = 256
+
+    def __init__(self, on_batch: Callable[[List[File]], None], key: Callable[[File], Hashable],
+                 window: float = DEFAULT_WINDOW, size: int = DEFAULT_SIZE, parallelism: int = 1):
+        """
+
+        :param on_batch: called, from the batcher thread, with files sharing the same key
+        :param key: groups files of a batch
+        :param window: seconds a batch is kept open for, since its first file
+        :param size: maximum files of a batch
+        :param parallelism: maximum parts each group is split in (e.g. dispatching threads)
+        """
+        super().__init__()
+
+        DispatchBatcher.__LOG = LogManager.get_instance().get(LogManager.Logger.OBSERVER)
+        self.__on_batch = on_batch
+        self.__key = key
+        self.__window = window
+        self.__size = size
+        self.__parallelism = max(1, parallelism)
+
+        self.__pending = []
+        # monotonic time of the first pending file
+        self.__opened = None
+        self.__condition = threading.Condition()
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__run, name=self.__class__.__name__, daemon=True)
+        self.__thread.start()
+
+    def add(self, file: File) -> None:
+        with self.__condition:
+            self.__pending.append(file)
+            # wake up timer thread to wait for the window, or to close a full batch
+            if len(self.__pending) == 1:
+                self.__opened = time.monotonic()
+                self.__condition.notify()
+            elif len(self.__pending) >= self.__size:
+                self.__condition.notify()
+
+    def __run(self) -> None:
+        while True:
+            with self.__condition:
+                while self.__running:
+                    if len(self.__pending) == 0:
+                        self.__condition.wait()
+                        continue
+                    delay = self.__opened + self.__window - time.monotonic()
+                    if delay <= 0 or len(self.__pending) >= self.__size:
+                        break
+                    self.__condition.wait(delay)
+
+                if not self.__running and len(self.__pending) == 0:
+                    return
+                batch, self.__pending = self.__pending[:self.__size], self.__pending[self.__size:]
+                opened, self.__opened = self.__opened, time.monotonic() if len(self.__pending) > 0 else None
+
+            Metrics.get_instance().observe(Metrics.BATCH_SECONDS, time.monotonic() - opened, phase="collect")
+            self.__flush(batch)
+
+    def __flush(self, batch: List[File]) -> None:
+        groups = {}
+        for file in batch:
+            try:
+                key = self.__key(file)
+            except Exception as e:
+                # file is dispatched alone, its error is handled by dispatching
+                DispatchBatcher.__LOG.debug("[BATCH] '%s' not grouped: %s", file.filename, e)
+                key = file.filename
+            groups.setdefault(key, []).append(file)
+
+        for files in groups.values():
+            parts = min(self.__parallelism, len(files))
+            for part in range(parts):
+                try:
+                    self.__on_batch(files[part::parts])
+                except Exception as e:
+                    DispatchBatcher.__LOG.warning("[BATCH ERROR] %s files not dispatched: %s", len(files[part::parts]), e)
+                    DispatchBatcher.__LOG.debug("[BATCH ERROR]", exc_info=True)
+
+    def stop(self) -> None:
+        """
+        Stop batching, handing over files still pending
+        """
+        with self.__condition:
+            self.__running = False
+            self.__condition.notify()
+        self.__thread.join()
+
+    @property
+    def pending(self) -> int:
+        return len(self.__pending)
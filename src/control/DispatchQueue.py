@@ -0,0 +1,164 @@
+import json
+import os
+import threading
+from typing import Callable, Dict
+
+from util import LogManager, Validation
+
+
+class DispatchQueue(object):
+    """
+    This class bounds the number of files in flight (waiting for transfer completion,
+        queued or being dispatched) between the observers and the dispatching workers.
+
+    When capacity is reached new files are handled according to the overload policy:
+        - block: the caller (observer thread) waits until a file is dispatched
+        - spill: filenames are appended to a journal on disk and admitted again later
+        - drop: files are discarded and their directories rescanned later
+    Spilled files and directories to rescan are fed back, by a dedicated thread, once
+        the depth falls below half of the capacity.
+    """
+
+    __LOG = None
+
+    POLICY_BLOCK = "block"
+    POLICY_SPILL = "spill"
+    POLICY_DROP = "drop"
+    POLICIES = (POLICY_BLOCK, POLICY_SPILL, POLICY_DROP)
+
+    # 0 means unbounded
+    DEFAULT_CAPACITY = 0
+    DEFAULT_POLICY = POLICY_BLOCK
+    # spilled filenames fed back at once
+    DRAIN_BATCH = 256
+
+    def __init__(self, on_admit: Callable[[str], None], on_rescan: Callable[[str], None],
+                 capacity: int = DEFAULT_CAPACITY, policy: str = DEFAULT_POLICY, spill_filename: str = None):
+        """
+
+        :param on_admit: called with spilled filenames when they can be admitted again
+        :param on_rescan: called with directories containing dropped files when they can be rescanned
+        :param capacity: maximum number of files in flight, 0 for unbounded
+        :param policy: overload policy, one of POLICIES
+        :param spill_filename: journal for spilled filenames (spill policy only)
+        :raise ValueError if policy is unknown or spill journal is not specified
+        """
+        super().__init__()
+
+        Validation.is_true(policy in DispatchQueue.POLICIES, f"Unknown queue policy '{policy}', available: {DispatchQueue.POLICIES}")
+        Validation.is_true(policy != DispatchQueue.POLICY_SPILL or spill_filename is not None, "Spill journal not specified")
+
+        DispatchQueue.__LOG = LogManager.get_instance().get(LogManager.Logger.OBSERVER)
+        self.__on_admit = on_admit
+        self.__on_rescan = on_rescan
+        self.__capacity = capacity
+        self.__policy = policy
+
+        self.__condition = threading.Condition()
+        self.__depth = 0
+        self.__running = True
+
+        self.__spill = None
+        self.__spill_offset = 0
+        self.__spilled = 0
+        self.__rescan = set()
+        self.__dropped = 0
+
+        self.__drainer = None
+        if capacity > 0 and policy != DispatchQueue.POLICY_BLOCK:
+            if policy == DispatchQueue.POLICY_SPILL:
+                # spilled filenames of a previous run are not lost
+                self.__spill = open(spill_filename, "a+", encoding="utf-8")
+            self.__drainer = threading.Thread(target=self.__drain, name=f"{self.__class__.__name__}-drain", daemon=True)
+            self.__drainer.start()
+
+    def offer(self, filename: str) -> bool:
+        """
+        :param filename: file to admit
+        :return: True iff filename has been admitted, so done() must be called once dispatched
+        """
+        with self.__condition:
+            if self.__capacity > 0 and self.__depth >= self.__capacity:
+                if self.__policy == DispatchQueue.POLICY_BLOCK:
+                    while self.__running and self.__depth >= self.__capacity:
+                        self.__condition.wait()
+                elif self.__policy == DispatchQueue.POLICY_SPILL:
+                    self.__spill.write(f"{json.dumps(filename)}\n")
+                    self.__spill.flush()
+                    self.__spilled += 1
+                    return False
+                else:
+                    self.__rescan.add(os.path.dirname(filename))
+                    self.__dropped += 1
+                    return False
+
+            self.__depth += 1
+            return True
+
+    def done(self) -> None:
+        with self.__condition:
+            self.__depth -= 1
+            self.__condition.notify_all()
+
+    def __has_backlog(self) -> bool:
+        if self.__spill is not None:
+            return self.__spill.seek(0, os.SEEK_END) > self.__spill_offset
+        return len(self.__rescan) > 0
+
+    def __drain(self) -> None:
+        while True:
+            with self.__condition:
+                while self.__running and (self.__depth > self.__capacity // 2 or not self.__has_backlog()):
+                    self.__condition.wait()
+                if not self.__running:
+                    return
+
+                if self.__spill is not None:
+                    self.__spill.seek(self.__spill_offset)
+                    filenames = []
+                    for line in iter(self.__spill.readline, ""):
+                        filenames.append(json.loads(line))
+                        if len(filenames) == DispatchQueue.DRAIN_BATCH:
+                            break
+                    self.__spill_offset = self.__spill.tell()
+                    if self.__spill_offset >= self.__spill.seek(0, os.SEEK_END):
+                        # everything has been read back
+                        self.__spill.truncate(0)
+                        self.__spill_offset = 0
+                    directories = []
+                else:
+                    filenames = []
+                    directories = list(self.__rescan)
+                    self.__rescan.clear()
+
+            for filename in filenames:
+                self.__on_admit(filename)
+            for directory in directories:
+                DispatchQueue.__LOG.debug("Rescanning '%s' for files dropped on overload", directory)
+                self.__on_rescan(directory)
+
+    def stop(self) -> None:
+        with self.__condition:
+            self.__running = False
+            self.__condition.notify_all()
+        if self.__drainer is not None:
+            self.__drainer.join()
+        if self.__spill is not None:
+            self.__spill.close()
+
+    @property
+    def depth(self) -> int:
+        return self.__depth
+
+    @property
+    def capacity(self) -> int:
+        return self.__capacity
+
+    def stats(self) -> Dict[str, int]:
+        with self.__condition:
+            return {
+                "depth": self.__depth,
+                "capacity": self.__capacity,
+                "spilled": self.__spilled,
+                "dropped": self.__dropped
+            }
@@ -1,12 +1,21 @@
+import os
+import time
 from concurrent.futures.thread import ThreadPoolExecutor
-from typing import List
+from typing import Dict, Iterator, List, Tuple
 
 from watchdog.events import FileSystemEvent, FileSystemMovedEvent, FileSystemEventHandler
 
-from control.dispatcher import FileDispatcher
-from model import File, Rule
-from util import LogManager
-from util.Validation import Validation, ValidationException
+from control.AsyncioEngine import AsyncioEngine
+from control.DispatchBatcher import DispatchBatcher
+from control.DispatchQueue import DispatchQueue
+from control.FileStabilizer import FileStabilizer
+from control.InFlightRegistry import InFlightRegistry
+from control.Profiler import Profiler
+from control.dispatcher import DispatchJournal, FileDispatcher
+from control.transfer import CopyEngine, FingerprintCache
+from model import File, RuleIndex
+from util import LogManager, Metrics, StageHooks
+from util.Validation import Validation
 
 
 class FileEventHandler(FileSystemEventHandler):
@@ -14,46 +23,314 @@ class FileEventHandler(FileSystemEventHandler):
     This class handles the events of creations and move to of a file and rely on
         FileDispatcher to copy/remove files.
 
-    Uses a thread pool to manage files dispatching.
+    Files are handed to a thread pool, which manages files dispatching, only once
+        FileStabilizer detects that they are completely transferred.
+        Alternatively, both stages can be run by AsyncioEngine.
+    Repeated events for a file already waiting or being dispatched are merged
+        by InFlightRegistry, so each file is dispatched once.
+    The number of files in flight is bounded by DispatchQueue.
+    With a batch window, stable files are handed to the thread pool in batches grouped
+        by destinations (see DispatchBatcher), each one dispatched by a single task.
     """
 
     __LOG = None
 
     DEFAULT_MAX_THREADS = 2
 
-    def __init__(self, rules: List[Rule], max_threads: int = DEFAULT_MAX_THREADS):
+    ENGINE_THREADS = "threads"
+    ENGINE_ASYNCIO = "asyncio"
+    ENGINES = (ENGINE_THREADS, ENGINE_ASYNCIO)
+    DEFAULT_ENGINE = ENGINE_THREADS
+
+    # files submitted at once while sweeping directories
+    SWEEP_BATCH = 256
+
+    def __init__(self, rules: RuleIndex, max_threads: int = DEFAULT_MAX_THREADS,
+                 sources_poll: Dict[str, float] = None, copy_engine: CopyEngine = None,
+                 queue_capacity: int = DispatchQueue.DEFAULT_CAPACITY, queue_policy: str = DispatchQueue.DEFAULT_POLICY,
+                 queue_spill_filename: str = None, engine: str = DEFAULT_ENGINE,
+                 fingerprints: FingerprintCache = None, profiler: Profiler = None,
+                 journal: DispatchJournal = None, batch_window: float = DispatchBatcher.DEFAULT_WINDOW,
+                 batch_size: int = DispatchBatcher.DEFAULT_SIZE):
         super().__init__()
 
+        Validation.is_true(engine in FileEventHandler.ENGINES, f"Unknown engine '{engine}', available: {FileEventHandler.ENGINES}")
+
         FileEventHandler.__LOG = LogManager.get_instance().get(LogManager.Logger.OBSERVER)
-        self.__dispatcher = FileDispatcher(rules)
-        self.__executor = ThreadPoolExecutor(max_workers=max_threads)
+        self.__rules = rules
+        self.__profiler = profiler
+        self.__dispatcher = FileDispatcher(rules, copy_engine, fingerprints, journal)
+        self.__registry = InFlightRegistry()
+        self.__batcher = None
+        if engine == FileEventHandler.ENGINE_ASYNCIO:
+            if batch_window > 0:
+                FileEventHandler.__LOG.warning("Batching is not supported by engine '%s': files are dispatched one by one", engine)
+            self.__executor = None
+            self.__stabilizer = AsyncioEngine(self.__execute, sources_poll, max_threads, on_drop=self.__drop)
+        else:
+            self.__executor = ThreadPoolExecutor(max_workers=max_threads)
+            if batch_window > 0:
+                self.__batcher = DispatchBatcher(
+                    self.__dispatch_batch,
+                    lambda file: self.__rules.match(file.filename, file),
+                    batch_window,
+                    batch_size,
+                    max_threads
+                )
+            self.__stabilizer = FileStabilizer(
+                self.__dispatch if self.__batcher is None else self.__batcher.add,
+                sources_poll,
+                on_drop=self.__drop
+            )
+        self.__queue = DispatchQueue(
+            self.__submit,
+            self.__rescan,
+            queue_capacity,
+            queue_policy,
+            queue_spill_filename
+        )
+
+        metrics = Metrics.get_instance()
+        metrics.gauge(Metrics.QUEUE_DEPTH, lambda: self.__queue.depth)
+        metrics.gauge(Metrics.IN_FLIGHT, lambda: len(self.__registry))
 
-    def __submit(self, filename) -> None:
+    def __submit(self, filename: str, checked: bool = False, ready: bool = False) -> bool:
+        """
+        :param filename: file which triggered an event
+        :param checked: filename is already known to be a regular file (e.g. from directory entry type)
+        :param ready: filename is already known to be completely transferred, so it is not stabilized
+        :return: True iff filename has been admitted for dispatching
+        """
+        # names are matched without touching the filesystem, so files no rule
+        #  dispatches are not even checked
+        if not self.__rules.accepts(filename):
+            FileEventHandler.__LOG.debug("[SKIPPING] file '%s': no matching rule", filename)
+            return False
         try:
-            Validation.is_file(filename)
-            Validation.has_extension(filename)
-        except ValidationException.MissingExtensionError:
-            FileEventHandler.__LOG.debug(f"[SKIPPING] file '{filename}': no extension")
-            return
+            if not checked:
+                Validation.is_file(filename)
         except FileNotFoundError:
-            FileEventHandler.__LOG.debug(f"[SKIPPING] file '{filename}': no regular file")
-            return
+            FileEventHandler.__LOG.debug("[SKIPPING] file '%s': no regular file", filename)
+            return False
+
+        # timing includes waits on a full queue
+        with StageHooks.stage(StageHooks.ADMIT, filename) as context:
+            admitted = self.__admit(filename)
+            if context is not None:
+                context.labels["admitted"] = admitted
+        if not admitted:
+            return False
+
+        if ready:
+            self.__stabilizer.ready(File(filename))
+        else:
+            self.__stabilizer.add(File(filename))
+        return True
+
+    def __admit(self, filename: str) -> bool:
+        if not self.__registry.admit(filename):
+            FileEventHandler.__LOG.debug("[COALESCED] file '%s': already in flight", filename)
+            return False
+
+        if not self.__queue.offer(filename):
+            FileEventHandler.__LOG.debug("[DEFERRED] file '%s': too many files in flight", filename)
+            self.__registry.discard(filename)
+            return False
+
+        return True
+
+    def __submit_batch(self, filenames: List[str]) -> int:
+        return sum(self.__submit(filename, checked=True) for filename in filenames)
+
+    @staticmethod
+    def __scan(directory: str, recursive: bool = False) -> Iterator[List[str]]:
+        """
+        Yield regular files of directory (and of its sub directories, if recursive) in batches,
+            relying on the entry type returned by the directory listing (no stat for each file)
+        """
+        batch = []
+        directories = [directory]
+        while len(directories) > 0:
+            current = directories.pop()
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        if entry.is_file(follow_symlinks=False):
+                            batch.append(entry.path)
+                            if len(batch) == FileEventHandler.SWEEP_BATCH:
+                                yield batch
+                                batch = []
+                        elif recursive and entry.is_dir(follow_symlinks=False):
+                            directories.append(entry.path)
+            except OSError as e:
+                FileEventHandler.__LOG.warning("Error scanning '%s': %s", current, e)
+        if len(batch) > 0:
+            yield batch
+
+    def __rescan(self, directory: str, recursive: bool = False) -> None:
+        for batch in FileEventHandler.__scan(directory, recursive):
+            self.__submit_batch(batch)
+
+    def sweep(self, directories: List[str], threads: int = DEFAULT_MAX_THREADS) -> Tuple[int, int]:
+        """
+        Submit files already present in directories, in parallel batches.
+        Files also notified by events during the sweep are dispatched once (see InFlightRegistry).
+
+        :param directories: directories to sweep
+        :param threads: threads submitting batches
+        :return: number of files found and number of files admitted for dispatching
+        """
+        found = 0
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="Sweep") as pool:
+            futures = []
+            for directory in directories:
+                for batch in FileEventHandler.__scan(directory, self.__rules.is_recursive(directory)):
+                    found += len(batch)
+                    futures.append(pool.submit(self.__submit_batch, batch))
+            admitted = sum(future.result() for future in futures)
+        return found, admitted
+
+    def recover(self) -> Dict[str, int]:
+        """
+        Complete or roll back dispatches interrupted by a previous run (see FileDispatcher.recover())
+        """
+        return self.__dispatcher.recover()
+
+    def recover_journal(self, filename: str) -> Dict[str, int]:
+        """
+        Replay a journal left by a process not running anymore (see FileDispatcher.recover_journal())
+        """
+        return self.__dispatcher.recover_journal(filename)
+
+    def __dispatch(self, file: File) -> None:
+        self.__executor.submit(
+            self.__execute,
+            file
+        )
 
+    def __dispatch_batch(self, files: List[File]) -> None:
         self.__executor.submit(
-            self.__dispatcher.execute,
-            File(filename)
+            self.__execute_batch,
+            files
         )
 
+    def __execute_batch(self, files: List[File]) -> None:
+        start = time.monotonic()
+        try:
+            with self.__dispatcher.batch():
+                for file in files:
+                    try:
+                        self.__execute(file)
+                    except Exception as e:
+                        # following files of the batch are dispatched anyway
+                        FileEventHandler.__LOG.warning("[BATCH ERROR] '%s': %s", file.filename, e)
+                        FileEventHandler.__LOG.debug("[BATCH ERROR]", exc_info=True)
+        finally:
+            metrics = Metrics.get_instance()
+            metrics.observe(Metrics.BATCH_FILES, len(files))
+            metrics.observe(Metrics.BATCH_SECONDS, time.monotonic() - start, phase="dispatch")
+
+    def __execute(self, file: File) -> None:
+        if file.stable is not None:
+            StageHooks.emit(StageHooks.STABILIZE, file.filename, file.stable - file.discovered)
+            StageHooks.emit(StageHooks.POOL, file.filename, time.monotonic() - file.stable)
+
+        if not self.__registry.claim(file.filename):
+            # a previous file with the same name is still being dispatched
+            self.__stabilizer.add(file)
+            return
+
+        try:
+            if self.__profiler is None:
+                self.__dispatcher.execute(file)
+            else:
+                with self.__profiler.profile():
+                    self.__dispatcher.execute(file)
+        finally:
+            self.__registry.release(file.filename)
+            self.__queue.done()
+
+    def __drop(self, file: File) -> None:
+        self.__registry.discard(file.filename)
+        self.__queue.done()
+
+    def __submit_directory(self, directory: str) -> None:
+        # files may be written in a new directory before it is watched
+        #  and files of a directory moved into a source do not trigger events
+        if self.__rules.owns(directory):
+            self.__rescan(directory, recursive=True)
+
     def on_created(self, event: FileSystemEvent) -> None:
         super().on_created(event)
-        FileEventHandler.__LOG.debug(f"[CREATED] file '{event.src_path}'")
+        if event.is_directory:
+            FileEventHandler.__LOG.debug("[CREATED] directory '%s'", event.src_path)
+            self.__submit_directory(event.src_path)
+            return
+        FileEventHandler.__LOG.debug("[CREATED] file '%s'", event.src_path)
         self.__submit(event.src_path)
 
     def on_moved(self, event: FileSystemMovedEvent) -> None:
         super().on_moved(event)
-        FileEventHandler.__LOG.debug(f"[MOVED] file '{event.src_path}' to '{event.dest_path}'")
+        if event.is_directory:
+            FileEventHandler.__LOG.debug("[MOVED] directory '%s' to '%s'", event.src_path, event.dest_path)
+            self.__submit_directory(event.dest_path)
+            return
+        FileEventHandler.__LOG.debug("[MOVED] file '%s' to '%s'", event.src_path, event.dest_path)
         self.__submit(event.dest_path)
 
+    def on_ready(self, filename: str) -> None:
+        """
+        Called by event sources which can detect the end of a transfer (e.g. inotify close of a written file)
+        """
+        FileEventHandler.__LOG.debug("[READY] file '%s'", filename)
+        self.__submit(filename, ready=True)
+
+    def on_directory(self, directory: str) -> None:
+        """
+        Called by event sources for directories created in, or moved into, a source
+        """
+        FileEventHandler.__LOG.debug("[DIRECTORY] '%s'", directory)
+        self.__submit_directory(directory)
+
+    def on_overflow(self, directory: str) -> None:
+        """
+        Called by event sources when events for directory may have been lost
+        """
+        FileEventHandler.__LOG.warning("Events lost for '%s', rescanning it", directory)
+        self.__rescan(directory, self.__rules.is_recursive(directory))
+
+    def reconfigure(self, rules: RuleIndex, sources_poll: Dict[str, float] = None) -> None:
+        """
+        Replace rules and poll times of sources. Each one is swapped atomically:
+            events received from now on use the new ones, files being dispatched
+            complete with the rules they were matched with
+        """
+        self.__dispatcher.set_rules(rules)
+        self.__stabilizer.set_sources_poll(sources_poll)
+        self.__rules = rules
+
     def shutdown(self) -> None:
         # shutdown threads
-        self.__executor.shutdown(wait=True)
+        self.__queue.stop()
+        self.__stabilizer.stop()
+        if self.__batcher is not None:
+            # stable files are dispatched before the thread pool stops
+            self.__batcher.stop()
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=True)
+        self.__dispatcher.shutdown()
+        FileEventHandler.__LOG.debug("In flight registry: %s", self.__registry.stats())
+        FileEventHandler.__LOG.debug("Dispatch queue: %s", self.__queue.stats())
+
+    def stats(self) -> Dict[str, int]:
+        stats = {f"registry.{k}": v for k, v in self.__registry.stats().items()}
+        stats.update({f"queue.{k}": v for k, v in self.__queue.stats().items()})
+        return stats
+
+    @property
+    def registry(self) -> InFlightRegistry:
+        return self.__registry
+
+    @property
+    def queue(self) -> DispatchQueue:
+        return self.__queue
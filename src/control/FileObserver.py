@@ -1,12 +1,21 @@
+import os
+import signal
+import threading
+import time
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List, Tuple
 
 from watchdog.observers import Observer
 
 import __version__
 from control.FileEventHandler import FileEventHandler
-from model import DispatcherConfig, RuleBuilder
-from util import Validation, LogManager
+from control.InotifyObserver import InotifyObserver
+from control.MetricsServer import MetricsServer
+from control.Profiler import Profiler
+from control.dispatcher import DispatchJournal
+from control.transfer import CopyEngine, FingerprintCache, StagingArea
+from model import DispatcherConfig, PatternMatcher, RuleBuilder, RuleIndex, SourceTrie
+from util import Validation, ValidationException, LogManager, Metrics, PathTable
 
 
 class FileObserver(object):
@@ -14,8 +23,13 @@ class FileObserver(object):
     This class provide observable behavior for multiple directories
         and only one handler.
 
-    One Observer for each source directory to observe.
-    All Observers have the same FileEventHandler.
+    A single Observer watches all source directories, so threads and wakeups
+        do not grow with the number of sources.
+    Events are routed to the rules of their source by the FileEventHandler.
+
+    Configuration is reloaded on SIGHUP (and, optionally, when its file changes):
+        rules are rebuilt and swapped in while files keep being dispatched, and
+        only sources added, removed or changed are scheduled again.
     """
 
     # TODO
@@ -26,6 +40,29 @@ class FileObserver(object):
 
     PY_VERSION_MIN = (3, 7)
 
+    BACKEND_WATCHDOG = "watchdog"
+    BACKEND_INOTIFY = "inotify"
+    BACKENDS = (BACKEND_WATCHDOG, BACKEND_INOTIFY)
+
+    RELOAD_SIGNAL = signal.SIGHUP
+    # options applied by reload(), changes to other ones take effect at restart
+    RELOADABLE = (
+        DispatcherConfig.K_FORMATS,
+        DispatcherConfig.K_SOURCES,
+        DispatcherConfig.K_SOURCES_POLL,
+        DispatcherConfig.K_SOURCES_RECURSIVE,
+        DispatcherConfig.K_SOURCES_SWEEP,
+        DispatcherConfig.K_DESTINATIONS,
+        DispatcherConfig.K_RULES
+    )
+    # derived or internal options
+    NOT_CONFIGURABLE = (
+        DispatcherConfig.K_VERSION,
+        DispatcherConfig.K_APP_NAME,
+        DispatcherConfig.K_LOG_FILENAME,
+        DispatcherConfig.K_CONFIG_FILE
+    )
+
     def __init__(self, dispatcher_config: DispatcherConfig):
         """
 
@@ -42,34 +79,132 @@ class FileObserver(object):
         self.__dispatcher_config = dispatcher_config
 
         # Load loggers
-        self.__init_loggers(dispatcher_config.log_filename)
+        self.__init_loggers(dispatcher_config.log_filename, dispatcher_config.general_log_async)
         # Validate rules
         self.__validate_rules()
         # Check permissions
         self.__check_permissions()
 
-        self.__dir_obs_dict = self.__fill_dict(dispatcher_config.dispatcher_sources)
+        self.__rules = self.__build_rules()
         self.__event_handler = FileEventHandler(
-            RuleBuilder.build_list(
-                dispatcher_config.dispatcher_rules,
-                dispatcher_config.dispatcher_formats,
-                dispatcher_config.dispatcher_sources,
-                dispatcher_config.dispatcher_destinations
+            self.__rules,
+            dispatcher_config.general_threads,
+            self.__sources_poll(),
+            CopyEngine.build(
+                dispatcher_config.general_copy_strategies,
+                dispatcher_config.general_copy_buffer,
+                dispatcher_config.general_copy_fan_out_threads,
+                StagingArea(dispatcher_config.general_tmp)
             ),
-            dispatcher_config.general_threads
+            dispatcher_config.general_queue_capacity,
+            dispatcher_config.general_queue_policy,
+            f"{dispatcher_config.general_tmp}/{dispatcher_config.app_name}.spill",
+            dispatcher_config.general_engine,
+            self.__fingerprints(),
+            self.__profiler(),
+            self.__journal(),
+            dispatcher_config.general_batch_window,
+            dispatcher_config.general_batch_size
         )
+        if dispatcher_config.dispatcher_sources_backend == FileObserver.BACKEND_INOTIFY:
+            self.__observer = InotifyObserver(timeout=dispatcher_config.dispatcher_sources_timeout)
+        else:
+            self.__observer = Observer(timeout=dispatcher_config.dispatcher_sources_timeout)
+        self.__directories = self.__watched_directories()
+        # directory -> (watch, recursive)
+        self.__watches = {}
+        self.__reload_lock = threading.Lock()
+        self.__stopped = threading.Event()
+        self.__config_watcher = None
+        if dispatcher_config.general_config_watch > 0 and dispatcher_config.config_file is not None:
+            self.__config_watcher = threading.Thread(
+                target=self.__watch_config,
+                args=(dispatcher_config.general_config_watch,),
+                name="ConfigWatcher",
+                daemon=True
+            )
+        try:
+            signal.signal(FileObserver.RELOAD_SIGNAL, self.__on_reload_signal)
+        except ValueError:
+            FileObserver.__LOG.debug("Configuration reload on signal disabled: signals are handled only by the main thread")
+
+        self.__metrics_server = None
+        if dispatcher_config.general_metrics_listen is not None:
+            Metrics.get_instance().enable()
+            self.__metrics_server = MetricsServer(dispatcher_config.general_metrics_listen)
 
     @classmethod
-    def __init_loggers(cls, log_filename: str) -> None:
+    def __init_loggers(cls, log_filename: str, asynchronous: bool) -> None:
         log_manager = LogManager.get_instance()
-        log_manager.load(log_filename)
+        # shard processes have loggers already configured by their supervisor
+        if not LogManager.is_loaded():
+            log_manager.load(log_filename, asynchronous)
         FileObserver.__LOG = log_manager.get(LogManager.Logger.OBSERVER)
 
-    def __fill_dict(self, directories: Dict[str, str]) -> Dict[str, Observer]:
-        directories_list = [directories[src] for src in directories]
-        timeout = self.__dispatcher_config.dispatcher_sources_timeout
-        observers_list = [Observer(timeout=timeout) for _ in range(len(directories_list))]
-        return dict(zip(directories_list, observers_list))
+    def __build_rules(self) -> RuleIndex:
+        return RuleBuilder.build_index(
+            self.__dispatcher_config.dispatcher_rules,
+            self.__dispatcher_config.dispatcher_formats,
+            self.__dispatcher_config.dispatcher_sources,
+            self.__dispatcher_config.dispatcher_destinations,
+            self.__dispatcher_config.dispatcher_sources_recursive
+        )
+
+    def __watched_directories(self) -> List[str]:
+        """
+        Sources to schedule: sources inside recursive ones are already watched
+        """
+        sources = self.__dispatcher_config.dispatcher_sources
+        recursive = SourceTrie()
+        for directory in sources.values():
+            if self.__rules.is_recursive(directory):
+                recursive.add(directory, directory, recursive=True)
+        return [
+            directory for directory in dict.fromkeys(RuleIndex.normalize(src) for src in sources.values())
+            if recursive.resolve(os.path.dirname(directory)) is None
+        ]
+
+    def __fingerprints(self) -> FingerprintCache:
+        if not self.__dispatcher_config.general_skip_identical:
+            return None
+        return FingerprintCache(
+            self.__dispatcher_config.general_fingerprints_entries,
+            self.__dispatcher_config.general_fingerprints_file
+        )
+
+    def __journal(self) -> DispatchJournal:
+        journal_file = self.__dispatcher_config.general_journal_file
+        if journal_file is None:
+            return None
+        journal_dir = os.path.dirname(os.path.abspath(journal_file))
+        Validation.is_dir_writeable(
+            journal_dir,
+            f"Directory '{journal_dir}' *must* exists and be writable"
+        )
+        return DispatchJournal(journal_file)
+
+    def __profiler(self) -> Profiler:
+        if self.__dispatcher_config.general_profiler_dir is None:
+            return None
+        Validation.is_dir_writeable(
+            self.__dispatcher_config.general_profiler_dir,
+            f"Directory '{self.__dispatcher_config.general_profiler_dir}' *must* exists and be writable"
+        )
+        profiler = Profiler(
+            self.__dispatcher_config.general_profiler_dir,
+            self.__dispatcher_config.general_profiler_window,
+            name=self.__dispatcher_config.app_name
+        )
+        try:
+            profiler.install()
+        except ValueError:
+            FileObserver.__LOG.warning("Profiling can not be toggled: signals are handled only by the main thread")
+        return profiler
+
+    def __sources_poll(self) -> Dict[str, float]:
+        sources = self.__dispatcher_config.dispatcher_sources
+        sources_poll = self.__dispatcher_config.dispatcher_sources_poll or {}
+        return {sources[src]: float(sources_poll[src]) for src in sources_poll}
 
     def __validate_rules(self) -> None:
         """
@@ -87,6 +222,10 @@ class FileObserver(object):
             len(formats) > 0,
             "Formats must be at least one"
         )
+        for frt in formats:
+            Validation.is_list(formats[frt], f"Patterns of format '{frt}' must be specified as a list")
+            for pattern in formats[frt]:
+                PatternMatcher.parse(pattern)
         Validation.is_dict(sources, "Source directories not specified")
         Validation.is_true(
             len(sources) > 0,
@@ -102,10 +241,45 @@ class FileObserver(object):
             len(rules) > 0,
             "Rules must be at least one"
         )
+        for rule in rules:
+            Validation.is_dict(rules[rule], f"Rule '{rule}' must be specified as a dictionary")
+            Validation.is_true(
+                RuleBuilder.K_FORMATS in rules[rule] or RuleBuilder.K_MIME in rules[rule],
+                f"Rule '{rule}' must specify '{RuleBuilder.K_FORMATS}' or '{RuleBuilder.K_MIME}'"
+            )
+            for mime in rules[rule].get(RuleBuilder.K_MIME, []):
+                Validation.is_true(
+                    type(mime) == str and mime.count("/") == 1 and not mime.startswith("/"),
+                    f"Invalid MIME type '{mime}' in rule '{rule}': expected 'type/subtype' or 'type/*'"
+                )
+        sources_poll = self.__dispatcher_config.dispatcher_sources_poll
+        if sources_poll is not None:
+            Validation.is_dict(sources_poll, "Sources poll times must be specified as a dictionary")
+            for src in sources_poll:
+                Validation.key_exists(sources, src, f"Poll time specified for unknown source '{src}'")
+        Validation.is_true(self.__dispatcher_config.general_batch_window >= 0, "Batch window must be greater than or equal to 0")
+        Validation.is_true(self.__dispatcher_config.general_batch_size > 0, "Batch size must be greater than 0")
+        backend = self.__dispatcher_config.dispatcher_sources_backend
+        Validation.is_true(backend in FileObserver.BACKENDS, f"Unknown sources backend '{backend}', available: {FileObserver.BACKENDS}")
+        Validation.is_true(
+            backend != FileObserver.BACKEND_INOTIFY or InotifyObserver.available(),
+            "Sources backend 'inotify' is available only on Linux"
+        )
+        sources_recursive = self.__dispatcher_config.dispatcher_sources_recursive
+        if sources_recursive is not None:
+            Validation.is_dict(sources_recursive, "Recursive sources must be specified as a dictionary")
+            for src in sources_recursive:
+                Validation.key_exists(sources, src, f"Recursion specified for unknown source '{src}'")
+                Validation.is_true(
+                    sources_recursive[src] in RuleIndex.LAYOUTS,
+                    f"Unknown layout '{sources_recursive[src]}' for source '{src}', available: {RuleIndex.LAYOUTS}"
+                )
 
     def __check_permissions(self):
         """
-        Check permissions on directories before performing the operations
+        Check permissions on directories before performing the operations.
+        Every directory is resolved once, concurrently (see PathTable), so checks
+            grow linearly with the number of sources and destinations
 
         :raise ValueError if input directory is equal to output directory
         :raise NotADirectoryError
@@ -114,57 +288,206 @@ class FileObserver(object):
         """
         sources = self.__dispatcher_config.dispatcher_sources
         destinations = self.__dispatcher_config.dispatcher_destinations
+        sources_recursive = self.__dispatcher_config.dispatcher_sources_recursive or {}
+        paths = PathTable(list(sources.values()) + list(destinations.values()))
 
         for source in sources:
-            Validation.is_dir(
+            paths.is_dir(
                 sources[source],
                 f"Missing input directory '{sources[source]}'"
             )
-            Validation.can_read(
+            paths.can_read(
                 sources[source],
                 f"Missing read permission on '{sources[source]}'"
             )
-            Validation.can_write(
+            paths.can_write(
                 sources[source],
                 f"Missing write permission on '{sources[source]}'"
             )
 
+        # real path -> source
+        sources_realpaths = paths.realpaths(sources.values())
+        recursive_realpaths = paths.realpaths(sources[source] for source in sources_recursive)
         for destination in destinations:
             try:
-                Validation.is_dir_writeable(
+                paths.is_dir_writeable(
                     destinations[destination],
                     f"Directory '{destinations[destination]}' *must* exists and be writable"
                 )
             except NotADirectoryError:
+                if paths[destinations[destination]].stat is not None:
+                    raise
                 parent_directory = Path(destinations[destination]).parent
                 Validation.can_write(
                     parent_directory,
                     f"Missing write permission on '{parent_directory}'"
                 )
-                FileObserver.__LOG.info(f"Creating missing destination directory '{destinations[destination]}'")
+                FileObserver.__LOG.info("Creating missing destination directory '%s'", destinations[destination])
                 # create if not exists
                 Path(destinations[destination]).mkdir(parents=True, exist_ok=True)
+                paths.refresh(destinations[destination])
 
-            for source in sources:
-                Validation.are_symlinks(
-                    sources[source],
-                    destinations[destination],
-                    f"Input ('{sources[source]}') and output ('{destinations[destination]}') directory can not be the same (or symlinks)"
+            realpath = paths[destinations[destination]].realpath
+            if realpath in sources_realpaths:
+                raise ValidationException.SymLinksError(
+                    f"Input ('{sources_realpaths[realpath]}') and output ('{destinations[destination]}') directory can not be the same (or symlinks)"
                 )
+            # dispatched files would be observed again
+            recursive = paths.ancestor(destinations[destination], recursive_realpaths)
+            Validation.is_true(
+                recursive is None,
+                f"Output ('{destinations[destination]}') directory can not be inside recursive input ('{recursive_realpaths.get(recursive)}') directory"
+            )
 
     def __observe(self) -> None:
+        if self.__metrics_server is not None:
+            self.__metrics_server.start()
+
+        # dispatches interrupted by a previous run are settled before new files are seen
+        recovered = self.__event_handler.recover()
+        if recovered is not None:
+            FileObserver.__LOG.info("Journal replay: %s", ", ".join(f"{n} {outcome}" for outcome, n in recovered.items()))
+            # journals left by shards of a previous run (when sharded, the supervisor replays them)
+            if self.__dispatcher_config.shard_number is None:
+                for journal_file in DispatchJournal.orphans(self.__dispatcher_config.general_journal_file):
+                    try:
+                        recovered = self.__event_handler.recover_journal(journal_file)
+                    except Exception as e:
+                        FileObserver.__LOG.error("Journal '%s' not replayed: %s", journal_file, e)
+                        FileObserver.__LOG.debug("Journal '%s' not replayed", journal_file, exc_info=True)
+                        continue
+                    FileObserver.__LOG.info(
+                        "Journal '%s' replay: %s", journal_file, ", ".join(f"{n} {outcome}" for outcome, n in recovered.items())
+                    )
+
         # Start observing directories
-        for directory in self.__dir_obs_dict:
-            self.__dir_obs_dict[directory].schedule(
-                self.__event_handler,
-                directory,
-                recursive=False
+        with self.__reload_lock:
+            self.__reschedule()
+        self.__observer.start()
+        if self.__config_watcher is not None:
+            self.__config_watcher.start()
+
+        # observer is already running: files created meanwhile are not lost
+        if self.__dispatcher_config.dispatcher_sources_sweep:
+            self.__sweep()
+
+        self.__observer.join()
+
+    def __reschedule(self) -> List[str]:
+        """
+        Schedule watched directories not scheduled yet, unschedule the ones not watched anymore
+            (or whose recursion changed)
+        :return: directories scheduled
+        """
+        directories = {directory: self.__rules.is_recursive(directory) for directory in self.__directories}
+        for directory, (watch, recursive) in list(self.__watches.items()):
+            if directories.get(directory) != recursive:
+                self.__observer.unschedule(watch)
+                del self.__watches[directory]
+                FileObserver.__LOG.debug("Stop observing %s", directory)
+
+        scheduled = [directory for directory in directories if directory not in self.__watches]
+        for directory in scheduled:
+            watch = self.__observer.schedule(self.__event_handler, directory, recursive=directories[directory])
+            self.__watches[directory] = (watch, directories[directory])
+            FileObserver.__LOG.debug("Start observing %s", directory)
+        return scheduled
+
+    def __on_reload_signal(self, signum, frame) -> None:
+        # reloading is not done in the signal handler, which interrupts the main thread
+        threading.Thread(target=self.reload, name="ConfigReload", daemon=True).start()
+
+    def __config_stamp(self) -> Tuple[int, int]:
+        try:
+            stat = os.stat(self.__dispatcher_config.config_file)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def __watch_config(self, interval: float) -> None:
+        stamp = self.__config_stamp()
+        while not self.__stopped.wait(interval):
+            current = self.__config_stamp()
+            if current is not None and current != stamp:
+                stamp = current
+                self.reload()
+
+    def reload(self) -> bool:
+        """
+        Reload configuration file. The new configuration is validated and its rules are
+            built while files keep being dispatched with the previous ones, then rules are
+            swapped in: files being dispatched complete with the previous rules.
+        If the new configuration is not valid the previous one is kept.
+
+        :return: True iff configuration has been reloaded
+        """
+        config_file = self.__dispatcher_config.config_file
+        if config_file is None:
+            FileObserver.__LOG.warning("Configuration not reloaded: not loaded from a file")
+            return False
+
+        with self.__reload_lock:
+            if self.__stopped.is_set():
+                return False
+            previous = dict(self.__dispatcher_config)
+            built = []
+
+            def prepare(dispatcher_config: DispatcherConfig) -> None:
+                self.__validate_rules()
+                self.__check_permissions()
+                built.append(self.__build_rules())
+
+            try:
+                self.__dispatcher_config.load_from(config_file, prepare)
+            except Exception as e:
+                FileObserver.__LOG.error("Configuration '%s' not reloaded, keeping the previous one: %s: %s", config_file, type(e).__name__, e)
+                return False
+
+            changed = sorted(
+                key for key in self.__dispatcher_config.keys() | previous.keys()
+                if key not in FileObserver.NOT_CONFIGURABLE and self.__dispatcher_config.get(key) != previous.get(key)
+            )
+            if len(changed) == 0:
+                FileObserver.__LOG.info("Configuration '%s' reloaded: nothing changed", config_file)
+                return True
+            deferred = [key for key in changed if key not in FileObserver.RELOADABLE]
+            if len(deferred) > 0:
+                FileObserver.__LOG.warning("Configuration reloaded: changes to %s take effect at restart", deferred)
+
+            self.__rules = built[0]
+            self.__event_handler.reconfigure(self.__rules, self.__sources_poll())
+            self.__directories = self.__watched_directories()
+            scheduled = self.__reschedule()
+            FileObserver.__LOG.info(
+                "Configuration '%s' reloaded: %s rules, %s directories scheduled, %s observed",
+                config_file,
+                len(self.__rules),
+                len(scheduled),
+                len(self.__watches)
             )
-            self.__dir_obs_dict[directory].start()
-            FileObserver.__LOG.debug(f"Start observing {directory}")
 
-        for directory in self.__dir_obs_dict:
-            self.__dir_obs_dict[directory].join()
+            # files of new sources, or left in sources by previous rules
+            if self.__dispatcher_config.dispatcher_sources_sweep:
+                self.__sweep()
+        return True
+
+    def __sweep(self) -> None:
+        """
+        Dispatch files already present in sources (e.g. created while not running)
+        """
+        start = time.monotonic()
+        found, admitted = self.__event_handler.sweep(
+            self.__directories,
+            self.__dispatcher_config.general_threads
+        )
+        elapsed = time.monotonic() - start
+        FileObserver.__LOG.info(
+            "Backlog sweep: %s files found, %s submitted in %.3fs (%.1f files/s)",
+            found,
+            admitted,
+            elapsed,
+            found / elapsed if elapsed > 0 else 0
+        )
 
     def start(self) -> None:
         FileObserver.__LOG.debug(chr(10) + self.__dispatcher_config)
@@ -175,24 +498,33 @@ class FileObserver(object):
         except KeyboardInterrupt:
             pass
         except Exception as e:
-            FileObserver.__LOG.fatal(f"Error occurred: {e}")
-            FileObserver.__LOG.debug(f"{e}", exc_info=True)
+            FileObserver.__LOG.fatal("Error occurred: %s", e)
+            FileObserver.__LOG.debug("%s", e, exc_info=True)
+
+    def stats(self) -> Dict[str, int]:
+        return self.__event_handler.stats()
 
     def __cleanup(self) -> None:
+        with self.__reload_lock:
+            self.__stopped.set()
+
         FileObserver.__LOG.debug("Detaching event handlers")
         self.__event_handler.shutdown()
 
-        FileObserver.__LOG.debug("Shutting down observers")
+        FileObserver.__LOG.debug("Shutting down observer")
         try:
-            for directory in self.__dir_obs_dict:
-                self.__dir_obs_dict[directory].unschedule_all()
-                # stop observer if interrupted
-                self.__dir_obs_dict[directory].stop()
-                # Wait until the thread terminates before exit
-                self.__dir_obs_dict[directory].join()
-                FileObserver.__LOG.debug(f"Stop observing {directory}")
+            self.__observer.unschedule_all()
+            # stop observer if interrupted
+            self.__observer.stop()
+            # Wait until the thread terminates before exit
+            self.__observer.join()
+            FileObserver.__LOG.debug("Stop observing %s", self.__directories)
         except RuntimeError as e:
-            FileObserver.__LOG.debug(f"{e}", exc_info=True)
+            FileObserver.__LOG.debug("%s", e, exc_info=True)
+
+        if self.__metrics_server is not None:
+            FileObserver.__LOG.debug("Shutting down metrics server")
+            self.__metrics_server.stop()
 
         FileObserver.__LOG.debug("Shutting down logging service")
         LogManager.get_instance().shutdown()
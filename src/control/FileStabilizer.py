@@ -0,0 +1,173 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from typing import Callable, Dict
+
+from control.dispatcher import BaseDispatcher
+from model import File, SourceTrie
+from util import LogManager
+
+
+class FileStabilizer(object):
+    """
+    This class waits until files are completely transferred on disk before handing
+        them to the dispatching workers.
+
+    Pending files are kept in a heap ordered by next check time and re-checked by
+        a single timer thread, so no worker sleeps while a file is being written.
+    A file is stable once two consecutive checks see the same size and modification time.
+    The poll interval starts from the base interval of the file source and doubles,
+        up to MAX_POLL_FACTOR times the base, while the file keeps changing.
+    """
+
+    __LOG = None
+
+    DEFAULT_POLL = BaseDispatcher.TRANSFER_DATA_POLL
+    MAX_POLL_FACTOR = 8
+    # worst case modification time granularity (FAT)
+    MTIME_GRANULARITY = 2
+
+    def __init__(self, on_stable: Callable[[File], None],
+                 sources_poll: Dict[str, float] = None, poll: float = DEFAULT_POLL,
+                 on_drop: Callable[[File], None] = None):
+        """
+
+        :param on_stable: called, from the stabilizer thread, once a file is stable
+        :param sources_poll: base poll time for each source directory
+        :param poll: base poll time for sources not in sources_poll
+        :param on_drop: called, from the stabilizer thread, if a file is removed while waiting
+        """
+        super().__init__()
+
+        FileStabilizer.__LOG = LogManager.get_instance().get(LogManager.Logger.OBSERVER)
+        self.__on_stable = on_stable
+        self.__on_drop = on_drop
+        self.__poll = poll
+        self.__sources_poll = FileStabilizer.sources_trie(sources_poll)
+
+        self.__heap = []
+        self.__counter = itertools.count()  # tie-breaker for entries scheduled at the same time
+        self.__condition = threading.Condition()
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__run, name=self.__class__.__name__, daemon=True)
+        self.__thread.start()
+
+    @staticmethod
+    def sources_trie(sources_poll: Dict[str, float] = None) -> SourceTrie:
+        # poll times apply to sub directories of sources too
+        trie = SourceTrie()
+        for source in sources_poll or {}:
+            trie.add(source, sources_poll[source], recursive=True)
+        return trie
+
+    def set_sources_poll(self, sources_poll: Dict[str, float] = None) -> None:
+        """
+        Replace poll times, for files added from now on
+        """
+        self.__sources_poll = FileStabilizer.sources_trie(sources_poll)
+
+    def add(self, file: File) -> None:
+        poll = self.__sources_poll.get(file.source, self.__poll)
+        # first check is immediate: files moved into source are usually already complete
+        self.__schedule(FileStabilizer.Entry(file, poll), time.monotonic())
+
+    def ready(self, file: File) -> None:
+        """
+        Hand over a file already known to be completely transferred, without waiting
+        """
+        self.__stable(file)
+
+    def __schedule(self, entry: "FileStabilizer.Entry", when: float) -> None:
+        with self.__condition:
+            heapq.heappush(self.__heap, (when, next(self.__counter), entry))
+            # wake up timer thread only if it is sleeping for too long
+            if self.__heap[0][2] is entry:
+                self.__condition.notify()
+
+    def __run(self) -> None:
+        while True:
+            with self.__condition:
+                while self.__running:
+                    if len(self.__heap) == 0:
+                        self.__condition.wait()
+                        continue
+                    delay = self.__heap[0][0] - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self.__condition.wait(delay)
+
+                if not self.__running:
+                    return
+                _, _, entry = heapq.heappop(self.__heap)
+
+            self.__check(entry)
+
+    def __check(self, entry: "FileStabilizer.Entry") -> None:
+        try:
+            delay = entry.observe()
+        except FileNotFoundError:
+            FileStabilizer.__LOG.debug("[SKIPPING] file '%s': removed while waiting", entry.file.filename)
+            if self.__on_drop is not None:
+                self.__on_drop(entry.file)
+            return
+
+        if delay is None:
+            self.__stable(entry.file)
+        else:
+            self.__schedule(entry, time.monotonic() + delay)
+
+    def __stable(self, file: File) -> None:
+        file.stabilized()
+        try:
+            self.__on_stable(file)
+        except Exception as e:
+            FileStabilizer.__LOG.warning("[STABILIZER ERROR] '%s': %s", file.filename, e)
+            FileStabilizer.__LOG.debug("[STABILIZER ERROR]", exc_info=True)
+
+    def stop(self) -> None:
+        with self.__condition:
+            self.__running = False
+            pending = len(self.__heap)
+            self.__heap.clear()
+            self.__condition.notify()
+        self.__thread.join()
+
+        if pending > 0:
+            FileStabilizer.__LOG.debug("Discarded %s files waiting for transfer completion", pending)
+
+    @property
+    def pending(self) -> int:
+        return len(self.__heap)
+
+    class Entry(object):
+        """
+        Stabilization state of a pending file
+        """
+
+        __slots__ = ("file", "base_poll", "poll", "observed")
+
+        def __init__(self, file: File, poll: float):
+            self.file = file
+            self.base_poll = poll
+            self.poll = poll
+            self.observed = None
+
+        def observe(self) -> float:
+            """
+            Check file once
+            :return: None if file is stable, seconds before next check otherwise
+            :raise FileNotFoundError if file has been removed
+            """
+            stat = os.stat(self.file.filename)
+            observed = (stat.st_size, stat.st_mtime_ns)
+            # not modified since last check or, on first check, not modified for a long time
+            if observed == self.observed or \
+                    (self.observed is None and time.time() - stat.st_mtime > self.poll + FileStabilizer.MTIME_GRANULARITY):
+                return None
+
+            if self.observed is not None:
+                self.poll = min(self.poll * 2, self.base_poll * FileStabilizer.MAX_POLL_FACTOR)
+            self.observed = observed
+            return self.poll
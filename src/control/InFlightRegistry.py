@@ -0,0 +1,94 @@
+import os
+import threading
+from typing import Dict, Tuple
+
+
+class InFlightRegistry(object):
+    """
+    This class tracks files from their first event to the end of their dispatching,
+        so repeated events for the same file are merged into the job already created.
+
+    A file is pending from admission until a worker starts dispatching it, then it is claimed
+        (together with its identity: inode and modification time) until dispatching ends.
+    Events for pending files are coalesced; events for claimed files are dropped, unless
+        the path now refers to a different file (different identity).
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        self.__lock = threading.Lock()
+        self.__pending = set()
+        # filename -> identity
+        self.__claimed = {}
+
+        self.__admitted = 0
+        self.__coalesced = 0
+        self.__dropped = 0
+
+    def admit(self, filename: str) -> bool:
+        """
+        :param filename: file which triggered an event
+        :return: True iff a new job must be created for filename
+        """
+        with self.__lock:
+            if filename in self.__pending:
+                self.__coalesced += 1
+                return False
+
+            if filename in self.__claimed:
+                identity = InFlightRegistry.__identity(filename)
+                # already removed or same file being dispatched
+                if identity is None or identity == self.__claimed[filename]:
+                    self.__dropped += 1
+                    return False
+
+            self.__pending.add(filename)
+            self.__admitted += 1
+            return True
+
+    def discard(self, filename: str) -> None:
+        """
+        Forget a pending file which will not be dispatched (e.g. removed while waiting)
+        """
+        with self.__lock:
+            self.__pending.discard(filename)
+
+    def claim(self, filename: str) -> bool:
+        """
+        :param filename: pending file
+        :return: True iff filename is not already being dispatched by another worker
+        """
+        with self.__lock:
+            if filename in self.__claimed:
+                return False
+
+            self.__pending.discard(filename)
+            self.__claimed[filename] = InFlightRegistry.__identity(filename)
+            return True
+
+    def release(self, filename: str) -> None:
+        with self.__lock:
+            self.__claimed.pop(filename, None)
+
+    @staticmethod
+    def __identity(filename: str) -> Tuple[int, int]:
+        # inode alone is not enough: inodes of removed files are reused
+        try:
+            stat = os.stat(filename, follow_symlinks=False)
+            return stat.st_ino, stat.st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def stats(self) -> Dict[str, int]:
+        with self.__lock:
+            return {
+                "pending": len(self.__pending),
+                "claimed": len(self.__claimed),
+                "admitted": self.__admitted,
+                "coalesced": self.__coalesced,
+                "dropped": self.__dropped
+            }
+
+    def __len__(self):
+        return len(self.__pending) + len(self.__claimed)
@@ -0,0 +1,200 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+from typing import Dict, Tuple
+
+from util import LogManager
+
+
+class InotifyObserver(object):
+    """
+    Linux only event source based on inotify, alternative to watchdog Observer.
+
+    All source directories are watched by a single inotify instance and a single thread.
+    A file is handed to the handler as ready (no transfer completion polling) as soon as
+        a writer closes it (IN_CLOSE_WRITE) or it is renamed into a source (IN_MOVED_TO),
+        so writers are expected to write each file with a single open.
+    Handler must provide on_ready(filename), on_directory(directory) and on_overflow(directory).
+    """
+
+    __LOG = None
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_EXCL_UNLINK = 0x04000000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = os.O_NONBLOCK
+    IN_CLOEXEC = os.O_CLOEXEC
+
+    WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR | IN_EXCL_UNLINK
+
+    # struct inotify_event: wd, mask, cookie, len (followed by name)
+    EVENT = struct.Struct("iIII")
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, timeout: float = 1):
+        """
+
+        :param timeout: maximum time (seconds) waiting for events before checking whether to stop
+        :raise OSError if inotify is not available
+        """
+        super().__init__()
+
+        InotifyObserver.__LOG = LogManager.get_instance().get(LogManager.Logger.OBSERVER)
+        self.__libc = InotifyObserver.__load_libc()
+        self.__timeout = timeout
+        self.__fd = self.__libc.inotify_init1(InotifyObserver.IN_NONBLOCK | InotifyObserver.IN_CLOEXEC)
+        if self.__fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        self.__handler = None
+        self.__lock = threading.Lock()
+        # watch descriptor -> (directory, recursive)
+        self.__watches = {}
+        # scheduled directory -> recursive
+        self.__roots = {}
+        self.__stopped = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name=self.__class__.__name__, daemon=True)
+
+    @staticmethod
+    def available() -> bool:
+        return sys.platform.startswith("linux") and ctypes.util.find_library("c") is not None
+
+    @staticmethod
+    def __load_libc() -> ctypes.CDLL:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        return libc
+
+    def schedule(self, handler, directory: str, recursive: bool = False) -> str:
+        """
+        :return: watch, to be passed to unschedule()
+        :raise OSError if directory can not be watched
+        """
+        self.__handler = handler
+        with self.__lock:
+            self.__roots[directory] = recursive
+            self.__watch(directory, recursive)
+        return directory
+
+    def __watch(self, directory: str, recursive: bool) -> None:
+        wd = self.__libc.inotify_add_watch(self.__fd, os.fsencode(directory), InotifyObserver.WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), directory)
+        # a directory renamed inside the tree keeps its watch descriptor
+        self.__watches[wd] = (directory, recursive)
+
+        if recursive:
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            self.__watch(entry.path, recursive)
+            except FileNotFoundError:
+                pass
+
+    def unschedule(self, watch: str) -> None:
+        """
+        Stop watching a directory (and its sub directories, if scheduled recursively)
+        :param watch: returned by schedule()
+        """
+        with self.__lock:
+            recursive = self.__roots.pop(watch, False)
+            prefix = os.path.join(watch, "")
+            for wd, (directory, _) in list(self.__watches.items()):
+                if directory == watch or (recursive and directory.startswith(prefix)):
+                    self.__libc.inotify_rm_watch(self.__fd, wd)
+                    del self.__watches[wd]
+
+    def unschedule_all(self) -> None:
+        with self.__lock:
+            for wd in list(self.__watches):
+                self.__libc.inotify_rm_watch(self.__fd, wd)
+            self.__watches.clear()
+            self.__roots.clear()
+
+    def start(self) -> None:
+        self.__thread.start()
+
+    def stop(self) -> None:
+        self.__stopped.set()
+
+    def join(self, timeout: float = None) -> None:
+        self.__thread.join(timeout)
+
+    def __run(self) -> None:
+        poller = select.poll()
+        poller.register(self.__fd, select.POLLIN)
+        try:
+            while not self.__stopped.is_set():
+                if len(poller.poll(self.__timeout * 1000)) == 0:
+                    continue
+                try:
+                    while True:
+                        self.__handle(os.read(self.__fd, InotifyObserver.READ_SIZE))
+                except BlockingIOError:
+                    pass
+                except Exception as e:
+                    InotifyObserver.__LOG.warning("Error handling inotify events: %s", e)
+                    InotifyObserver.__LOG.debug("Error handling inotify events", exc_info=True)
+        finally:
+            with self.__lock:
+                self.__watches.clear()
+                os.close(self.__fd)
+
+    def __handle(self, buffer: bytes) -> None:
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = InotifyObserver.EVENT.unpack_from(buffer, offset)
+            offset += InotifyObserver.EVENT.size
+            name = os.fsdecode(buffer[offset:offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & InotifyObserver.IN_Q_OVERFLOW:
+                for directory in self.__roots_copy():
+                    self.__handler.on_overflow(directory)
+                continue
+
+            with self.__lock:
+                if mask & InotifyObserver.IN_IGNORED:
+                    # watched directory removed
+                    self.__watches.pop(wd, None)
+                    continue
+                watch = self.__watches.get(wd)
+            if watch is None:
+                continue
+
+            directory, recursive = watch
+            path = os.path.join(directory, name)
+            if mask & InotifyObserver.IN_ISDIR:
+                if recursive and mask & (InotifyObserver.IN_CREATE | InotifyObserver.IN_MOVED_TO):
+                    with self.__lock:
+                        try:
+                            self.__watch(path, recursive)
+                        except OSError as e:
+                            InotifyObserver.__LOG.warning("Can not watch '%s': %s", path, e)
+                    # files written before the watch was added
+                    self.__handler.on_directory(path)
+            elif mask & (InotifyObserver.IN_CLOSE_WRITE | InotifyObserver.IN_MOVED_TO):
+                self.__handler.on_ready(path)
+
+    def __roots_copy(self) -> Dict[str, bool]:
+        with self.__lock:
+            return dict(self.__roots)
+
+    @property
+    def watches(self) -> Tuple[str, ...]:
+        with self.__lock:
+            return tuple(directory for directory, _ in self.__watches.values())
@@ -0,0 +1,100 @@
+import os
+import socketserver
+import stat
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from util import LogManager, Metrics, Validation
+
+
+class MetricsServer(object):
+    """
+    This class serves Metrics, in Prometheus text format, over HTTP from a local
+        TCP address ('host:port') or Unix socket ('unix:/path/to/socket').
+    """
+
+    __LOG = None
+
+    UNIX_PREFIX = "unix:"
+    PATHS = ("/", "/metrics")
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self, listen: str, metrics: Metrics = None):
+        """
+
+        :param listen: 'host:port' or 'unix:/path/to/socket'
+        :param metrics: metrics to serve, process wide ones if not specified
+        :raise ValueError if listen is not valid
+        :raise OSError if listen address can not be bound
+        """
+        super().__init__()
+
+        MetricsServer.__LOG = LogManager.get_instance().get(LogManager.Logger.OBSERVER)
+        self.__listen = listen
+        self.__metrics = metrics or Metrics.get_instance()
+        handler = MetricsServer.__handler(self.__metrics)
+
+        self.__socket_path = None
+        if listen.startswith(MetricsServer.UNIX_PREFIX):
+            self.__socket_path = listen[len(MetricsServer.UNIX_PREFIX):]
+            # socket left by a previous run, other files are never removed
+            try:
+                mode = os.lstat(self.__socket_path).st_mode
+            except FileNotFoundError:
+                mode = None
+            if mode is not None:
+                Validation.is_true(
+                    stat.S_ISSOCK(mode),
+                    f"Metrics address '{listen}': '{self.__socket_path}' exists and is not a socket"
+                )
+                os.unlink(self.__socket_path)
+            self.__server = MetricsServer.UnixHTTPServer(self.__socket_path, handler)
+        else:
+            host, _, port = listen.rpartition(":")
+            Validation.is_true(port.isdigit(), f"Metrics address '{listen}' must be 'host:port' or '{MetricsServer.UNIX_PREFIX}path'")
+            self.__server = ThreadingHTTPServer((host, int(port)), handler)
+        self.__server.daemon_threads = True
+        self.__thread = threading.Thread(target=self.__server.serve_forever, name=self.__class__.__name__, daemon=True)
+
+    @staticmethod
+    def __handler(metrics: Metrics) -> type:
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in MetricsServer.PATHS:
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", MetricsServer.CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> None:
+        self.__thread.start()
+        MetricsServer.__LOG.info("Serving metrics on '%s'", self.__listen)
+
+    def stop(self) -> None:
+        if self.__thread.is_alive():
+            self.__server.shutdown()
+        self.__server.server_close()
+        if self.__socket_path is not None:
+            try:
+                os.unlink(self.__socket_path)
+            except FileNotFoundError:
+                pass
+
+    class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        """
+        HTTP server on a Unix socket
+        """
+
+        def get_request(self):
+            request, _ = super().get_request()
+            # BaseHTTPRequestHandler expects a (host, port) client address
+            return request, ("local", 0)
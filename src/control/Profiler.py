@@ -0,0 +1,137 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import signal
+import threading
+import time
+from contextlib import contextmanager
+
+from util import LogManager
+
+
+class Profiler(object):
+    """
+    This class profiles dispatching on demand, without restarting the process.
+
+    A signal toggles a profiling window: while it is open each dispatching is run
+        under its own cProfile profiler (profilers are per thread) and the results
+        are merged; when the window is closed, by the signal or once it lasted the
+        configured time, the merged statistics are dumped in pstats format.
+    """
+
+    __LOG = None
+
+    DEFAULT_SIGNAL = signal.SIGUSR2
+    DEFAULT_WINDOW = 60
+    # rows of the summary logged when a window is closed
+    SUMMARY_ROWS = 15
+
+    def __init__(self, directory: str, window: float = DEFAULT_WINDOW, signum: int = DEFAULT_SIGNAL,
+                 name: str = "dispatcher"):
+        """
+
+        :param directory: directory of dumps
+        :param window: maximum duration (seconds) of a profiling window
+        :param signum: signal toggling profiling windows
+        :param name: prefix of dumps filenames
+        """
+        super().__init__()
+
+        Profiler.__LOG = LogManager.get_instance().get(LogManager.Logger.OBSERVER)
+        self.__directory = directory
+        self.__window = window
+        self.__signum = signum
+        self.__name = name
+
+        self.__lock = threading.Lock()
+        self.__stats = None
+        self.__profiled = 0
+        self.__timer = None
+
+    def install(self) -> None:
+        """
+        Install signal handler
+        :raise ValueError if not called from the main thread
+        """
+        signal.signal(self.__signum, self.__toggle)
+        Profiler.__LOG.debug("Send signal %s to pid %s to toggle profiling", signal.Signals(self.__signum).name, os.getpid())
+
+    def __toggle(self, signum, frame) -> None:
+        # dumping is not done in the signal handler, which interrupts the main thread
+        threading.Thread(target=self.toggle, name=self.__class__.__name__, daemon=True).start()
+
+    @property
+    def active(self) -> bool:
+        return self.__timer is not None
+
+    def toggle(self) -> None:
+        if self.active:
+            self.stop()
+        else:
+            self.start()
+
+    def start(self) -> None:
+        with self.__lock:
+            if self.__timer is not None:
+                return
+            self.__stats = None
+            self.__profiled = 0
+            self.__timer = threading.Timer(self.__window, self.stop)
+            self.__timer.daemon = True
+            self.__timer.start()
+        Profiler.__LOG.info("Profiling dispatching for %ss", self.__window)
+
+    def stop(self) -> None:
+        with self.__lock:
+            if self.__timer is None:
+                return
+            self.__timer.cancel()
+            self.__timer = None
+            stats, profiled = self.__stats, self.__profiled
+            self.__stats = None
+
+        if stats is None:
+            Profiler.__LOG.info("Profiling stopped: no file dispatched")
+            return
+
+        filename = f"{self.__directory}/{self.__name}.{os.getpid()}.{time.strftime('%Y%m%d%H%M%S')}.pstats"
+        try:
+            stats.dump_stats(filename)
+            Profiler.__LOG.info("Profiling stopped: %s files dispatched, statistics dumped to '%s'", profiled, filename)
+        except OSError as e:
+            Profiler.__LOG.warning("Profiling statistics not dumped to '%s': %s", filename, e)
+        if Profiler.__LOG.isEnabledFor(logging.DEBUG):
+            summary = io.StringIO()
+            stats.stream = summary
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(Profiler.SUMMARY_ROWS)
+            Profiler.__LOG.debug(summary.getvalue())
+
+    @contextmanager
+    def profile(self):
+        """
+        Profile the block if a window is open
+        """
+        if self.__timer is None:
+            yield
+            return
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # another profiler is active (e.g. in another thread on interpreters with a single profiler)
+            yield
+            return
+        try:
+            yield
+        finally:
+            profiler.disable()
+            with self.__lock:
+                if self.__timer is not None:
+                    if self.__stats is None:
+                        self.__stats = pstats.Stats(profiler)
+                    else:
+                        self.__stats.add(profiler)
+                    self.__profiled += 1
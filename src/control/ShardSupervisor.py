@@ -0,0 +1,264 @@
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from typing import Dict, List
+
+from control.dispatcher import DispatchJournal, FileDispatcher
+from control.transfer import CopyEngine, StagingArea
+from model import DispatcherConfig, RuleBuilder
+from util import LogManager
+
+
+class ShardSupervisor(object):
+    """
+    This class partitions sources across worker processes (shards), each one running
+        its own FileObserver (observers, registry, queue and workers), so busy sources
+        do not compete for the same interpreter lock.
+
+    Shards send log records and periodic statistics to the supervisor, which handles
+        records with its own loggers and aggregates statistics.
+    Crashed shards are restarted, with an increasing delay, without stopping the others.
+    Configuration reload signals are forwarded to shards; sources are partitioned
+        at startup, so sources added to configuration are observed after a restart.
+    Journals of shards no longer running (e.g. processes reduced) are replayed before shards start.
+    """
+
+    __LOG = None
+
+    MONITOR_INTERVAL = 1
+    STATS_INTERVAL = 30
+    RESTART_DELAY_MIN = 1
+    RESTART_DELAY_MAX = 60
+    STOP_TIMEOUT = 30
+
+    def __init__(self, config_file: str, dispatcher_config: DispatcherConfig):
+        super().__init__()
+
+        log_manager = LogManager.get_instance()
+        log_manager.load(dispatcher_config.log_filename, dispatcher_config.general_log_async)
+        ShardSupervisor.__LOG = log_manager.get(LogManager.Logger.OBSERVER)
+
+        self.__config_file = config_file
+        self.__dispatcher_config = dispatcher_config
+        # spawn: shards must not inherit threads and locks of supervisor
+        self.__context = multiprocessing.get_context("spawn")
+        self.__log_queue = self.__context.Queue()
+        self.__stats_queue = self.__context.Queue()
+
+        sources = sorted(dispatcher_config.dispatcher_sources)
+        processes = max(1, min(dispatcher_config.general_processes, len(sources)))
+        self.__shards = [sources[shard::processes] for shard in range(processes)]
+        self.__processes = [None] * processes
+        self.__restart_delays = [0] * processes
+        self.__restart_times = [0] * processes
+        # shard -> last statistics received
+        self.__stats = {}
+
+        self.__stopping = threading.Event()
+        self.__log_forwarder = threading.Thread(target=self.__forward_logs, name="ShardLogForwarder", daemon=True)
+
+    def __spawn(self, shard: int) -> None:
+        process = self.__context.Process(
+            target=ShardSupervisor._run_shard,
+            args=(shard, self.__config_file, self.__shards[shard], self.__log_queue, self.__stats_queue),
+            name=f"Shard-{shard}",
+            daemon=False
+        )
+        process.start()
+        self.__processes[shard] = process
+        ShardSupervisor.__LOG.info("Started shard %s (pid %s) for sources %s", shard, process.pid, self.__shards[shard])
+
+    def recover_journals(self) -> None:
+        """
+        Replay journals which no shard replays (left by a previous run with more processes, or a single one).
+        Journals which can not be replayed are kept, to be replayed at the next start
+        """
+        journal_file = self.__dispatcher_config.general_journal_file
+        if journal_file is None:
+            return
+        journal_files = DispatchJournal.orphans(journal_file, len(self.__shards))
+        if len(journal_files) == 0:
+            return
+
+        config = self.__dispatcher_config
+        dispatcher = FileDispatcher(
+            RuleBuilder.build_index(
+                config.dispatcher_rules,
+                config.dispatcher_formats,
+                config.dispatcher_sources,
+                config.dispatcher_destinations,
+                config.dispatcher_sources_recursive
+            ),
+            CopyEngine.build(
+                config.general_copy_strategies,
+                config.general_copy_buffer,
+                config.general_copy_fan_out_threads,
+                StagingArea(config.general_tmp)
+            )
+        )
+        try:
+            for journal_file in journal_files:
+                try:
+                    recovered = dispatcher.recover_journal(journal_file)
+                except Exception as e:
+                    ShardSupervisor.__LOG.error("Journal '%s' not replayed: %s", journal_file, e)
+                    ShardSupervisor.__LOG.debug("Journal '%s' not replayed", journal_file, exc_info=True)
+                    continue
+                ShardSupervisor.__LOG.info(
+                    "Journal '%s' replay: %s", journal_file, ", ".join(f"{n} {outcome}" for outcome, n in recovered.items())
+                )
+        finally:
+            dispatcher.shutdown()
+
+    def __forward_logs(self) -> None:
+        while True:
+            record = self.__log_queue.get()
+            if record is None:
+                return
+            logging.getLogger(record.name).handle(record)
+
+    def __monitor(self) -> None:
+        now = time.monotonic()
+        for shard, process in enumerate(self.__processes):
+            if process.is_alive() or self.__stopping.is_set():
+                continue
+
+            if self.__restart_times[shard] == 0:
+                self.__restart_delays[shard] = min(
+                    max(self.__restart_delays[shard] * 2, ShardSupervisor.RESTART_DELAY_MIN),
+                    ShardSupervisor.RESTART_DELAY_MAX
+                )
+                self.__restart_times[shard] = now + self.__restart_delays[shard]
+                ShardSupervisor.__LOG.warning(
+                    "Shard %s exited with code %s, restarting in %ss",
+                    shard,
+                    process.exitcode,
+                    self.__restart_delays[shard]
+                )
+            elif now >= self.__restart_times[shard]:
+                self.__restart_times[shard] = 0
+                self.__spawn(shard)
+
+    def __collect_stats(self, timeout: float) -> None:
+        try:
+            shard, stats = self.__stats_queue.get(timeout=timeout)
+            self.__stats[shard] = stats
+            # a shard reporting statistics is healthy
+            self.__restart_delays[shard] = 0
+        except queue.Empty:
+            pass
+
+    def stats(self) -> Dict[str, int]:
+        aggregated = {}
+        for stats in list(self.__stats.values()):
+            for key, value in stats.items():
+                aggregated[key] = aggregated.get(key, 0) + value
+        return aggregated
+
+    @property
+    def shards(self) -> List[List[str]]:
+        """
+        :return: keys of the sources of each shard
+        """
+        return self.__shards
+
+    def __forward_signal(self, signum, frame) -> None:
+        for process in self.__processes:
+            if process is not None and process.is_alive():
+                os.kill(process.pid, signum)
+
+    def start(self) -> None:
+        ShardSupervisor.__LOG.info("*** START *** supervising %s shards", len(self.__shards))
+        try:
+            signal.signal(signal.SIGHUP, self.__forward_signal)
+        except ValueError:
+            ShardSupervisor.__LOG.debug("Configuration reload on signal disabled: signals are handled only by the main thread")
+        self.__log_forwarder.start()
+        # files of interrupted dispatches may be in sources of any shard
+        self.recover_journals()
+        for shard in range(len(self.__shards)):
+            self.__spawn(shard)
+
+        last_report = time.monotonic()
+        try:
+            while not self.__stopping.is_set():
+                self.__collect_stats(ShardSupervisor.MONITOR_INTERVAL)
+                self.__monitor()
+                if time.monotonic() - last_report >= ShardSupervisor.STATS_INTERVAL:
+                    last_report = time.monotonic()
+                    ShardSupervisor.__LOG.info("Shards statistics: %s", self.stats())
+        except KeyboardInterrupt:
+            pass
+
+    def stop(self) -> None:
+        if self.__stopping.is_set():
+            return
+        self.__stopping.set()
+        ShardSupervisor.__LOG.info("*** STOP *** supervising")
+
+        for process in self.__processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for shard, process in enumerate(self.__processes):
+            if process is None:
+                continue
+            process.join(ShardSupervisor.STOP_TIMEOUT)
+            if process.is_alive():
+                ShardSupervisor.__LOG.warning("Shard %s not stopped in %ss, killing it", shard, ShardSupervisor.STOP_TIMEOUT)
+                process.kill()
+                process.join()
+
+        # statistics sent by shards while stopping
+        while True:
+            try:
+                shard, stats = self.__stats_queue.get_nowait()
+                self.__stats[shard] = stats
+            except queue.Empty:
+                break
+        ShardSupervisor.__LOG.info("Shards statistics: %s", self.stats())
+
+        self.__log_queue.put(None)
+        if self.__log_forwarder.is_alive():
+            self.__log_forwarder.join()
+        LogManager.get_instance().shutdown()
+
+    @staticmethod
+    def _run_shard(shard: int, config_file: str, sources: List[str],
+                   log_queue: multiprocessing.Queue, stats_queue: multiprocessing.Queue) -> None:
+        """
+        Entry point of shard processes
+        """
+        from control.FileObserver import FileObserver
+
+        # supervisor handles interruptions and stops shards with SIGTERM
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, ShardSupervisor.__interrupt)
+
+        dispatcher_config = DispatcherConfig.get_instance()
+        dispatcher_config.load_from(config_file)
+        LogManager.get_instance().load_queue(log_queue, LogManager.level(dispatcher_config.log_filename))
+        dispatcher_config.shard(sources, shard)
+
+        file_observer = FileObserver(dispatcher_config)
+
+        def report() -> None:
+            while True:
+                time.sleep(ShardSupervisor.STATS_INTERVAL)
+                stats_queue.put((shard, file_observer.stats()))
+
+        threading.Thread(target=report, name="ShardStats", daemon=True).start()
+        try:
+            # Blocking call
+            file_observer.start()
+        finally:
+            stats = file_observer.stats()
+            file_observer.stop()
+            stats_queue.put((shard, stats))
+
+    @staticmethod
+    def __interrupt(signum, frame) -> None:
+        raise KeyboardInterrupt
@@ -1,7 +1,15 @@
 from control.FileEventHandler import FileEventHandler
+from control.InotifyObserver import InotifyObserver
+from control.MetricsServer import MetricsServer
+from control.Profiler import Profiler
 from control.FileObserver import FileObserver
+from control.ShardSupervisor import ShardSupervisor
 
 __all__ = [
     "FileEventHandler",
-    "FileObserver"
+    "InotifyObserver",
+    "MetricsServer",
+    "Profiler",
+    "FileObserver",
+    "ShardSupervisor"
 ]
@@ -1,9 +1,9 @@
-import time
 from abc import ABC
-from os.path import getsize
+from typing import Tuple
 
 from control.dispatcher import IDispatcher
 from model import File
+from util import StageHooks
 
 
 class BaseDispatcher(ABC, IDispatcher):
@@ -18,36 +18,32 @@ class BaseDispatcher(ABC, IDispatcher):
         DO NOT EDIT OR OVERRIDE THIS METHOD
         :param file: object which encapsulates information for file
         """
-        self.prepare(file)
-
-        try:
-            self.dispatch(file)
-        except Exception as e:
-            return self.on_error(file, e)
+        with StageHooks.stage(StageHooks.DISPATCH, file.filename) as context:
+            self.prepare(file)
+
+            try:
+                self.dispatch(file)
+            except Exception as e:
+                # errors are handled here, so they do not reach the stage
+                if context is not None:
+                    context.error = e
+                    context.labels["rules"] = self.rule_names(file)
+                return self.on_error(file, e)
 
         return self.on_success(file)
 
     def prepare(self, file: File) -> None:
         pass
 
+    def rule_names(self, file: File) -> Tuple[str, ...]:
+        """
+        :return: names of the rules matching file, used to label errors
+        """
+        return ()
+
     def on_error(self, file: File = None,
                  exception: Exception = None) -> None:
         pass
 
     def on_success(self, file: File = None) -> None:
         pass
-
-    @classmethod
-    def _wait_file(cls, file: File,
-                   poll_time: float = TRANSFER_DATA_POLL) -> None:
-        """
-        This function blocks until file is not completely transferred on disk
-        This action is mandatory on low speed network, otherwise file could be
-         read even if it is not completely transferred on the server
-        :param file: object to obtain filename
-        :param poll_time: poll time
-        """
-        size = -1
-        while size != getsize(file.filename):
-            size = getsize(file.filename)
-            time.sleep(poll_time)
@@ -0,0 +1,341 @@
+import itertools
+import json
+import os
+import threading
+import zlib
+from typing import Callable, Dict, List
+
+from util import LogManager
+
+
+class DispatchJournal(object):
+    """
+    Append-only journal of dispatches, so dispatches interrupted by a crash (e.g. between
+        the copy of a file and the removal of its source) are completed or rolled back
+        at the next start (see replay()).
+
+    For each dispatch, records are appended for its intent (source and target filenames),
+        for each target written and for the removal of its source.
+    Records are written and fsynced in groups by a single writer thread: a dispatch waits
+        only for its intent to be durable, sharing the fsync with all the records appended
+        meanwhile (group commit), while the following records of a dispatch are made
+        durable by the next group.
+    Each record is prefixed by its CRC32, so a record torn by a crash is detected and ignored.
+    The journal is compacted, keeping only open dispatches, after replay and whenever it
+        grows over compact_size.
+    """
+
+    __LOG = None
+
+    INTENT = "I"
+    WRITTEN = "W"
+    REMOVED = "R"
+    ABORTED = "A"
+
+    DEFAULT_COMPACT_SIZE = 16 * 1024 * 1024
+
+    class Entry(object):
+        """
+        Open dispatch
+        """
+
+        __slots__ = ("source", "size", "mtime", "targets", "written")
+
+        def __init__(self, source: str, size: int, mtime: int, targets: List[str]):
+            self.source = source
+            self.size = size
+            self.mtime = mtime
+            self.targets = targets
+            self.written = set()
+
+    def __init__(self, filename: str, compact_size: int = DEFAULT_COMPACT_SIZE):
+        """
+
+        :param filename: journal file, dispatches left open by a previous run are loaded from it
+        :param compact_size: size (bytes) over which the journal is compacted
+        """
+        super().__init__()
+
+        DispatchJournal.__LOG = LogManager.get_instance().get(LogManager.Logger.DISPATCHER)
+        self.__filename = filename
+        self.__compact_size = compact_size
+        # dispatch id -> Entry
+        self.__open = {}
+        self.__size = 0
+        self.__records = 0
+        self.__commits = 0
+
+        last_id = self.__load()
+        self.__ids = itertools.count(last_id + 1)
+        self.__file = open(filename, "ab", buffering=0)
+        self.__size = self.__file.seek(0, os.SEEK_END)
+
+        self.__lock = threading.Lock()
+        # signaled when records are appended and when they are durable
+        self.__appended = threading.Condition(self.__lock)
+        self.__committed = threading.Condition(self.__lock)
+        self.__pending = []
+        # sequence numbers of the last record appended and of the last one durable
+        self.__sequence = 0
+        self.__durable = 0
+        self.__compaction = False
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__run, name=self.__class__.__name__, daemon=True)
+        self.__thread.start()
+
+    @staticmethod
+    def __encode(record: list) -> bytes:
+        payload = json.dumps(record, separators=(",", ":")).encode("utf-8")
+        return b"%08x %s\n" % (zlib.crc32(payload), payload)
+
+    @staticmethod
+    def __decode(line: bytes) -> list:
+        """
+        :raise ValueError if line is torn or corrupted
+        """
+        crc, _, payload = line.rstrip(b"\n").partition(b" ")
+        if not line.endswith(b"\n") or int(crc, 16) != zlib.crc32(payload):
+            raise ValueError("checksum mismatch")
+        return json.loads(payload.decode("utf-8"))
+
+    def __load(self) -> int:
+        """
+        :return: greatest dispatch id found
+        """
+        last_id = 0
+        try:
+            with open(self.__filename, "rb") as file:
+                for number, line in enumerate(file, 1):
+                    try:
+                        record = DispatchJournal.__decode(line)
+                    except ValueError as e:
+                        # records after a torn one were never acknowledged
+                        DispatchJournal.__LOG.warning("Journal '%s' truncated at record %s: %s", self.__filename, number, e)
+                        break
+                    last_id = max(last_id, record[1])
+                    self.__apply(record)
+        except FileNotFoundError:
+            pass
+        return last_id
+
+    def __apply(self, record: list) -> None:
+        kind, dispatch_id = record[0], record[1]
+        if kind == DispatchJournal.INTENT:
+            self.__open[dispatch_id] = DispatchJournal.Entry(*record[2:])
+        elif kind == DispatchJournal.WRITTEN:
+            entry = self.__open.get(dispatch_id)
+            if entry is not None:
+                entry.written.add(record[2])
+        else:
+            self.__open.pop(dispatch_id, None)
+
+    def __append(self, record: list, durable: bool = False) -> None:
+        data = DispatchJournal.__encode(record)
+        with self.__lock:
+            self.__apply(record)
+            self.__pending.append(data)
+            self.__sequence += 1
+            sequence = self.__sequence
+            self.__appended.notify()
+            if durable:
+                while self.__durable < sequence and self.__running:
+                    self.__committed.wait()
+
+    def begin(self, source: str, stat: os.stat_result, targets: List[str]) -> int:
+        """
+        Record the intent of dispatching source to targets, returning once it is durable
+        :param source: filename to dispatch
+        :param stat: status of source
+        :param targets: filenames source is going to be written to
+        :return: dispatch id
+        """
+        dispatch_id = next(self.__ids)
+        self.__append(
+            [DispatchJournal.INTENT, dispatch_id, source, stat.st_size, stat.st_mtime_ns, list(targets)],
+            durable=True
+        )
+        return dispatch_id
+
+    def written(self, dispatch_id: int, targets: List[str]) -> None:
+        for target in targets:
+            self.__append([DispatchJournal.WRITTEN, dispatch_id, target])
+
+    def removed(self, dispatch_id: int) -> None:
+        """
+        Record the removal (or the move into its last target) of the source: dispatch is complete
+        """
+        self.__append([DispatchJournal.REMOVED, dispatch_id])
+
+    def abort(self, dispatch_id: int) -> None:
+        """
+        Record that dispatch failed, leaving its source in place
+        """
+        self.__append([DispatchJournal.ABORTED, dispatch_id])
+
+    def __run(self) -> None:
+        # journal file is written, and replaced by compaction, only by this thread
+        while True:
+            with self.__lock:
+                while self.__running and len(self.__pending) == 0 and not self.__compaction:
+                    self.__appended.wait()
+                if len(self.__pending) == 0 and not self.__compaction:
+                    return
+                pending, self.__pending = self.__pending, []
+                sequence = self.__sequence
+
+            data = b"".join(pending)
+            if len(data) > 0:
+                try:
+                    self.__file.write(data)
+                    DispatchJournal.__sync(self.__file.fileno())
+                except OSError as e:
+                    DispatchJournal.__LOG.error("Journal '%s' not written, interrupted dispatches may not be recovered: %s", self.__filename, e)
+
+            with self.__lock:
+                if len(data) > 0:
+                    self.__size += len(data)
+                    self.__records += len(pending)
+                    self.__commits += 1
+                    self.__durable = sequence
+                if self.__compaction or self.__size > self.__compact_size:
+                    self.__compact()
+                    self.__compaction = False
+                self.__committed.notify_all()
+
+    def __compact(self) -> None:
+        """
+        Rewrite journal with open dispatches only (lock held, by the writer thread:
+            appended records are already applied to open dispatches, so pending ones are dropped)
+        """
+        records = []
+        for dispatch_id, entry in self.__open.items():
+            records.append(DispatchJournal.__encode(
+                [DispatchJournal.INTENT, dispatch_id, entry.source, entry.size, entry.mtime, entry.targets]
+            ))
+            records.extend(DispatchJournal.__encode([DispatchJournal.WRITTEN, dispatch_id, target]) for target in entry.written)
+        data = b"".join(records)
+
+        staged = f"{self.__filename}.{os.getpid()}.tmp"
+        try:
+            with open(staged, "wb", buffering=0) as file:
+                file.write(data)
+                os.fsync(file.fileno())
+            os.replace(staged, self.__filename)
+            DispatchJournal.__fsync_directory(os.path.dirname(os.path.abspath(self.__filename)))
+        except OSError as e:
+            DispatchJournal.__LOG.error("Journal '%s' not compacted: %s", self.__filename, e)
+            return
+
+        self.__file.close()
+        self.__file = open(self.__filename, "ab", buffering=0)
+        self.__pending.clear()
+        self.__size = len(data)
+        self.__durable = self.__sequence
+        DispatchJournal.__LOG.debug("Journal '%s' compacted: %s open dispatches", self.__filename, len(self.__open))
+
+    @staticmethod
+    def __sync(fd: int) -> None:
+        # appended data and file size only: other metadata is not needed to replay
+        if hasattr(os, "fdatasync"):
+            os.fdatasync(fd)
+        else:
+            os.fsync(fd)
+
+    @staticmethod
+    def __fsync_directory(directory: str) -> None:
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def replay(self, resume: Callable[[str, List[str]], None]) -> Dict[str, int]:
+        """
+        Complete or roll back dispatches left open by a previous run, then compact the journal:
+            - source removed: dispatch completed (its source was moved into its last target)
+            - source unchanged: targets not written yet are written by resume and source is removed;
+              if resume fails, targets already written are removed (source keeps the content)
+            - source changed: it is a new file, to be dispatched again; targets are kept
+        :param resume: called with source and targets not written yet, writes them and removes source
+        :return: number of dispatches for each outcome
+        """
+        with self.__lock:
+            interrupted = list(self.__open.items())
+        outcomes = {"completed": 0, "resumed": 0, "rolled back": 0}
+
+        for dispatch_id, entry in interrupted:
+            try:
+                stat = os.stat(entry.source, follow_symlinks=False)
+            except FileNotFoundError:
+                outcomes["completed"] += 1
+                continue
+
+            if (stat.st_size, stat.st_mtime_ns) != (entry.size, entry.mtime):
+                DispatchJournal.__LOG.info("[ROLLBACK] '%s': changed since interrupted dispatch", entry.source)
+                outcomes["rolled back"] += 1
+                continue
+
+            pending = [target for target in entry.targets if target not in entry.written]
+            DispatchJournal.__LOG.info("[RESUMING] '%s' to '%s'", entry.source, pending)
+            try:
+                resume(entry.source, pending)
+                outcomes["resumed"] += 1
+            except Exception as e:
+                DispatchJournal.__LOG.warning("[ROLLBACK] '%s': interrupted dispatch not resumed: %s", entry.source, e)
+                for target in entry.written:
+                    try:
+                        os.unlink(target)
+                    except FileNotFoundError:
+                        pass
+                outcomes["rolled back"] += 1
+
+        with self.__lock:
+            for dispatch_id, _ in interrupted:
+                self.__open.pop(dispatch_id, None)
+            self.__compaction = True
+            self.__appended.notify()
+            while self.__compaction and self.__running:
+                self.__committed.wait()
+        return outcomes
+
+    @staticmethod
+    def orphans(filename: str, shards: int = 0) -> List[str]:
+        """
+        Journals which no process replays, left by a previous run with a different
+            number of processes (see DispatcherConfig.shard())
+        :param filename: configured journal file
+        :param shards: number of processes journaling to filename suffixed by their shard number,
+            0 if a single process journals to filename
+        :return: journal files, in order
+        """
+        orphans = [filename] if shards > 0 and os.path.isfile(filename) else []
+        directory, name = os.path.split(os.path.abspath(filename))
+        try:
+            entries = os.listdir(directory)
+        except FileNotFoundError:
+            return orphans
+
+        numbers = []
+        for entry in entries:
+            prefix, _, suffix = entry.rpartition(".")
+            if prefix == name and suffix.isdigit() and int(suffix) >= shards:
+                numbers.append(int(suffix))
+        return orphans + [f"{filename}.{number}" for number in sorted(numbers)]
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__running = False
+            self.__appended.notify()
+        self.__thread.join()
+        self.__file.close()
+        DispatchJournal.__LOG.debug(
+            "Journal '%s': %s records in %s commits, %s open dispatches",
+            self.__filename, self.__records, self.__commits, len(self.__open)
+        )
+
+    @property
+    def filename(self) -> str:
+        return self.__filename
+
+    def __len__(self):
+        return len(self.__open)
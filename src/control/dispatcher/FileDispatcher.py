@@ -1,56 +1,318 @@
-from typing import List
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
 
-from control.dispatcher import BaseDispatcher
-from model import File, Rule
-from util import LogManager
+from control.dispatcher import BaseDispatcher, DispatchJournal
+from control.transfer import CopyEngine, FingerprintCache
+from model import File, Rule, RuleIndex
+from util import LogManager, StageHooks
 
 
 class FileDispatcher(BaseDispatcher):
     """
+    Dispatches files to the destinations of matching rules.
 
+    Destinations on the same device of the file are served by metadata-only
+        operations (hard links and a final rename); file content is copied,
+        by a CopyEngine, only to destinations on other devices.
+    With a FingerprintCache, destinations already holding an identical file are skipped.
+    With a DispatchJournal, each dispatch is journaled, so it can be completed (or
+        rolled back) after a crash (see recover()).
+    Dispatches of a batch (see batch()) share destination directories, each one
+        opened once and synced once at the end of the batch.
     """
 
     __LOG = None
 
-    def __init__(self, rules: List[Rule]):
+    def __init__(self, rules: RuleIndex, copy_engine: CopyEngine = None,
+                 fingerprints: FingerprintCache = None, journal: DispatchJournal = None):
         super().__init__()
 
         FileDispatcher.__LOG = LogManager.get_instance().get(LogManager.Logger.DISPATCHER)
         self.__rules = rules
+        self.__copy_engine = copy_engine or CopyEngine.build()
+        self.__fingerprints = fingerprints
+        self.__journal = journal
+        # destination directory -> device id
+        self.__devices = {}
+        # directories of the batch being dispatched by each thread
+        self.__local = threading.local()
 
         if len(rules) == 0:
             FileDispatcher.__LOG.warning("No rule specified. All files will be skipped.")
 
-    def prepare(self, file: File) -> None:
-        super().prepare(file)
-        super()._wait_file(file)
+    def set_rules(self, rules: RuleIndex) -> None:
+        """
+        Replace rules: files being dispatched keep the rules they were matched with
+        """
+        self.__rules = rules
 
     def dispatch(self, file: File) -> None:
-        FileDispatcher.__LOG.info(f"[DISPATCHING] '{file.filename}'")
+        FileDispatcher.__LOG.info("[DISPATCHING] '%s'", file.filename)
+
+        with StageHooks.stage(StageHooks.MATCH, file.filename):
+            destinations, subdirectory = self.__rules.match(file.filename, file)
+        if len(destinations) > 0:  # if file matches a rule, move it
+            self.__move(file, destinations, subdirectory)
+        else:
+            FileDispatcher.__LOG.debug("[SKIPPING] '%s': not match any rule", file.filename)
+
+    def __move(self, file: File, destinations: Sequence[str], subdirectory: str = "") -> None:
+        stat = os.stat(file.filename, follow_symlinks=False)
+        # sub directories are assumed to be on the device of their destination
+        local_roots = [dst for dst in destinations if self.__device(dst) == stat.st_dev]
+        foreign_roots = [dst for dst in destinations if dst not in local_roots]
+        local = FileDispatcher.__subdirectories(local_roots, subdirectory)
+        foreign = FileDispatcher.__subdirectories(foreign_roots, subdirectory)
+
+        digest = None
+        if self.__fingerprints is not None:
+            identical, digest = self.__fingerprints.identical(
+                file.filename,
+                [f"{destination}/{file.file}" for destination in local + foreign]
+            )
+            if len(identical) > 0:
+                FileDispatcher.__LOG.info("[SKIPPING] '%s': identical to '%s'", file.filename, sorted(identical))
+                kept = [(root, dst) for root, dst in zip(local_roots, local) if f"{dst}/{file.file}" not in identical]
+                local_roots, local = [root for root, _ in kept], [dst for _, dst in kept]
+                kept = [(root, dst) for root, dst in zip(foreign_roots, foreign) if f"{dst}/{file.file}" not in identical]
+                foreign_roots, foreign = [root for root, _ in kept], [dst for _, dst in kept]
+
+        if self.__journal is None:
+            self.__transfer(file, stat, local_roots, local, foreign_roots, foreign, digest)
+            return
+
+        dispatch_id = self.__journal.begin(file.filename, stat, [f"{destination}/{file.file}" for destination in foreign + local])
+        try:
+            self.__transfer(file, stat, local_roots, local, foreign_roots, foreign, digest, dispatch_id)
+        except Exception:
+            self.__journal.abort(dispatch_id)
+            raise
+
+    def __transfer(self, file: File, stat: os.stat_result, local_roots: List[str], local: List[str],
+                   foreign_roots: List[str], foreign: List[str], digest: str = None, dispatch_id: int = None) -> None:
+        """
+        Write file into local (by links and a final rename) and foreign (by copies) destinations
+        :param dispatch_id: journal id of the dispatch, None if not journaled
+        """
+        # content is still needed by copies, so they are performed first
+        if len(foreign) > 0:
+            FileDispatcher.__LOG.debug("[COPYING] '%s' to '%s'", file.filename, foreign)
+            self.__copy(file, foreign, foreign_roots, stat.st_size)
+            self.__written(file, foreign, dispatch_id)
+            for destination in foreign:
+                self.__directory(destination, open_fd=False)
+            if digest is not None:
+                for destination in foreign:
+                    self.__fingerprints.store(f"{destination}/{file.file}", digest)
 
-        copied = False  # indicates that input file has been copied at least in one destination
-        for rule in self.__rules:
-            if file.match_rule(rule):
-                FileDispatcher.__LOG.debug(f"[COPYING] '{file.filename}' to '{rule.destinations}")
-                file.copy_to(rule.destinations)
-                copied |= len(rule.destinations) > 0
+        if len(local) == 0:
+            self.__delete(file, dispatch_id)
+            return
 
-        if copied:  # if file matches a rule, remove it
-            FileDispatcher.__LOG.debug(f"[REMOVING] '{file.filename}'")
+        for root, destination in zip(local_roots[:-1], local[:-1]):
+            FileDispatcher.__LOG.debug("[LINKING] '%s' to '%s'", file.filename, destination)
+            try:
+                with StageHooks.stage(StageHooks.LINK, file.filename, destination=root):
+                    file.link_to(destination, self.__stage(destination, file), self.__directory(destination))
+            except OSError:
+                # e.g. file system without hard links support or bind mounts
+                FileDispatcher.__LOG.debug("[COPYING] '%s' to '%s': link failed", file.filename, destination, exc_info=True)
+                self.__copy(file, [destination], [root], stat.st_size)
+            self.__written(file, [destination], dispatch_id)
+
+        FileDispatcher.__LOG.debug("[MOVING] '%s' to '%s'", file.filename, local[-1])
+        try:
+            with StageHooks.stage(StageHooks.MOVE, file.filename, destination=local_roots[-1]):
+                file.move_to(local[-1], self.__directory(local[-1]))
+                self.__directory(file.source, open_fd=False)
+        except OSError:
+            FileDispatcher.__LOG.debug("[COPYING] '%s' to '%s': rename failed", file.filename, local[-1], exc_info=True)
+            self.__devices.pop(local_roots[-1], None)
+            self.__copy(file, [local[-1]], [local_roots[-1]], stat.st_size)
+            self.__written(file, [local[-1]], dispatch_id)
+            self.__delete(file, dispatch_id)
+            return
+        if dispatch_id is not None:
+            # source has been renamed into its last destination
+            self.__journal.removed(dispatch_id)
+
+    def __copy(self, file: File, destinations: List[str], roots: List[str], size: int) -> None:
+        """
+        :param destinations: directories to copy file into
+        :param roots: configured destinations of directories, used to label stages
+        :param size: size of file
+        """
+        if not StageHooks.active():
+            file.copy_to(destinations, self.__copy_engine.copy_many)
+            return
+
+        # destinations are copied together, so they share timing
+        start = time.perf_counter()
+        error = None
+        try:
+            file.copy_to(destinations, self.__copy_engine.copy_many)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            for root in roots:
+                StageHooks.emit(StageHooks.COPY, file.filename, elapsed, error, destination=root, bytes=size)
+
+    def __delete(self, file: File, dispatch_id: int = None) -> None:
+        FileDispatcher.__LOG.debug("[REMOVING] '%s'", file.filename)
+        with StageHooks.stage(StageHooks.DELETE, file.filename):
             file.delete()
-        else:
-            FileDispatcher.__LOG.debug(f"[SKIPPING] '{file.filename}': not match any rule")
+        self.__directory(file.source, open_fd=False)
+        if dispatch_id is not None:
+            self.__journal.removed(dispatch_id)
+
+    @contextmanager
+    def batch(self):
+        """
+        Dispatches performed by this thread in the context share destination directories
+            (see FileDispatcher.Directories)
+        """
+        directories = self.__local.directories = FileDispatcher.Directories()
+        try:
+            yield
+        finally:
+            self.__local.directories = None
+            directories.close()
+
+    def __directory(self, directory: str, open_fd: bool = True) -> int:
+        """
+        Record that directory is modified by the batch being dispatched, if any
+        :param open_fd: whether the descriptor of directory is needed
+        :return: descriptor of directory, None if not dispatching a batch
+        """
+        directories = getattr(self.__local, "directories", None)
+        if directories is None:
+            return None
+        directories.modified(directory)
+        return directories.fd(directory) if open_fd else None
+
+    def __written(self, file: File, destinations: List[str], dispatch_id: int = None) -> None:
+        if dispatch_id is not None:
+            self.__journal.written(dispatch_id, [f"{destination}/{file.file}" for destination in destinations])
+
+    def resume(self, filename: str, targets: List[str]) -> None:
+        """
+        Complete an interrupted dispatch (see DispatchJournal.replay())
+        :param filename: file to dispatch
+        :param targets: filenames file has still to be written to
+        """
+        self.__move(File(filename), [os.path.dirname(target) for target in targets])
+
+    def recover(self) -> Dict[str, int]:
+        """
+        Complete or roll back dispatches interrupted by a crash, before dispatching new files
+        :return: number of interrupted dispatches for each outcome, None if dispatches are not journaled
+        """
+        if self.__journal is None:
+            return None
+        return self.__journal.replay(self.resume)
+
+    def recover_journal(self, filename: str) -> Dict[str, int]:
+        """
+        Replay a journal left by a process not running anymore (see DispatchJournal.orphans()), then remove it
+        :param filename: journal file
+        :return: number of interrupted dispatches for each outcome
+        """
+        journal = DispatchJournal(filename)
+        try:
+            recovered = journal.replay(self.resume)
+        finally:
+            journal.close()
+        os.unlink(filename)
+        return recovered
+
+    @staticmethod
+    def __subdirectories(destinations: List[str], subdirectory: str) -> List[str]:
+        if not subdirectory:
+            return destinations
+
+        subdirectories = [os.path.join(destination, subdirectory) for destination in destinations]
+        for directory in subdirectories:
+            os.makedirs(directory, exist_ok=True)
+        return subdirectories
+
+    def __stage(self, destination: str, file: File) -> str:
+        staging = self.__copy_engine.staging
+        return None if staging is None else staging.stage(f"{destination}/{file.file}")
+
+    def __device(self, destination: str) -> int:
+        device = self.__devices.get(destination)
+        if device is None:
+            device = self.__devices[destination] = os.stat(destination).st_dev
+        return device
+
+    def rule_names(self, file: File) -> Tuple[str, ...]:
+        return self.__rules.rule_names(file.filename, file)
 
     def on_success(self, file: File = None) -> None:
         super().on_success(file)
-        FileDispatcher.__LOG.debug(f"[DISPATCH SUCCESS] '{file.filename}'")
+        FileDispatcher.__LOG.debug("[DISPATCH SUCCESS] '%s'", file.filename)
 
     def on_error(self, file: File = None,
                  exception: Exception = None) -> None:
         super().on_error(file, exception)
-        FileDispatcher.__LOG.warning(f"[DISPATCH ERROR] '{file.filename}'")
+        FileDispatcher.__LOG.warning("[DISPATCH ERROR] '%s'", file.filename)
         FileDispatcher.__LOG.debug("[DISPATCH ERROR]", exc_info=True)
 
+    def shutdown(self) -> None:
+        self.__copy_engine.shutdown()
+        if self.__fingerprints is not None:
+            self.__fingerprints.save()
+        if self.__journal is not None:
+            self.__journal.close()
+
     @property
     def rules(self) -> List[Rule]:
-        return self.__rules
+        return self.__rules.rules
+
+    class Directories(object):
+        """
+        Directories modified by a batch of dispatches: each one is opened once, so names
+            are resolved relative to its descriptor (openat style) instead of walking its
+            path for every file, and synced once when the batch ends, making its new
+            entries durable.
+        """
+
+        # descriptors are used only where links and renames accept them (e.g. not on Windows),
+        #  os.replace is not listed but shares the implementation of os.rename
+        SUPPORTED = os.link in os.supports_dir_fd and os.rename in os.supports_dir_fd
+
+        def __init__(self):
+            # directory -> descriptor
+            self.__fds = {}
+            self.__modified = {}
+
+        def fd(self, directory: str) -> int:
+            return self.__open(directory) if FileDispatcher.Directories.SUPPORTED else None
+
+        def __open(self, directory: str) -> int:
+            fd = self.__fds.get(directory)
+            if fd is None:
+                fd = self.__fds[directory] = os.open(directory, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+            return fd
+
+        def modified(self, directory: str) -> None:
+            self.__modified[directory] = None
+
+        def close(self) -> None:
+            try:
+                for directory in self.__modified:
+                    try:
+                        os.fsync(self.__open(directory))
+                    except OSError as e:
+                        # e.g. directories which can not be opened or synced (Windows)
+                        LogManager.get_instance().get(LogManager.Logger.DISPATCHER).debug("Directory '%s' not synced: %s", directory, e)
+            finally:
+                for fd in self.__fds.values():
+                    os.close(fd)
+                self.__fds.clear()
+                self.__modified.clear()
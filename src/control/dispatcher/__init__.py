@@ -2,10 +2,12 @@ from control.dispatcher.IDispatcher import IDispatcher
 
 from control.dispatcher.BaseDispatcher import BaseDispatcher
 
+from control.dispatcher.DispatchJournal import DispatchJournal
 from control.dispatcher.FileDispatcher import FileDispatcher
 
 __all__ = [
     "IDispatcher",
     "BaseDispatcher",
+    "DispatchJournal",
     "FileDispatcher"
 ]
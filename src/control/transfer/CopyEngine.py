@@ -0,0 +1,181 @@
+import os
+from typing import List
+
+from control.transfer.CopyStrategy import CopyStrategy, ReflinkCopy, CopyFileRangeCopy, SendfileCopy, UserspaceCopy
+from control.transfer.FanOutWriter import FanOutWriter
+from control.transfer.StagingArea import StagingArea
+from util import LogManager, Validation
+
+
+class CopyEngine(object):
+    """
+    This class copies files choosing, for each (source device, destination device) pair,
+        the best available CopyStrategy.
+
+    Strategies are tried in order of preference and the first one which succeeds
+        is remembered for the pair, so probing cost is paid only once.
+    Copies of a file to several destinations are done by a FanOutWriter, which reads
+        the file only once, unless destinations can be cloned.
+    Destinations are written through a StagingArea, if specified, and published atomically.
+    """
+
+    __LOG = None
+
+    STRATEGIES = {
+        ReflinkCopy.NAME: ReflinkCopy,
+        CopyFileRangeCopy.NAME: CopyFileRangeCopy,
+        SendfileCopy.NAME: SendfileCopy,
+        UserspaceCopy.NAME: UserspaceCopy
+    }
+    DEFAULT_STRATEGIES = [ReflinkCopy.NAME, CopyFileRangeCopy.NAME, SendfileCopy.NAME, UserspaceCopy.NAME]
+
+    def __init__(self, strategies: List[CopyStrategy], fan_out: FanOutWriter = None,
+                 staging: StagingArea = None):
+        super().__init__()
+
+        CopyEngine.__LOG = LogManager.get_instance().get(LogManager.Logger.DISPATCHER)
+        self.__strategies = [strategy for strategy in strategies if strategy.available()]
+        Validation.is_true(len(self.__strategies) > 0, "No copy strategy available on this platform")
+        # (source device, destination device) -> strategy
+        self.__choices = {}
+        self.__fan_out = fan_out or FanOutWriter()
+        self.__staging = staging
+
+    @classmethod
+    def build(cls, names: List[str] = None,
+              buffer_size: int = UserspaceCopy.DEFAULT_BUFFER_SIZE, fan_out_threads: int = 0,
+              staging: StagingArea = None) -> "CopyEngine":
+        """
+
+        :param names: names of strategies, in order of preference
+            (userspace strategy is always used as last resort)
+        :param buffer_size: buffer size for userspace strategy and fan-out copies
+        :param fan_out_threads: threads writing a chunk to destinations in parallel,
+            0 to write sequentially
+        :param staging: staging area for atomic writes, None to write destinations in place
+        :raise KeyError if a strategy name is unknown
+        """
+        names = list(names or cls.DEFAULT_STRATEGIES)
+        if UserspaceCopy.NAME not in names:
+            names.append(UserspaceCopy.NAME)
+
+        strategies = []
+        for name in names:
+            Validation.key_exists(cls.STRATEGIES, name, f"Unknown copy strategy '{name}', available: {list(cls.STRATEGIES)}")
+            if name == UserspaceCopy.NAME:
+                strategies.append(UserspaceCopy(buffer_size))
+            else:
+                strategies.append(cls.STRATEGIES[name]())
+        return cls(strategies, FanOutWriter(buffer_size, fan_out_threads), staging)
+
+    def copy(self, src: str, dst: str) -> None:
+        """
+        Copy content of src to dst, which is created or replaced
+        :param src: source filename
+        :param dst: destination filename
+        """
+        self.copy_many(src, [dst])
+
+    def copy_many(self, src: str, dsts: List[str]) -> None:
+        """
+        Copy content of src to all dsts, which are created or replaced.
+        If a StagingArea is set, content is written to temporary files which are then
+            renamed to dsts, so dsts are never seen partially written
+        :param src: source filename
+        :param dsts: destination filenames
+        """
+        if self.__staging is None:
+            staged, flags = dsts, os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+        else:
+            staged, flags = [self.__staging.stage(dst) for dst in dsts], os.O_WRONLY | os.O_CREAT | os.O_EXCL
+
+        try:
+            dst_fds = []
+            src_fd = os.open(src, os.O_RDONLY)
+            try:
+                for filename in staged:
+                    dst_fds.append(os.open(filename, flags, 0o666))
+                if len(dst_fds) == 1:
+                    self.copy_fd(src_fd, dst_fds[0])
+                else:
+                    self.copy_fds(src_fd, dst_fds)
+            finally:
+                for dst_fd in dst_fds:
+                    os.close(dst_fd)
+                os.close(src_fd)
+
+            if self.__staging is not None:
+                for filename, dst in zip(staged, dsts):
+                    self.__staging.publish(filename, dst)
+        except BaseException:
+            if self.__staging is not None:
+                for filename in staged:
+                    self.__staging.discard(filename)
+            raise
+
+    def copy_fds(self, src_fd: int, dst_fds: List[int]) -> None:
+        """
+        Copy content of src_fd to all the empty dst_fds
+        :param src_fd: file descriptor opened for reading, positioned at offset 0
+        :param dst_fds: file descriptors opened for writing, positioned at offset 0
+        """
+        src_device = os.fstat(src_fd).st_dev
+        fan_out = []
+        for dst_fd in dst_fds:
+            chosen = self.__choices.get((src_device, os.fstat(dst_fd).st_dev))
+            # clones cost nothing and unknown device pairs must be probed
+            if chosen is None or isinstance(chosen, ReflinkCopy):
+                os.lseek(src_fd, 0, os.SEEK_SET)
+                self.copy_fd(src_fd, dst_fd)
+            else:
+                fan_out.append(dst_fd)
+
+        os.lseek(src_fd, 0, os.SEEK_SET)
+        if len(fan_out) == 1:
+            self.copy_fd(src_fd, fan_out[0])
+        elif len(fan_out) > 1:
+            self.__fan_out.copy_fd(src_fd, fan_out)
+
+    def copy_fd(self, src_fd: int, dst_fd: int) -> None:
+        """
+        Copy content of src_fd to the empty dst_fd
+        :param src_fd: file descriptor opened for reading, positioned at offset 0
+        :param dst_fd: file descriptor opened for writing, positioned at offset 0
+        """
+        src_stat = os.fstat(src_fd)
+        if src_stat.st_size == 0:
+            return
+
+        devices = (src_stat.st_dev, os.fstat(dst_fd).st_dev)
+        chosen = self.__choices.get(devices)
+        candidates = self.__strategies if chosen is None else \
+            [chosen] + [strategy for strategy in self.__strategies if strategy is not chosen]
+
+        for strategy in candidates:
+            try:
+                strategy.copy(src_fd, dst_fd, src_stat.st_size)
+            except CopyStrategy.UnsupportedError as e:
+                CopyEngine.__LOG.debug("Copy strategy not supported for devices %s: %s", devices, e)
+                # restart from scratch with next strategy
+                os.ftruncate(dst_fd, 0)
+                os.lseek(dst_fd, 0, os.SEEK_SET)
+                os.lseek(src_fd, 0, os.SEEK_SET)
+                continue
+
+            if strategy is not chosen:
+                self.__choices[devices] = strategy
+                CopyEngine.__LOG.debug("Using copy strategy '%s' for devices %s", strategy.NAME, devices)
+            return
+
+        raise CopyStrategy.UnsupportedError(f"No copy strategy supported for devices {devices}")
+
+    def shutdown(self) -> None:
+        self.__fan_out.shutdown()
+
+    @property
+    def staging(self) -> StagingArea:
+        return self.__staging
+
+    @property
+    def strategies(self) -> List[CopyStrategy]:
+        return self.__strategies
@@ -0,0 +1,175 @@
+import errno
+import os
+import threading
+from abc import ABC, abstractmethod
+
+try:
+    import fcntl
+except ImportError:  # not on POSIX systems
+    fcntl = None
+
+
+class CopyStrategy(ABC):
+    """
+    Mechanism used to copy the content of a file descriptor into another one.
+
+    A strategy raises CopyStrategy.UnsupportedError if it can not be used
+        for the given pair of file descriptors, so the next one can be tried.
+    """
+
+    NAME = None
+
+    @classmethod
+    def available(cls) -> bool:
+        """
+        :return: True iff strategy is supported by the running platform
+        """
+        return True
+
+    @abstractmethod
+    def copy(self, src_fd: int, dst_fd: int, size: int) -> None:
+        """
+        Copy size bytes from src_fd to dst_fd, both positioned at offset 0
+        :param src_fd: file descriptor opened for reading
+        :param dst_fd: empty file descriptor opened for writing
+        :param size: bytes to copy
+        :raise CopyStrategy.UnsupportedError if strategy can not be used for descriptors
+        """
+        raise NotImplementedError
+
+    # errors meaning that a mechanism is not supported by file systems/kernel
+    UNSUPPORTED_ERRNO = frozenset((
+        errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP,
+        getattr(errno, "ENOTSUP", errno.EOPNOTSUPP), errno.ENOTTY
+    ))
+
+    @classmethod
+    def _unsupported(cls, e: OSError) -> Exception:
+        if e.errno in cls.UNSUPPORTED_ERRNO:
+            return CopyStrategy.UnsupportedError(f"{cls.NAME}: {e}")
+        return e
+
+    @classmethod
+    def _check_copied(cls, copied: int, size: int) -> None:
+        """
+        In kernel copies may stop early (e.g. files of pseudo or FUSE file systems reporting
+            a wrong size): nothing copied means unsupported, a short copy is an error
+        :raise CopyStrategy.UnsupportedError if no byte has been copied
+        :raise OSError if less than size bytes have been copied
+        """
+        if copied == size:
+            return
+        if copied == 0:
+            raise cls._unsupported(OSError(errno.EINVAL, f"no data copied, {size} bytes expected"))
+        raise OSError(errno.EIO, f"{cls.NAME}: short copy, {copied} of {size} bytes copied")
+
+    class UnsupportedError(Exception):
+
+        def __init__(self, *args):
+            super().__init__(*args)
+
+
+class ReflinkCopy(CopyStrategy):
+    """
+    Copy-on-write clone (btrfs, xfs, ...): constant time, no data is copied
+    """
+
+    NAME = "reflink"
+
+    # _IOW(0x94, 9, int)
+    FICLONE = 0x40049409
+
+    @classmethod
+    def available(cls) -> bool:
+        return fcntl is not None and os.uname().sysname == "Linux"
+
+    def copy(self, src_fd: int, dst_fd: int, size: int) -> None:
+        try:
+            fcntl.ioctl(dst_fd, ReflinkCopy.FICLONE, src_fd)
+        except OSError as e:
+            raise self._unsupported(e)
+
+
+class CopyFileRangeCopy(CopyStrategy):
+    """
+    In kernel copy, which may be offloaded to the file system (e.g. server side copy on NFS)
+    """
+
+    NAME = "copy_file_range"
+
+    @classmethod
+    def available(cls) -> bool:
+        return hasattr(os, "copy_file_range")
+
+    def copy(self, src_fd: int, dst_fd: int, size: int) -> None:
+        copied = 0
+        try:
+            while copied < size:
+                sent = os.copy_file_range(src_fd, dst_fd, size - copied)
+                if sent == 0:
+                    break
+                copied += sent
+        except OSError as e:
+            raise self._unsupported(e)
+        self._check_copied(copied, size)
+
+
+class SendfileCopy(CopyStrategy):
+    """
+    In kernel copy through page cache, without moving data into user space
+    """
+
+    NAME = "sendfile"
+
+    @classmethod
+    def available(cls) -> bool:
+        # only Linux supports regular files as output
+        return hasattr(os, "sendfile") and os.uname().sysname == "Linux"
+
+    def copy(self, src_fd: int, dst_fd: int, size: int) -> None:
+        copied = 0
+        try:
+            while copied < size:
+                sent = os.sendfile(dst_fd, src_fd, copied, size - copied)
+                if sent == 0:
+                    break
+                copied += sent
+        except OSError as e:
+            raise self._unsupported(e)
+        self._check_copied(copied, size)
+
+
+class UserspaceCopy(CopyStrategy):
+    """
+    Portable copy through a reusable (per thread) buffer
+    """
+
+    NAME = "userspace"
+
+    DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+    def __init__(self, buffer_size: int = DEFAULT_BUFFER_SIZE):
+        super().__init__()
+
+        self.__buffer_size = buffer_size
+        self.__local = threading.local()
+
+    def buffer(self) -> memoryview:
+        buffer = getattr(self.__local, "buffer", None)
+        if buffer is None:
+            buffer = self.__local.buffer = memoryview(bytearray(self.__buffer_size))
+        return buffer
+
+    def copy(self, src_fd: int, dst_fd: int, size: int) -> None:
+        buffer = self.buffer()
+        while True:
+            read = os.readv(src_fd, [buffer])
+            if read == 0:
+                break
+            written = 0
+            while written < read:
+                written += os.write(dst_fd, buffer[written:read])
+
+    @property
+    def buffer_size(self) -> int:
+        return self.__buffer_size
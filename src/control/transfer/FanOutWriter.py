@@ -0,0 +1,62 @@
+import os
+import threading
+from concurrent.futures.thread import ThreadPoolExecutor
+from typing import List
+
+from control.transfer.CopyStrategy import UserspaceCopy
+
+
+class FanOutWriter(object):
+    """
+    This class copies a file descriptor into several ones reading each chunk
+        of the source only once.
+
+    Every chunk is read into a reusable (per thread) buffer and then written to
+        all destinations, sequentially or, if threads are specified, in parallel
+        (one write per destination).
+    """
+
+    def __init__(self, buffer_size: int = UserspaceCopy.DEFAULT_BUFFER_SIZE, threads: int = 0):
+        super().__init__()
+
+        self.__buffer_size = buffer_size
+        self.__local = threading.local()
+        self.__executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix=self.__class__.__name__) \
+            if threads > 0 else None
+
+    def __buffer(self) -> memoryview:
+        buffer = getattr(self.__local, "buffer", None)
+        if buffer is None:
+            buffer = self.__local.buffer = memoryview(bytearray(self.__buffer_size))
+        return buffer
+
+    def copy_fd(self, src_fd: int, dst_fds: List[int]) -> None:
+        """
+        Copy content of src_fd to all dst_fds
+        :param src_fd: file descriptor opened for reading
+        :param dst_fds: empty file descriptors opened for writing
+        """
+        buffer = self.__buffer()
+        while True:
+            read = os.readv(src_fd, [buffer])
+            if read == 0:
+                break
+
+            chunk = buffer[:read]
+            if self.__executor is None:
+                for dst_fd in dst_fds:
+                    FanOutWriter.__write(dst_fd, chunk)
+            else:
+                # chunk is overwritten by next read, so wait for all writes
+                for future in [self.__executor.submit(FanOutWriter.__write, dst_fd, chunk) for dst_fd in dst_fds]:
+                    future.result()
+
+    @staticmethod
+    def __write(dst_fd: int, chunk: memoryview) -> None:
+        written = 0
+        while written < len(chunk):
+            written += os.write(dst_fd, chunk[written:])
+
+    def shutdown(self) -> None:
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=True)
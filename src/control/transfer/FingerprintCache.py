@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Set, Tuple
+
+from util import LogManager
+
+
+class FingerprintCache(object):
+    """
+    This class tells whether destination files are identical to a source file,
+        so dispatching can skip rewriting them.
+
+    Files are compared by size first (only hard links of the same file are identical
+        without reading them) and then by a streamed BLAKE2 digest: files with the same size
+        and modification time may still differ (e.g. times copied from another file).
+    Digests of destination files are cached, together with their size and modification
+        time, in a LRU table (optionally persisted), so a destination already seen costs
+        a single stat instead of a full read.
+    """
+
+    __LOG = None
+
+    DEFAULT_ENTRIES = 100000
+    BUFFER_SIZE = 1024 * 1024
+
+    def __init__(self, entries: int = DEFAULT_ENTRIES, filename: str = None):
+        """
+
+        :param entries: maximum number of cached fingerprints
+        :param filename: file where fingerprints are loaded from and saved to, not persisted if not specified
+        """
+        super().__init__()
+
+        FingerprintCache.__LOG = LogManager.get_instance().get(LogManager.Logger.DISPATCHER)
+        self.__entries = entries
+        self.__filename = filename
+        self.__lock = threading.Lock()
+        # filename -> (size, modification time, digest)
+        self.__fingerprints = OrderedDict()
+
+        if filename is not None:
+            self.__load()
+
+    @staticmethod
+    def digest(filename: str) -> str:
+        digest = hashlib.blake2b()
+        with open(filename, "rb", buffering=0) as file:
+            for chunk in iter(lambda: file.read(FingerprintCache.BUFFER_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def identical(self, source: str, targets: List[str]) -> Tuple[Set[str], Optional[str]]:
+        """
+        :param source: file to dispatch
+        :param targets: destination filenames of source
+        :return: targets identical to source and digest of source (None if it has not been computed)
+        """
+        source_stat = os.stat(source)
+        identical = set()
+        candidates = []
+        for target in targets:
+            try:
+                stat = os.stat(target)
+            except FileNotFoundError:
+                continue
+            if stat.st_size != source_stat.st_size:
+                continue
+            # same file (hard link): no need to read them
+            if (stat.st_dev, stat.st_ino) == (source_stat.st_dev, source_stat.st_ino):
+                identical.add(target)
+            else:
+                candidates.append((target, stat))
+        if len(candidates) == 0:
+            return identical, None
+
+        digest = FingerprintCache.digest(source)
+        identical.update(target for target, stat in candidates if self.__fingerprint(target, stat) == digest)
+        return identical, digest
+
+    def __fingerprint(self, filename: str, stat: os.stat_result) -> str:
+        with self.__lock:
+            fingerprint = self.__fingerprints.get(filename)
+            if fingerprint is not None and fingerprint[:2] == (stat.st_size, stat.st_mtime_ns):
+                self.__fingerprints.move_to_end(filename)
+                return fingerprint[2]
+
+        digest = FingerprintCache.digest(filename)
+        self.__put(filename, stat, digest)
+        return digest
+
+    def store(self, filename: str, digest: str) -> None:
+        """
+        Record the digest of a file just written
+        """
+        try:
+            self.__put(filename, os.stat(filename), digest)
+        except FileNotFoundError:
+            pass
+
+    def __put(self, filename: str, stat: os.stat_result, digest: str) -> None:
+        with self.__lock:
+            self.__fingerprints[filename] = (stat.st_size, stat.st_mtime_ns, digest)
+            self.__fingerprints.move_to_end(filename)
+            while len(self.__fingerprints) > self.__entries:
+                self.__fingerprints.popitem(last=False)
+
+    def __load(self) -> None:
+        try:
+            with open(self.__filename, encoding="utf-8") as file:
+                fingerprints = json.load(file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            FingerprintCache.__LOG.warning("Fingerprints '%s' not loaded: %s", self.__filename, e)
+            return
+
+        with self.__lock:
+            for filename, fingerprint in fingerprints[-self.__entries:]:
+                self.__fingerprints[filename] = tuple(fingerprint)
+        FingerprintCache.__LOG.debug("Loaded %s fingerprints from '%s'", len(self.__fingerprints), self.__filename)
+
+    def save(self) -> None:
+        if self.__filename is None:
+            return
+
+        with self.__lock:
+            # least recently used first
+            fingerprints = list(self.__fingerprints.items())
+        staged = f"{self.__filename}.{os.getpid()}.tmp"
+        try:
+            with open(staged, "w", encoding="utf-8") as file:
+                json.dump(fingerprints, file)
+            os.replace(staged, self.__filename)
+        except OSError as e:
+            FingerprintCache.__LOG.warning("Fingerprints '%s' not saved: %s", self.__filename, e)
+
+    def __len__(self):
+        return len(self.__fingerprints)
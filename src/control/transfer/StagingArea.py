@@ -0,0 +1,96 @@
+import errno
+import os
+import shutil
+from uuid import uuid4
+
+from util import LogManager
+
+
+class StagingArea(object):
+    """
+    This class provides temporary filenames where files are written before being
+        published, with a single os.replace, to their final filename.
+
+    Temporary files are created in the tmp directory if it is on the same device of
+        the destination, so watchers of the destination see only complete files.
+        Otherwise they are created, as hidden files, in the destination itself.
+    A device may be mounted more than once (e.g. bind mounts), and files can not be renamed
+        across mounts: temporary files which can not be renamed are copied to the destination,
+        where the following ones are created directly.
+    """
+
+    __LOG = None
+
+    SUFFIX = ".part"
+
+    def __init__(self, tmp_dir: str = None):
+        super().__init__()
+
+        StagingArea.__LOG = LogManager.get_instance().get(LogManager.Logger.DISPATCHER)
+        self.__tmp_dir = tmp_dir
+        self.__tmp_device = None
+        # directory -> device id
+        self.__devices = {}
+        # directories on the device of tmp directory, but on another mount
+        self.__mounts = set()
+
+        if tmp_dir is not None:
+            try:
+                self.__tmp_device = os.stat(tmp_dir).st_dev
+            except OSError as e:
+                StagingArea.__LOG.warning("Temporary directory '%s' not usable, files will be staged in destinations: %s", tmp_dir, e)
+
+    def stage(self, filename: str) -> str:
+        """
+        :param filename: final filename
+        :return: temporary filename, on the same device of filename
+        """
+        directory, file = os.path.split(filename)
+        if self.__tmp_device is not None and directory not in self.__mounts and self.__device(directory) == self.__tmp_device:
+            return f"{self.__tmp_dir}/{file}.{uuid4().hex}{StagingArea.SUFFIX}"
+        return f"{directory}/.{file}.{uuid4().hex}{StagingArea.SUFFIX}"
+
+    def publish(self, staged: str, filename: str) -> None:
+        """
+        Rename staged to filename, through a copy in the directory of filename
+            if they are on different mounts
+        :param staged: temporary filename returned by stage()
+        :param filename: final filename
+        """
+        try:
+            os.replace(staged, filename)
+            return
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+
+        directory, file = os.path.split(filename)
+        if directory not in self.__mounts:
+            self.__mounts.add(directory)
+            StagingArea.__LOG.info("Directory '%s' is on another mount of the temporary directory device, files will be staged in it", directory)
+
+        copied = f"{directory}/.{file}.{uuid4().hex}{StagingArea.SUFFIX}"
+        try:
+            shutil.copyfile(staged, copied)
+            os.replace(copied, filename)
+        except BaseException:
+            StagingArea.discard(copied)
+            raise
+        StagingArea.discard(staged)
+
+    @staticmethod
+    def discard(staged: str) -> None:
+        try:
+            os.unlink(staged)
+        except FileNotFoundError:
+            pass
+
+    def __device(self, directory: str) -> int:
+        device = self.__devices.get(directory)
+        if device is None:
+            device = self.__devices[directory] = os.stat(directory).st_dev
+        return device
+
+    @property
+    def tmp_dir(self) -> str:
+        return self.__tmp_dir
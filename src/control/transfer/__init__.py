@@ -0,0 +1,17 @@
+from control.transfer.CopyStrategy import CopyStrategy, ReflinkCopy, CopyFileRangeCopy, SendfileCopy, UserspaceCopy
+from control.transfer.FanOutWriter import FanOutWriter
+from control.transfer.StagingArea import StagingArea
+from control.transfer.CopyEngine import CopyEngine
+from control.transfer.FingerprintCache import FingerprintCache
+
+__all__ = [
+    "CopyStrategy",
+    "ReflinkCopy",
+    "CopyFileRangeCopy",
+    "SendfileCopy",
+    "UserspaceCopy",
+    "FanOutWriter",
+    "StagingArea",
+    "CopyEngine",
+    "FingerprintCache"
+]
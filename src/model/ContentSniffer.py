@@ -0,0 +1,141 @@
+import os
+from typing import List, Optional, Sequence, Tuple
+
+
+class ContentSniffer(object):
+    """
+    Classifies files by content: the header of a file (at most HEADER_SIZE bytes,
+        read with a single pread) is matched against magic signatures.
+
+    Signatures are compiled into a prefix table: for each offset, the first
+        PREFIX_SIZE bytes of signatures map to the (few) candidates to compare,
+        most specific first, so classification costs a dictionary lookup per offset.
+    Short or nested magic bytes (e.g. the type of a RIFF container) are qualified
+        by other bytes the header must also contain.
+    Headers matching no signature are classified as text if they are valid UTF-8
+        without NUL bytes.
+    """
+
+    HEADER_SIZE = 4096
+    PREFIX_SIZE = 2
+
+    TEXT = "text/plain"
+
+    # containers of WebP, AVI and WAV
+    RIFF = ((0, b"RIFF"),)
+    # reserved bytes and DIB header size (12 bytes for OS/2 bitmaps, 40, 108 or 124 for Windows ones)
+    BMP = tuple(((6, b"\x00" * 4), (14, size.to_bytes(4, "little"))) for size in (12, 40, 108, 124))
+
+    # (offset, magic bytes, MIME type[, ((offset, bytes), ...) also required])
+    SIGNATURES = (
+        (0, b"\xff\xd8\xff", "image/jpeg"),
+        (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+        (0, b"GIF87a", "image/gif"),
+        (0, b"GIF89a", "image/gif"),
+        (0, b"BM", "image/bmp", BMP[0]),
+        (0, b"BM", "image/bmp", BMP[1]),
+        (0, b"BM", "image/bmp", BMP[2]),
+        (0, b"BM", "image/bmp", BMP[3]),
+        (0, b"II*\x00", "image/tiff"),
+        (0, b"MM\x00*", "image/tiff"),
+        (0, b"\x00\x00\x01\x00", "image/x-icon"),
+        (8, b"WEBP", "image/webp", RIFF),
+        (4, b"ftypheic", "image/heic"),
+        (4, b"ftypavif", "image/avif"),
+        (4, b"ftyp", "video/mp4"),
+        (4, b"ftypqt", "video/quicktime"),
+        (0, b"\x1aE\xdf\xa3", "video/x-matroska"),
+        (8, b"AVI ", "video/x-msvideo", RIFF),
+        (0, b"ID3", "audio/mpeg"),
+        (0, b"fLaC", "audio/flac"),
+        (0, b"OggS", "audio/ogg"),
+        (8, b"WAVE", "audio/wav", RIFF),
+        (0, b"%PDF-", "application/pdf"),
+        (0, b"PK\x03\x04", "application/zip"),
+        (0, b"PK\x05\x06", "application/zip"),
+        (0, b"\x1f\x8b", "application/gzip"),
+        (0, b"BZh", "application/x-bzip2"),
+        (0, b"\xfd7zXZ\x00", "application/x-xz"),
+        (0, b"(\xb5/\xfd", "application/zstd"),
+        (0, b"7z\xbc\xaf'\x1c", "application/x-7z-compressed"),
+        (0, b"Rar!\x1a\x07", "application/vnd.rar"),
+        (257, b"ustar", "application/x-tar"),
+        (0, b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "application/x-ole-storage"),
+        (0, b"SQLite format 3\x00", "application/vnd.sqlite3"),
+        (0, b"\x7fELF", "application/x-executable"),
+        (0, b"\x00asm", "application/wasm")
+    )
+
+    def __init__(self, signatures: Sequence[tuple] = SIGNATURES,
+                 header_size: int = HEADER_SIZE):
+        """
+
+        :param signatures: (offset, magic bytes, MIME type[, other (offset, bytes) required]) to match
+        :param header_size: maximum bytes read from each file
+        """
+        super().__init__()
+
+        self.__header_size = header_size
+        # offset -> prefix -> [(magic bytes, MIME type, other (offset, bytes) required)], most bytes first
+        self.__table = {}
+        for offset, magic, mime, *required in signatures:
+            candidates = self.__table.setdefault(offset, {}).setdefault(magic[:ContentSniffer.PREFIX_SIZE], [])
+            candidates.append((magic, mime, tuple(required[0]) if len(required) > 0 else ()))
+        for prefixes in self.__table.values():
+            for candidates in prefixes.values():
+                candidates.sort(key=lambda c: len(c[0]) + sum(len(part) for _, part in c[2]), reverse=True)
+        self.__offsets = sorted(self.__table)
+
+    def sniff(self, filename: str) -> Optional[str]:
+        """
+        :return: MIME type of filename, None if it is unknown (or filename can not be read)
+        """
+        try:
+            fd = os.open(filename, os.O_RDONLY)
+        except OSError:
+            return None
+        try:
+            header = os.pread(fd, self.__header_size, 0)
+        except OSError:
+            return None
+        finally:
+            os.close(fd)
+        return self.classify(header)
+
+    def classify(self, header: bytes) -> Optional[str]:
+        """
+        :return: MIME type of a file starting with header, None if it is unknown
+        """
+        for offset in self.__offsets:
+            candidates = self.__table[offset].get(header[offset:offset + ContentSniffer.PREFIX_SIZE])
+            if candidates is None:
+                continue
+            for magic, mime, required in candidates:
+                if header.startswith(magic, offset) and all(header.startswith(part, at) for at, part in required):
+                    return mime
+
+        if len(header) > 0 and b"\x00" not in header:
+            # a full header may end in the middle of a character
+            cut = 4 if len(header) == self.__header_size else 1
+            for end in range(len(header), len(header) - cut, -1):
+                try:
+                    header[:end].decode("utf-8")
+                    return ContentSniffer.TEXT
+                except UnicodeDecodeError:
+                    continue
+        return None
+
+    @staticmethod
+    def compile_types(types: List[str]) -> Tuple[frozenset, Tuple[str, ...]]:
+        """
+        :param types: MIME types, possibly with wildcard subtypes (e.g. 'image/*')
+        :return: exact types and prefixes of wildcard types
+        """
+        exact = frozenset(t.lower() for t in types if not t.endswith("/*"))
+        prefixes = tuple(t[:-1].lower() for t in types if t.endswith("/*"))
+        return exact, prefixes
+
+    @staticmethod
+    def matches(compiled: Tuple[frozenset, Tuple[str, ...]], mime: str) -> bool:
+        exact, prefixes = compiled
+        return mime in exact or mime.startswith(prefixes)
@@ -1,6 +1,7 @@
 import ast
 import configparser
 import threading
+from typing import Callable, Optional
 
 import __version__
 from util import Validation
@@ -21,16 +22,54 @@ class DispatcherConfig(dict):
     V_DEFAULT_APP_NAME = "Dispatcher"
     K_LOG_FILENAME = "log.filename"
     V_DEFAULT_LOG_FILENAME = None
+    K_CONFIG_FILE = "config.file"
+    V_DEFAULT_CONFIG_FILE = None
 
     # Section
     S_GENERAL = "GENERAL"
     # Keys
     K_LOG_DIR = "log.dir"
     V_DEFAULT_LOG_DIR = None
+    K_LOG_ASYNC = "log.async"
+    V_DEFAULT_LOG_ASYNC = True
     K_TMP = "tmp"
     V_DEFAULT_TMP = "/tmp"
     K_THREADS = "threads"
     V_DEFAULT_THREADS = 2
+    K_ENGINE = "engine"
+    V_DEFAULT_ENGINE = "threads"
+    K_COPY_STRATEGIES = "copy.strategies"
+    V_DEFAULT_COPY_STRATEGIES = None
+    K_COPY_BUFFER = "copy.buffer"
+    V_DEFAULT_COPY_BUFFER = 1024 * 1024
+    K_COPY_FAN_OUT_THREADS = "copy.fanout.threads"
+    V_DEFAULT_COPY_FAN_OUT_THREADS = 0
+    K_QUEUE_CAPACITY = "queue.capacity"
+    V_DEFAULT_QUEUE_CAPACITY = 0
+    K_QUEUE_POLICY = "queue.policy"
+    V_DEFAULT_QUEUE_POLICY = "block"
+    K_BATCH_WINDOW = "batch.window"
+    V_DEFAULT_BATCH_WINDOW = 0
+    K_BATCH_SIZE = "batch.size"
+    V_DEFAULT_BATCH_SIZE = 256
+    K_SKIP_IDENTICAL = "skip.identical"
+    V_DEFAULT_SKIP_IDENTICAL = False
+    K_FINGERPRINTS_ENTRIES = "fingerprints.entries"
+    V_DEFAULT_FINGERPRINTS_ENTRIES = 100000
+    K_FINGERPRINTS_FILE = "fingerprints.file"
+    V_DEFAULT_FINGERPRINTS_FILE = None
+    K_JOURNAL_FILE = "journal.file"
+    V_DEFAULT_JOURNAL_FILE = None
+    K_METRICS_LISTEN = "metrics.listen"
+    V_DEFAULT_METRICS_LISTEN = None
+    K_PROFILER_DIR = "profiler.dir"
+    V_DEFAULT_PROFILER_DIR = None
+    K_PROFILER_WINDOW = "profiler.window"
+    V_DEFAULT_PROFILER_WINDOW = 60
+    K_PROCESSES = "processes"
+    V_DEFAULT_PROCESSES = 1
+    K_CONFIG_WATCH = "config.watch"
+    V_DEFAULT_CONFIG_WATCH = 0
 
     # Section
     S_DISPATCHER = "DISPATCHER"
@@ -41,6 +80,14 @@ class DispatcherConfig(dict):
     V_DEFAULT_SOURCES = None
     K_SOURCES_TIMEOUT = "sources.timeout"
     V_DEFAULT_SOURCES_TIMEOUT = 1
+    K_SOURCES_POLL = "sources.poll"
+    V_DEFAULT_SOURCES_POLL = None
+    K_SOURCES_BACKEND = "sources.backend"
+    V_DEFAULT_SOURCES_BACKEND = "watchdog"
+    K_SOURCES_RECURSIVE = "sources.recursive"
+    V_DEFAULT_SOURCES_RECURSIVE = None
+    K_SOURCES_SWEEP = "sources.sweep"
+    V_DEFAULT_SOURCES_SWEEP = True
     K_DESTINATIONS = "destinations"
     V_DEFAULT_DESTINATIONS = None
     K_RULES = "rules"
@@ -53,9 +100,15 @@ class DispatcherConfig(dict):
         super().__init__()
 
         DispatcherConfig.__INSTANCE = self
-        self.__config_parser = configparser.ConfigParser(interpolation=configparser.ExtendedInterpolation())
+        self.__config_parser = DispatcherConfig.__new_parser()
+        # (source keys, shard) restricting configuration, see shard()
+        self.__shard = None
         self.__upload_config()
 
+    @staticmethod
+    def __new_parser() -> configparser.ConfigParser:
+        return configparser.ConfigParser(interpolation=configparser.ExtendedInterpolation())
+
     @classmethod
     def get_instance(cls) -> "DispatcherConfig":
         if cls.__INSTANCE is None:
@@ -64,10 +117,15 @@ class DispatcherConfig(dict):
                     DispatcherConfig()
         return cls.__INSTANCE
 
-    def load_from(self, config_file: str) -> None:
+    def load_from(self, config_file: str, validate: Callable[["DispatcherConfig"], None] = None) -> None:
         """
+        Load configuration file, replacing current configuration: options not specified
+            in config_file get their default values (also when reloading).
+        A shard restriction (see shard()) is applied again.
 
         :param config_file:
+        :param validate: called with the new configuration before it is kept: if it raises,
+            the previous configuration is restored and the exception is raised
         :raise: SyntaxError if there is a syntax error in configuration file
         """
         Validation.is_file_readable(
@@ -76,8 +134,67 @@ class DispatcherConfig(dict):
         )
 
         with self.__LOCK:
-            self.__config_parser.read(config_file)
-            self.__upload_config()
+            previous_parser, previous = self.__config_parser, dict(self)
+            try:
+                self.__config_parser = DispatcherConfig.__new_parser()
+                self.__config_parser.read(config_file)
+                self.__upload_config()
+                self.__put_str(DispatcherConfig.K_CONFIG_FILE, '', '', config_file)
+                if self.__shard is not None:
+                    self.__restrict(*self.__shard)
+                if validate is not None:
+                    validate(self)
+            except Exception:
+                self.__config_parser = previous_parser
+                self.clear()
+                self.update(previous)
+                raise
+
+    def shard(self, source_keys: list, shard: int) -> None:
+        """
+        Restrict configuration to a subset of sources, for a shard process:
+            rules, and poll times, not involving those sources are removed
+
+        :param source_keys: keys of sources handled by shard
+        :param shard: shard number, used to make per-process resources (e.g. spill journal) unique
+        """
+        with self.__LOCK:
+            self.__shard = (list(source_keys), shard)
+            self.__restrict(source_keys, shard)
+
+    def __restrict(self, source_keys: list, shard: int) -> None:
+        from model.RuleBuilder import RuleBuilder
+
+        sources = self.dispatcher_sources
+        # sources removed from a reloaded configuration
+        self[DispatcherConfig.K_SOURCES] = {src: sources[src] for src in source_keys if src in sources}
+
+        rules = {}
+        for name, rule in self.dispatcher_rules.items():
+            rule_sources = [src for src in rule[RuleBuilder.K_SOURCES] if src in source_keys]
+            if len(rule_sources) > 0:
+                rules[name] = {**rule, RuleBuilder.K_SOURCES: rule_sources}
+        self[DispatcherConfig.K_RULES] = rules
+
+        if self.dispatcher_sources_poll is not None:
+            sources_poll = self.dispatcher_sources_poll
+            self[DispatcherConfig.K_SOURCES_POLL] = {src: sources_poll[src] for src in sources_poll if src in source_keys}
+        if self.dispatcher_sources_recursive is not None:
+            sources_recursive = self.dispatcher_sources_recursive
+            self[DispatcherConfig.K_SOURCES_RECURSIVE] = {src: sources_recursive[src] for src in sources_recursive if src in source_keys}
+
+        if self.general_fingerprints_file is not None:
+            self[DispatcherConfig.K_FINGERPRINTS_FILE] = f"{self.general_fingerprints_file}.{shard}"
+        if self.general_journal_file is not None:
+            self[DispatcherConfig.K_JOURNAL_FILE] = f"{self.general_journal_file}.{shard}"
+        if self.general_metrics_listen is not None:
+            # each shard serves its own metrics: next ports, or sockets suffixed by shard
+            address, _, port = self.general_metrics_listen.rpartition(":")
+            if port.isdigit():
+                self[DispatcherConfig.K_METRICS_LISTEN] = f"{address}:{int(port) + 1 + shard}"
+            else:
+                self[DispatcherConfig.K_METRICS_LISTEN] = f"{self.general_metrics_listen}.{shard}"
+        self[DispatcherConfig.K_APP_NAME] = f"{self.app_name}.{shard}"
 
     def __upload_config(self) -> None:
         """
@@ -86,13 +203,35 @@ class DispatcherConfig(dict):
         """
         # section [GENERAL]
         self.__put_str(DispatcherConfig.K_LOG_DIR, DispatcherConfig.S_GENERAL, DispatcherConfig.K_LOG_DIR, DispatcherConfig.V_DEFAULT_LOG_DIR)
+        self.__put_bool(DispatcherConfig.K_LOG_ASYNC, DispatcherConfig.S_GENERAL, DispatcherConfig.K_LOG_ASYNC, DispatcherConfig.V_DEFAULT_LOG_ASYNC)
         self.__put_str(DispatcherConfig.K_TMP, DispatcherConfig.S_GENERAL, DispatcherConfig.K_TMP, DispatcherConfig.V_DEFAULT_TMP)
         self.__put_int(DispatcherConfig.K_THREADS, DispatcherConfig.S_GENERAL, DispatcherConfig.K_THREADS, DispatcherConfig.V_DEFAULT_THREADS)
+        self.__put_str(DispatcherConfig.K_ENGINE, DispatcherConfig.S_GENERAL, DispatcherConfig.K_ENGINE, DispatcherConfig.V_DEFAULT_ENGINE)
+        self.__put_dict(DispatcherConfig.K_COPY_STRATEGIES, DispatcherConfig.S_GENERAL, DispatcherConfig.K_COPY_STRATEGIES, DispatcherConfig.V_DEFAULT_COPY_STRATEGIES)
+        self.__put_int(DispatcherConfig.K_COPY_BUFFER, DispatcherConfig.S_GENERAL, DispatcherConfig.K_COPY_BUFFER, DispatcherConfig.V_DEFAULT_COPY_BUFFER)
+        self.__put_int(DispatcherConfig.K_COPY_FAN_OUT_THREADS, DispatcherConfig.S_GENERAL, DispatcherConfig.K_COPY_FAN_OUT_THREADS, DispatcherConfig.V_DEFAULT_COPY_FAN_OUT_THREADS)
+        self.__put_int(DispatcherConfig.K_QUEUE_CAPACITY, DispatcherConfig.S_GENERAL, DispatcherConfig.K_QUEUE_CAPACITY, DispatcherConfig.V_DEFAULT_QUEUE_CAPACITY)
+        self.__put_str(DispatcherConfig.K_QUEUE_POLICY, DispatcherConfig.S_GENERAL, DispatcherConfig.K_QUEUE_POLICY, DispatcherConfig.V_DEFAULT_QUEUE_POLICY)
+        self.__put_float(DispatcherConfig.K_BATCH_WINDOW, DispatcherConfig.S_GENERAL, DispatcherConfig.K_BATCH_WINDOW, DispatcherConfig.V_DEFAULT_BATCH_WINDOW)
+        self.__put_int(DispatcherConfig.K_BATCH_SIZE, DispatcherConfig.S_GENERAL, DispatcherConfig.K_BATCH_SIZE, DispatcherConfig.V_DEFAULT_BATCH_SIZE)
+        self.__put_bool(DispatcherConfig.K_SKIP_IDENTICAL, DispatcherConfig.S_GENERAL, DispatcherConfig.K_SKIP_IDENTICAL, DispatcherConfig.V_DEFAULT_SKIP_IDENTICAL)
+        self.__put_int(DispatcherConfig.K_FINGERPRINTS_ENTRIES, DispatcherConfig.S_GENERAL, DispatcherConfig.K_FINGERPRINTS_ENTRIES, DispatcherConfig.V_DEFAULT_FINGERPRINTS_ENTRIES)
+        self.__put_str(DispatcherConfig.K_FINGERPRINTS_FILE, DispatcherConfig.S_GENERAL, DispatcherConfig.K_FINGERPRINTS_FILE, DispatcherConfig.V_DEFAULT_FINGERPRINTS_FILE)
+        self.__put_str(DispatcherConfig.K_JOURNAL_FILE, DispatcherConfig.S_GENERAL, DispatcherConfig.K_JOURNAL_FILE, DispatcherConfig.V_DEFAULT_JOURNAL_FILE)
+        self.__put_str(DispatcherConfig.K_METRICS_LISTEN, DispatcherConfig.S_GENERAL, DispatcherConfig.K_METRICS_LISTEN, DispatcherConfig.V_DEFAULT_METRICS_LISTEN)
+        self.__put_str(DispatcherConfig.K_PROFILER_DIR, DispatcherConfig.S_GENERAL, DispatcherConfig.K_PROFILER_DIR, DispatcherConfig.V_DEFAULT_PROFILER_DIR)
+        self.__put_float(DispatcherConfig.K_PROFILER_WINDOW, DispatcherConfig.S_GENERAL, DispatcherConfig.K_PROFILER_WINDOW, DispatcherConfig.V_DEFAULT_PROFILER_WINDOW)
+        self.__put_int(DispatcherConfig.K_PROCESSES, DispatcherConfig.S_GENERAL, DispatcherConfig.K_PROCESSES, DispatcherConfig.V_DEFAULT_PROCESSES)
+        self.__put_float(DispatcherConfig.K_CONFIG_WATCH, DispatcherConfig.S_GENERAL, DispatcherConfig.K_CONFIG_WATCH, DispatcherConfig.V_DEFAULT_CONFIG_WATCH)
 
         # section [DISPATCHER]
         self.__put_dict(DispatcherConfig.K_FORMATS, DispatcherConfig.S_DISPATCHER, DispatcherConfig.K_FORMATS, DispatcherConfig.V_DEFAULT_FORMATS)
         self.__put_dict(DispatcherConfig.K_SOURCES, DispatcherConfig.S_DISPATCHER, DispatcherConfig.K_SOURCES, DispatcherConfig.V_DEFAULT_SOURCES)
         self.__put_float(DispatcherConfig.K_SOURCES_TIMEOUT, DispatcherConfig.S_DISPATCHER, DispatcherConfig.K_SOURCES_TIMEOUT, DispatcherConfig.V_DEFAULT_SOURCES_TIMEOUT)
+        self.__put_dict(DispatcherConfig.K_SOURCES_POLL, DispatcherConfig.S_DISPATCHER, DispatcherConfig.K_SOURCES_POLL, DispatcherConfig.V_DEFAULT_SOURCES_POLL)
+        self.__put_str(DispatcherConfig.K_SOURCES_BACKEND, DispatcherConfig.S_DISPATCHER, DispatcherConfig.K_SOURCES_BACKEND, DispatcherConfig.V_DEFAULT_SOURCES_BACKEND)
+        self.__put_dict(DispatcherConfig.K_SOURCES_RECURSIVE, DispatcherConfig.S_DISPATCHER, DispatcherConfig.K_SOURCES_RECURSIVE, DispatcherConfig.V_DEFAULT_SOURCES_RECURSIVE)
+        self.__put_bool(DispatcherConfig.K_SOURCES_SWEEP, DispatcherConfig.S_DISPATCHER, DispatcherConfig.K_SOURCES_SWEEP, DispatcherConfig.V_DEFAULT_SOURCES_SWEEP)
         self.__put_dict(DispatcherConfig.K_DESTINATIONS, DispatcherConfig.S_DISPATCHER, DispatcherConfig.K_DESTINATIONS, DispatcherConfig.V_DEFAULT_DESTINATIONS)
         self.__put_dict(DispatcherConfig.K_RULES, DispatcherConfig.S_DISPATCHER, DispatcherConfig.K_RULES, DispatcherConfig.V_DEFAULT_RULES)
 
@@ -158,7 +297,7 @@ class DispatcherConfig(dict):
 
     def __put_bool(self, key: str, section: str, section_key: str, default: bool = None) -> None:
         try:
-            self[key] = bool(self.__config_parser.get(section, section_key))
+            self[key] = self.__config_parser.getboolean(section, section_key)
         except (configparser.NoOptionError, configparser.NoSectionError):
             self[key] = default
 
@@ -174,10 +313,18 @@ class DispatcherConfig(dict):
     def log_filename(self) -> str:
         return self.get(DispatcherConfig.K_LOG_FILENAME)
 
+    @property
+    def config_file(self) -> str:
+        return self.get(DispatcherConfig.K_CONFIG_FILE)
+
     @property
     def general_log_dir(self) -> str:
         return self.get(DispatcherConfig.K_LOG_DIR)
 
+    @property
+    def general_log_async(self) -> bool:
+        return self.get(DispatcherConfig.K_LOG_ASYNC)
+
     @property
     def general_tmp(self) -> str:
         return self.get(DispatcherConfig.K_TMP)
@@ -186,6 +333,81 @@ class DispatcherConfig(dict):
     def general_threads(self) -> int:
         return self.get(DispatcherConfig.K_THREADS)
 
+    @property
+    def general_engine(self) -> str:
+        return self.get(DispatcherConfig.K_ENGINE)
+
+    @property
+    def general_copy_strategies(self) -> list:
+        return self.get(DispatcherConfig.K_COPY_STRATEGIES)
+
+    @property
+    def general_copy_buffer(self) -> int:
+        return self.get(DispatcherConfig.K_COPY_BUFFER)
+
+    @property
+    def general_copy_fan_out_threads(self) -> int:
+        return self.get(DispatcherConfig.K_COPY_FAN_OUT_THREADS)
+
+    @property
+    def general_queue_capacity(self) -> int:
+        return self.get(DispatcherConfig.K_QUEUE_CAPACITY)
+
+    @property
+    def general_queue_policy(self) -> str:
+        return self.get(DispatcherConfig.K_QUEUE_POLICY)
+
+    @property
+    def general_batch_window(self) -> float:
+        return self.get(DispatcherConfig.K_BATCH_WINDOW)
+
+    @property
+    def general_batch_size(self) -> int:
+        return self.get(DispatcherConfig.K_BATCH_SIZE)
+
+    @property
+    def general_skip_identical(self) -> bool:
+        return self.get(DispatcherConfig.K_SKIP_IDENTICAL)
+
+    @property
+    def general_fingerprints_entries(self) -> int:
+        return self.get(DispatcherConfig.K_FINGERPRINTS_ENTRIES)
+
+    @property
+    def general_fingerprints_file(self) -> str:
+        return self.get(DispatcherConfig.K_FINGERPRINTS_FILE)
+
+    @property
+    def general_journal_file(self) -> str:
+        return self.get(DispatcherConfig.K_JOURNAL_FILE)
+
+    @property
+    def general_metrics_listen(self) -> str:
+        return self.get(DispatcherConfig.K_METRICS_LISTEN)
+
+    @property
+    def general_profiler_dir(self) -> str:
+        return self.get(DispatcherConfig.K_PROFILER_DIR)
+
+    @property
+    def general_profiler_window(self) -> float:
+        return self.get(DispatcherConfig.K_PROFILER_WINDOW)
+
+    @property
+    def general_processes(self) -> int:
+        return self.get(DispatcherConfig.K_PROCESSES)
+
+    @property
+    def shard_number(self) -> Optional[int]:
+        """
+        :return: shard handled by this process (see shard()), None if configuration is not restricted to a shard
+        """
+        return None if self.__shard is None else self.__shard[1]
+
+    @property
+    def general_config_watch(self) -> float:
+        return self.get(DispatcherConfig.K_CONFIG_WATCH)
+
     @property
     def dispatcher_formats(self) -> dict:
         return self.get(DispatcherConfig.K_FORMATS)
@@ -198,6 +420,22 @@ class DispatcherConfig(dict):
     def dispatcher_sources_timeout(self) -> float:
         return self.get(DispatcherConfig.K_SOURCES_TIMEOUT)
 
+    @property
+    def dispatcher_sources_poll(self) -> dict:
+        return self.get(DispatcherConfig.K_SOURCES_POLL)
+
+    @property
+    def dispatcher_sources_backend(self) -> str:
+        return self.get(DispatcherConfig.K_SOURCES_BACKEND)
+
+    @property
+    def dispatcher_sources_recursive(self) -> dict:
+        return self.get(DispatcherConfig.K_SOURCES_RECURSIVE)
+
+    @property
+    def dispatcher_sources_sweep(self) -> bool:
+        return self.get(DispatcherConfig.K_SOURCES_SWEEP)
+
     @property
     def dispatcher_destinations(self) -> dict:
         return self.get(DispatcherConfig.K_DESTINATIONS)
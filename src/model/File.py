@@ -1,8 +1,12 @@
-from os.path import splitext
+import os
+import time
+from os.path import dirname, splitext
 from pathlib import Path
 from shutil import copyfile
+from typing import Callable, List, Optional
+from uuid import uuid4
 
-from model import Rule
+from model.ContentSniffer import ContentSniffer
 from util import Validation
 
 
@@ -11,18 +15,30 @@ class File(object):
 
     """
 
+    __NOT_SNIFFED = object()
+
     def __init__(self, filename: str):
         super().__init__()
 
         self.__filename = filename
+        self.__source = dirname(filename)
         self.__basename = Path(self.__filename).stem
         self.__ext = splitext(filename)[1]
         self.__file = f"{self.__basename}{self.__ext}"
+        # monotonic times of discovery and of transfer completion detection
+        self.__discovered = time.monotonic()
+        self.__stable = None
+        # MIME type sniffed from content, see content_type()
+        self.__mime = File.__NOT_SNIFFED
 
     @property
     def filename(self) -> str:
         return self.__filename
 
+    @property
+    def source(self) -> str:
+        return self.__source
+
     @property
     def ext(self) -> str:
         return self.__ext
@@ -35,6 +51,30 @@ class File(object):
     def file(self):
         return self.__file
 
+    @property
+    def discovered(self) -> float:
+        return self.__discovered
+
+    @property
+    def stable(self) -> float:
+        return self.__stable
+
+    def stabilized(self) -> None:
+        """
+        Record that file is completely transferred
+        """
+        self.__stable = time.monotonic()
+
+    def content_type(self, sniffer: ContentSniffer) -> Optional[str]:
+        """
+        MIME type of file content, sniffed only the first time
+        :param sniffer: content classifier
+        :return: MIME type, None if unknown
+        """
+        if self.__mime is File.__NOT_SNIFFED:
+            self.__mime = sniffer.sniff(self.__filename)
+        return self.__mime
+
     def exists(self) -> bool:
         try:
             Validation.path_exists(self.__filename)
@@ -48,33 +88,63 @@ class File(object):
 
         Path(self.__filename).unlink()
 
-    def copy_to(self, destinations: list) -> None:
+    def copy_to(self, destinations: list,
+                copy_function: Callable[[str, List[str]], None] = None) -> None:
+        """
+
+        :param destinations: destination directories
+        :param copy_function: function copying content of a filename to a list of filenames,
+            shutil.copyfile for each destination if not specified
+        """
         if not self.exists():
             raise FileNotFoundError(f"File '{self.__filename}' not exists and can not be copied")
 
-        for destination in destinations:
-            copyfile(self.__filename, f"{destination}/{self.__file}", follow_symlinks=False)
-
-    def match_rule(self, rule: Rule) -> bool:
-        follow_rule = False
-
-        # checks if file extension match formats
-        for f in rule.formats:
-            if self.__ext.lower() == f.lower():
-                follow_rule = True
-                break
-        if not follow_rule:
-            return False
-
-        # checks if creation/modification file which had triggered event handler
-        #  belongs to at least one source in rule object
-        # Note: this works only if file is created in the root directory of source
-        #   (recursively search might take too long)
-        for source in rule.sources:
+        filenames = [f"{destination}/{self.__file}" for destination in destinations]
+        if copy_function is None:
+            for filename in filenames:
+                copyfile(self.__filename, filename, follow_symlinks=False)
+        else:
+            copy_function(self.__filename, filenames)
+
+    def link_to(self, destination: str, tmp_filename: str = None, dir_fd: int = None) -> None:
+        """
+        Hard link file into destination, which must be on the same device of file
+        :param destination: destination directory
+        :param tmp_filename: temporary name, on the same device, for the link
+        :param dir_fd: open descriptor of destination, names are resolved relative to it if specified
+        :raise OSError if file can not be linked (e.g. different devices)
+        """
+        # link does not overwrite, so link to a temporary name and then replace
+        if dir_fd is None:
+            if tmp_filename is None:
+                tmp_filename = f"{destination}/.{self.__file}.{uuid4().hex}"
+            os.link(self.__filename, tmp_filename, follow_symlinks=False)
             try:
-                Validation.path_exists(f"{source}/{self.__file}")
-                return True
-            except FileNotFoundError:
-                pass
-
-        return False
+                os.replace(tmp_filename, f"{destination}/{self.__file}")
+            except OSError:
+                os.unlink(tmp_filename)
+                raise
+            return
+
+        # temporary names inside destination are relative to it too
+        tmp_dir_fd = None
+        if tmp_filename is None:
+            tmp_filename, tmp_dir_fd = f".{self.__file}.{uuid4().hex}", dir_fd
+        os.link(self.__filename, tmp_filename, dst_dir_fd=tmp_dir_fd, follow_symlinks=False)
+        try:
+            os.replace(tmp_filename, self.__file, src_dir_fd=tmp_dir_fd, dst_dir_fd=dir_fd)
+        except OSError:
+            os.unlink(tmp_filename, dir_fd=tmp_dir_fd)
+            raise
+
+    def move_to(self, destination: str, dir_fd: int = None) -> None:
+        """
+        Atomically rename file into destination, which must be on the same device of file
+        :param destination: destination directory
+        :param dir_fd: open descriptor of destination, see link_to()
+        :raise OSError if file can not be renamed (e.g. different devices)
+        """
+        if dir_fd is None:
+            os.replace(self.__filename, f"{destination}/{self.__file}")
+        else:
+            os.replace(self.__filename, self.__file, dst_dir_fd=dir_fd)
@@ -0,0 +1,135 @@
+import fnmatch
+import re
+from typing import List, Tuple
+
+
+class PatternMatcher(object):
+    """
+    Matches file names against a list of patterns at once:
+        - suffixes ('.jpg', '.tar.gz'): stored in a trie of reversed suffixes, so all
+          suffixes of a name are found by a single walk from its last character
+        - globs ('glob:IMG_*.jpg') and regular expressions ('re:^report-\\d+\\.csv$'):
+          combined in one regular expression with a named group for each pattern,
+          each in an optional lookahead, so a single match reports all of them.
+          Expressions which can not be embedded in another one (with groups, and so
+          possibly back references, or global inline flags) are matched one by one
+    Patterns are matched against the whole file name and are case insensitive.
+    """
+
+    GLOB_PREFIX = "glob:"
+    REGEX_PREFIX = "re:"
+    SUFFIX_PREFIX = "."
+
+    FLAGS = re.IGNORECASE | re.DOTALL
+
+    # trie key of the pattern ending at a node
+    __END = None
+    # flags of expressions without global inline flags
+    __BASE_FLAGS = re.compile("").flags
+
+    def __init__(self, patterns: List[str]):
+        """
+
+        :param patterns: patterns, identified by their position
+        :raise ValueError if a pattern is not valid
+        """
+        super().__init__()
+
+        self.__patterns = list(patterns)
+        self.__suffixes = {}
+        expressions = []
+        # [(pattern id, compiled expression)] matched one by one
+        self.__separate = []
+        for pattern_id, pattern in enumerate(self.__patterns):
+            kind, value = PatternMatcher.parse(pattern)
+            if kind == PatternMatcher.SUFFIX_PREFIX:
+                self.__add_suffix(value, pattern_id)
+                continue
+
+            expression = fnmatch.translate(value) if kind == PatternMatcher.GLOB_PREFIX else value
+            try:
+                compiled = re.compile(expression, PatternMatcher.FLAGS)
+            except re.error as e:
+                raise ValueError(f"Invalid pattern '{pattern}': {e}")
+            if PatternMatcher.__combinable(expression, compiled):
+                expressions.append(f"(?:(?=(?P<p{pattern_id}>(?:{expression}))\\Z))?")
+            else:
+                self.__separate.append((pattern_id, compiled))
+
+        self.__expression = None
+        if len(expressions) > 0:
+            self.__expression = re.compile("".join(expressions), PatternMatcher.FLAGS)
+
+    @staticmethod
+    def __combinable(expression: str, compiled: re.Pattern) -> bool:
+        """
+        :return: True iff expression has neither groups (back references and group names
+            would refer to groups of other expressions) nor global inline flags
+        """
+        # inline flags are told apart from FLAGS compiling without them
+        return compiled.groups == 0 and re.compile(expression).flags == PatternMatcher.__BASE_FLAGS
+
+    @staticmethod
+    def parse(pattern: str) -> Tuple[str, str]:
+        """
+        :return: kind of pattern (one of GLOB_PREFIX, REGEX_PREFIX, SUFFIX_PREFIX) and its value
+        :raise ValueError if pattern is not valid
+        """
+        for prefix in (PatternMatcher.GLOB_PREFIX, PatternMatcher.REGEX_PREFIX):
+            if pattern.startswith(prefix):
+                if len(pattern) == len(prefix):
+                    raise ValueError(f"Empty pattern '{pattern}'")
+                return prefix, pattern[len(prefix):]
+        if not pattern.startswith(PatternMatcher.SUFFIX_PREFIX) or len(pattern) == 1:
+            raise ValueError(
+                f"Invalid pattern '{pattern}': expected an extension ('.jpg', '.tar.gz'), "
+                f"'{PatternMatcher.GLOB_PREFIX}' or '{PatternMatcher.REGEX_PREFIX}' pattern"
+            )
+        return PatternMatcher.SUFFIX_PREFIX, pattern.lower()
+
+    @staticmethod
+    def normalize(pattern: str) -> str:
+        """
+        Suffixes are lowercased, expressions are kept as they are
+        """
+        if pattern.startswith((PatternMatcher.GLOB_PREFIX, PatternMatcher.REGEX_PREFIX)):
+            return pattern
+        return pattern.lower()
+
+    def __add_suffix(self, suffix: str, pattern_id: int) -> None:
+        node = self.__suffixes
+        for char in reversed(suffix):
+            node = node.setdefault(char, {})
+        node.setdefault(PatternMatcher.__END, []).append(pattern_id)
+
+    def match(self, name: str) -> Tuple[int, ...]:
+        """
+        :param name: file name (without directory)
+        :return: sorted identifiers of patterns matching name
+        """
+        matched = []
+
+        # a suffix must leave a non empty stem, as extensions do
+        node = self.__suffixes
+        lowered = name.lower()
+        for depth in range(len(lowered) - 1, 0, -1):
+            node = node.get(lowered[depth])
+            if node is None:
+                break
+            ids = node.get(PatternMatcher.__END)
+            if ids is not None:
+                matched.extend(ids)
+
+        if self.__expression is not None:
+            groups = self.__expression.match(name).groupdict()
+            matched.extend(int(group[1:]) for group, value in groups.items() if value is not None)
+        matched.extend(pattern_id for pattern_id, compiled in self.__separate if compiled.fullmatch(name) is not None)
+
+        return tuple(sorted(matched))
+
+    @property
+    def patterns(self) -> List[str]:
+        return self.__patterns
+
+    def __len__(self):
+        return len(self.__patterns)
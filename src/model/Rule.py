@@ -6,13 +6,15 @@ class Rule(object):
 
     """
 
-    def __init__(self, name: str, formats: List[str], sources: List[str], destinations: List[str]):
+    def __init__(self, name: str, formats: List[str], sources: List[str], destinations: List[str],
+                 mime: List[str] = None):
         super().__init__()
 
         self.__name = name
         self.__formats = formats
         self.__sources = sources
         self.__destinations = destinations
+        self.__mime = mime or []
 
     @property
     def name(self) -> str:
@@ -29,3 +31,7 @@ class Rule(object):
     @property
     def destinations(self) -> List[str]:
         return self.__destinations
+
+    @property
+    def mime(self) -> List[str]:
+        return self.__mime
@@ -1,6 +1,8 @@
 from typing import List
 
+from model.PatternMatcher import PatternMatcher
 from model.Rule import Rule
+from model.RuleIndex import RuleIndex
 from util import Validation
 
 
@@ -12,6 +14,7 @@ class RuleBuilder(object):
     K_FORMATS = "formats"
     K_SOURCES = "sources"
     K_DESTINATIONS = "destinations"
+    K_MIME = "mime"
 
     def __init__(self):
         super().__init__()
@@ -19,9 +22,10 @@ class RuleBuilder(object):
     @classmethod
     def _retrieve_format_list(cls, rule: dict, formats: dict) -> List[str]:
         formats_list = []
-        for frt in rule[cls.K_FORMATS]:
+        # rules may classify files only by content
+        for frt in rule.get(cls.K_FORMATS, []):
             for _frt in formats[frt]:
-                formats_list.append(_frt.lower())
+                formats_list.append(PatternMatcher.normalize(_frt))
         return formats_list
 
     @classmethod
@@ -32,6 +36,10 @@ class RuleBuilder(object):
     def _retrieve_destination_list(cls, rule: dict, destinations: dict) -> List[str]:
         return [destinations[dst] for dst in rule[cls.K_DESTINATIONS]]
 
+    @classmethod
+    def _retrieve_mime_list(cls, rule: dict) -> List[str]:
+        return [mime.lower() for mime in rule.get(cls.K_MIME, [])]
+
     @classmethod
     def build_list(cls, rules: dict, formats: dict,
                    sources: dict, destinations: dict) -> List[Rule]:
@@ -41,7 +49,17 @@ class RuleBuilder(object):
                 rule,
                 cls._retrieve_format_list(rules[rule], formats),
                 cls._retrieve_source_list(rules[rule], sources),
-                cls._retrieve_destination_list(rules[rule], destinations)
+                cls._retrieve_destination_list(rules[rule], destinations),
+                cls._retrieve_mime_list(rules[rule])
             ))
 
         return rules_list
+
+    @classmethod
+    def build_index(cls, rules: dict, formats: dict,
+                    sources: dict, destinations: dict, recursive: dict = None) -> RuleIndex:
+        """
+        :param recursive: layout (see RuleIndex.LAYOUTS) for each recursive source key
+        """
+        recursive_sources = {sources[src]: layout for src, layout in (recursive or {}).items()}
+        return RuleIndex(cls.build_list(rules, formats, sources, destinations), recursive_sources)
@@ -0,0 +1,178 @@
+from os.path import abspath, normpath, realpath, split
+from typing import Dict, List, Optional, Tuple
+
+from model.ContentSniffer import ContentSniffer
+from model.File import File
+from model.PatternMatcher import PatternMatcher
+from model.Rule import Rule
+from model.SourceTrie import SourceTrie
+
+
+class RuleIndex(object):
+    """
+    Compiled view of a list of rules.
+
+    Formats of all rules are compiled in a single PatternMatcher, so a file name
+        is classified against every rule in one pass; the patterns it matches and
+        its source are then mapped to the deduplicated tuple of destinations it
+        must be dispatched to (computed once for each combination), so matching
+        a file does not touch the filesystem.
+    Rules with MIME types also match files by content: only files of their sources
+        are sniffed by a ContentSniffer, once (see File.content_type()).
+    Files in sub directories of recursive sources are resolved to their source by
+        a SourceTrie; with the tree layout their relative sub directory is kept
+        in destinations.
+    """
+
+    # files of sub directories are dispatched directly into destinations
+    LAYOUT_FLAT = "flat"
+    # files of sub directories are dispatched into the same sub directories of destinations
+    LAYOUT_TREE = "tree"
+    LAYOUTS = (LAYOUT_FLAT, LAYOUT_TREE)
+
+    def __init__(self, rules: List[Rule], recursive: Dict[str, str] = None):
+        """
+
+        :param rules: rules to compile
+        :param recursive: layout for each recursive source directory, one of LAYOUTS
+        """
+        super().__init__()
+
+        self.__rules = rules
+        self.__recursive = {RuleIndex.normalize(source): layout for source, layout in (recursive or {}).items()}
+        self.__matcher = PatternMatcher(list(dict.fromkeys(frt for rule in rules for frt in rule.formats)))
+        self.__index = self.__compile(rules)
+        # source -> [(rule index, compiled MIME types)]
+        self.__mime = self.__compile_mime(rules)
+        self.__sniffer = ContentSniffer() if len(self.__mime) > 0 else None
+        # (source, patterns identifiers, MIME type) -> (destinations, rule names)
+        self.__combinations = {}
+        self.__sources = self.__compile_sources(rules)
+
+    @staticmethod
+    def normalize(path: str) -> str:
+        return normpath(abspath(path))
+
+    def __compile(self, rules: List[Rule]) -> Dict[Tuple[str, int], Tuple[int, ...]]:
+        """
+        :return: (source, pattern identifier) -> indexes of rules, in order
+        """
+        pattern_ids = {pattern: pattern_id for pattern_id, pattern in enumerate(self.__matcher.patterns)}
+        index = {}
+        for rule_id, rule in enumerate(rules):
+            for source in rule.sources:
+                for frt in rule.formats:
+                    rule_ids = index.setdefault((RuleIndex.normalize(source), pattern_ids[frt]), [])
+                    if rule_id not in rule_ids:
+                        rule_ids.append(rule_id)
+
+        return {key: tuple(rule_ids) for key, rule_ids in index.items()}
+
+    @staticmethod
+    def __compile_mime(rules: List[Rule]) -> Dict[str, List[Tuple[int, Tuple[frozenset, Tuple[str, ...]]]]]:
+        mime = {}
+        for rule_id, rule in enumerate(rules):
+            if len(rule.mime) == 0:
+                continue
+            types = ContentSniffer.compile_types(rule.mime)
+            for source in dict.fromkeys(RuleIndex.normalize(source) for source in rule.sources):
+                mime.setdefault(source, []).append((rule_id, types))
+        return mime
+
+    def __combine(self, source: str, pattern_ids: Tuple[int, ...],
+                  mime: str = None) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+        """
+        :return: deduplicated destinations and names of the rules of source matching
+            any of pattern_ids or MIME type mime
+        """
+        key = (source, pattern_ids, mime)
+        combination = self.__combinations.get(key)
+        if combination is None:
+            rule_ids = {rule_id for pattern_id in pattern_ids for rule_id in self.__index.get((source, pattern_id), ())}
+            if mime is not None:
+                rule_ids.update(rule_id for rule_id, types in self.__mime.get(source, ()) if ContentSniffer.matches(types, mime))
+            rule_ids = sorted(rule_ids)
+            destinations = []
+            for rule_id in rule_ids:
+                destinations.extend(d for d in self.__rules[rule_id].destinations if d not in destinations)
+            combination = (tuple(destinations), tuple(self.__rules[rule_id].name for rule_id in rule_ids))
+            # concurrent misses compute the same value
+            self.__combinations[key] = combination
+        return combination
+
+    def __compile_sources(self, rules: List[Rule]) -> SourceTrie:
+        sources = SourceTrie()
+        for rule in rules:
+            for source in rule.sources:
+                normalized = RuleIndex.normalize(source)
+                layout = self.__recursive.get(normalized)
+                # events may carry either the configured path or the resolved one
+                #  (resolution is done only once, here)
+                for src in {normalized, realpath(source)}:
+                    sources.add(src, (normalized, layout == RuleIndex.LAYOUT_TREE), layout is not None)
+        return sources
+
+    def match(self, filename: str, file: File = None) -> Tuple[Tuple[str, ...], str]:
+        """
+        Destinations for filename, computed from the event path only unless
+            a rule of its source matches content types
+        :param filename: path of the file which triggered the event
+        :param file: file of filename, sniffed if rules of its source match content types
+        :return: deduplicated destinations, empty if no rule matches, and the sub directory
+            to dispatch filename into ('' to dispatch it directly into destinations)
+        """
+        resolved = self.__resolve(filename, file)
+        if resolved is None:
+            return (), ""
+
+        key, subdirectory = resolved
+        return self.__combine(*key)[0], subdirectory
+
+    def rule_names(self, filename: str, file: File = None) -> Tuple[str, ...]:
+        """
+        :param filename: path of the file which triggered the event
+        :param file: file of filename, see match()
+        :return: names of the rules matching filename
+        """
+        resolved = self.__resolve(filename, file)
+        return () if resolved is None else self.__combine(*resolved[0])[1]
+
+    def accepts(self, filename: str) -> bool:
+        """
+        :param filename: path of the file which triggered the event
+        :return: True iff a rule of the source of filename matches its name, or
+            may match its content
+        """
+        resolved = self.__resolve(filename)
+        if resolved is None:
+            return False
+        (source, pattern_ids, _), _ = resolved
+        return source in self.__mime or len(self.__combine(source, pattern_ids)[0]) > 0
+
+    def __resolve(self, filename: str, file: File = None) -> Optional[Tuple[Tuple[str, Tuple[int, ...], str], str]]:
+        directory, name = split(RuleIndex.normalize(filename))
+        resolved = self.__sources.resolve(directory)
+        if resolved is None:
+            return None
+
+        (source, tree), subdirectory = resolved
+        mime = None
+        if file is not None and source in self.__mime:
+            mime = file.content_type(self.__sniffer)
+        return (source, self.__matcher.match(name), mime), subdirectory if tree else ""
+
+    def is_recursive(self, source: str) -> bool:
+        return RuleIndex.normalize(source) in self.__recursive
+
+    def owns(self, directory: str) -> bool:
+        """
+        :return: True iff files in directory are dispatched by some rule's source
+        """
+        return self.__sources.resolve(directory) is not None
+
+    @property
+    def rules(self) -> List[Rule]:
+        return self.__rules
+
+    def __len__(self):
+        return len(self.__rules)
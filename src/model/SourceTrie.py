@@ -0,0 +1,71 @@
+import os
+from typing import Any, Optional, Tuple
+
+
+class SourceTrie(object):
+    """
+    Prefix tree over the path components of source directories.
+
+    Resolves any directory to the source owning it, together with the path of the
+        directory relative to that source, walking at most one node per component:
+        no filesystem access is needed.
+    Sub directories are owned by a source only if it is recursive; when sources are
+        nested the deepest owner wins.
+    """
+
+    # node key holding (value, recursive) of a source
+    __SOURCE = None
+
+    def __init__(self):
+        super().__init__()
+
+        self.__root = {}
+        self.__size = 0
+
+    @staticmethod
+    def __components(path: str) -> list:
+        return os.path.normpath(os.path.abspath(path)).split(os.sep)[1:]
+
+    def add(self, source: str, value: Any, recursive: bool = False) -> None:
+        """
+        :param source: source directory
+        :param value: value returned when resolving directories owned by source
+        :param recursive: source owns its sub directories too
+        """
+        node = self.__root
+        for component in SourceTrie.__components(source):
+            if component:
+                node = node.setdefault(component, {})
+        if SourceTrie.__SOURCE not in node:
+            self.__size += 1
+        node[SourceTrie.__SOURCE] = (value, recursive)
+
+    def resolve(self, directory: str) -> Optional[Tuple[Any, str]]:
+        """
+        :param directory: directory to resolve
+        :return: value of the source owning directory and path of directory relative
+            to it ('' for the source itself), None if no source owns directory
+        """
+        components = [component for component in SourceTrie.__components(directory) if component]
+        node = self.__root
+        owner = None
+        for depth in range(len(components) + 1):
+            source = node.get(SourceTrie.__SOURCE)
+            if source is not None and (source[1] or depth == len(components)):
+                owner = source[0], depth
+            if depth == len(components):
+                break
+            node = node.get(components[depth])
+            if node is None:
+                break
+
+        if owner is None:
+            return None
+        return owner[0], os.sep.join(components[owner[1]:])
+
+    def get(self, directory: str, default: Any = None) -> Any:
+        resolved = self.resolve(directory)
+        return default if resolved is None else resolved[0]
+
+    def __len__(self):
+        return self.__size
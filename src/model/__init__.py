@@ -1,5 +1,9 @@
 from model.RuleBuilder import RuleBuilder
 from model.Rule import Rule
+from model.SourceTrie import SourceTrie
+from model.PatternMatcher import PatternMatcher
+from model.ContentSniffer import ContentSniffer
+from model.RuleIndex import RuleIndex
 
 from model.File import File
 
@@ -8,6 +12,10 @@ from model.DispatcherConfig import DispatcherConfig
 __all__ = [
     "RuleBuilder",
     "Rule",
+    "SourceTrie",
+    "PatternMatcher",
+    "ContentSniffer",
+    "RuleIndex",
     "File",
     "DispatcherConfig"
 ]
@@ -1,8 +1,11 @@
 import logging
 import logging.config
+import logging.handlers
+import queue
 import sys
 import threading
 from enum import Enum
+from typing import List
 
 from util import Validation
 
@@ -22,9 +25,14 @@ class LogManager(object):
     _HANDLER_CONSOLE = None
     _LOG_FILENAME = None
     _HANDLER_FILE = None
+    _HANDLER_QUEUE = None
+    _LISTENER = None
 
     _FORMATTER = None
 
+    # level of console handler, file handler logs everything
+    CONSOLE_LEVEL = logging.INFO
+
     def __init__(self):
         if LogManager.__INSTANCE is not None:
             raise LogManager.MultipleInstancesException(LogManager)
@@ -42,7 +50,14 @@ class LogManager(object):
         return cls.__INSTANCE
 
     @classmethod
-    def load(cls, log_filename: str = None) -> None:
+    def load(cls, log_filename: str = None, asynchronous: bool = False) -> None:
+        """
+        Configure loggers with console handler and, if log_filename is specified, file handler
+        :param log_filename: log file
+        :param asynchronous: if True, loggers only enqueue records, which are written
+            by a listener thread flushing handlers once per batch, so logging threads
+            never wait for I/O
+        """
         if log_filename is not None:
             from pathlib import Path
             from util import Validation
@@ -53,14 +68,22 @@ class LogManager(object):
             # formatters
             cls._FORMATTER = LogManager.__configure_formatter()
             # handlers
-            cls._HANDLER_CONSOLE = LogManager.__configure_handler_console()
+            cls._HANDLER_CONSOLE = LogManager.__configure_handler_console(asynchronous)
             if log_filename is not None:
                 LogManager._LOG_FILENAME = log_filename
-                cls._HANDLER_FILE = LogManager.__configure_handler_file(log_filename)
+                cls._HANDLER_FILE = LogManager.__configure_handler_file(log_filename, asynchronous)
+            if asynchronous:
+                records = queue.SimpleQueue()
+                cls._LISTENER = LogManager.Listener(records, cls.__handlers())
+                cls._LISTENER.start()
+                cls._HANDLER_QUEUE = LogManager.LocalQueueHandler(records)
             # loggers
             cls._LOGGER_ROOT = LogManager.__configure_logger_root()
             cls._LOGGER_OBSERVER = LogManager.__configure_logger_observer()
             cls._LOGGER_DISPATCHER = LogManager.__configure_logger_dispatcher()
+            # records below handlers levels are not even created
+            for logger in (cls._LOGGER_ROOT, cls._LOGGER_OBSERVER, cls._LOGGER_DISPATCHER):
+                logger.setLevel(LogManager.level(log_filename))
 
     @classmethod
     def load_from(cls, log_config_file: str) -> None:
@@ -74,6 +97,43 @@ class LogManager(object):
             cls._LOGGER_OBSERVER = logging.getLogger(LogManager.Logger.OBSERVER.value)
             cls._LOGGER_DISPATCHER = logging.getLogger(LogManager.Logger.DISPATCHER.value)
 
+    @classmethod
+    def load_queue(cls, queue, level: int = logging.DEBUG) -> None:
+        """
+        Configure loggers to only send records to queue, which is consumed by
+            another process (e.g. shards supervisor)
+        :param queue: queue shared with consumer process
+        :param level: lowest level handled by consumer process (see level())
+        """
+        with cls.__LOCK:
+            cls._HANDLER_QUEUE = logging.handlers.QueueHandler(queue)
+            loggers = []
+            for logger in LogManager.Logger:
+                queue_logger = logging.getLogger(logger.value)
+                queue_logger.setLevel(level)
+                queue_logger.handlers = [cls._HANDLER_QUEUE]
+                queue_logger.propagate = logger == LogManager.Logger.ROOT
+                loggers.append(queue_logger)
+            cls._LOGGER_ROOT, cls._LOGGER_OBSERVER, cls._LOGGER_DISPATCHER = loggers
+
+    @classmethod
+    def is_loaded(cls) -> bool:
+        return cls._LOGGER_ROOT is not None
+
+    @staticmethod
+    def level(log_filename: str = None) -> int:
+        """
+        Lowest level handled by handlers configured by load()
+        """
+        return logging.DEBUG if log_filename is not None else LogManager.CONSOLE_LEVEL
+
+    @classmethod
+    def __handlers(cls) -> List[logging.Handler]:
+        handlers = [cls._HANDLER_CONSOLE]
+        if cls._HANDLER_FILE is not None:
+            handlers.append(cls._HANDLER_FILE)
+        return handlers
+
     class Logger(Enum):
         ROOT = "root"
         OBSERVER = "observer"
@@ -94,13 +154,20 @@ class LogManager(object):
 
     @classmethod
     def shutdown(cls) -> None:
+        # pending records are written before handlers are closed
+        if cls._LISTENER is not None:
+            cls._LISTENER.stop()
+            cls._LISTENER = None
         logging.shutdown()
 
     @staticmethod
     def __configure_logger_root() -> logging.Logger:
         root_logger = logging.getLogger(LogManager.Logger.ROOT.value)
         root_logger.setLevel(logging.DEBUG)
-        root_logger.addHandler(LogManager._HANDLER_CONSOLE)
+        if LogManager._HANDLER_QUEUE is not None:
+            root_logger.addHandler(LogManager._HANDLER_QUEUE)
+        else:
+            root_logger.addHandler(LogManager._HANDLER_CONSOLE)
         return root_logger
 
     @staticmethod
@@ -108,6 +175,9 @@ class LogManager(object):
         observer_logger = logging.getLogger(LogManager.Logger.OBSERVER.value)
         observer_logger.setLevel(logging.DEBUG)
         observer_logger.propagate = 0
+        if LogManager._HANDLER_QUEUE is not None:
+            observer_logger.addHandler(LogManager._HANDLER_QUEUE)
+            return observer_logger
         observer_logger.addHandler(LogManager._HANDLER_CONSOLE)
         if LogManager._LOG_FILENAME is not None:
             observer_logger.addHandler(LogManager._HANDLER_FILE)
@@ -118,22 +188,31 @@ class LogManager(object):
         dispatcher_logger = logging.getLogger(LogManager.Logger.DISPATCHER.value)
         dispatcher_logger.setLevel(logging.DEBUG)
         dispatcher_logger.propagate = 0
+        if LogManager._HANDLER_QUEUE is not None:
+            dispatcher_logger.addHandler(LogManager._HANDLER_QUEUE)
+            return dispatcher_logger
         dispatcher_logger.addHandler(LogManager._HANDLER_CONSOLE)
         if LogManager._LOG_FILENAME is not None:
             dispatcher_logger.addHandler(LogManager._HANDLER_FILE)
         return dispatcher_logger
 
     @staticmethod
-    def __configure_handler_console() -> logging.Handler:
-        console_handler = logging.StreamHandler(sys.stdout)
-        console_handler.setLevel(logging.INFO)
+    def __configure_handler_console(buffered: bool = False) -> logging.Handler:
+        if buffered:
+            console_handler = LogManager.BufferedStreamHandler(sys.stdout)
+        else:
+            console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setLevel(LogManager.CONSOLE_LEVEL)
         # console_handler.setLevel(logging.DEBUG)
         console_handler.setFormatter(LogManager._FORMATTER)
         return console_handler
 
     @staticmethod
-    def __configure_handler_file(log_filename: str) -> logging.Handler:
-        file_handler = logging.FileHandler(log_filename)
+    def __configure_handler_file(log_filename: str, buffered: bool = False) -> logging.Handler:
+        if buffered:
+            file_handler = LogManager.BufferedFileHandler(log_filename)
+        else:
+            file_handler = logging.FileHandler(log_filename)
         file_handler.setLevel(logging.DEBUG)
         file_handler.setFormatter(LogManager._FORMATTER)
         return file_handler
@@ -143,6 +222,76 @@ class LogManager(object):
         f = "[%(levelname)-7s] | %(asctime)s | [%(name)s] %(funcName)s (%(module)s:%(lineno)s) - %(message)s"
         return logging.Formatter(f)
 
+    class LocalQueueHandler(logging.handlers.QueueHandler):
+        """
+        Queue handler for a queue consumed in the same process: records are enqueued
+            as they are, so even formatting is done by the listener thread
+        """
+
+        def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+            return record
+
+    class BufferedStreamHandler(logging.StreamHandler):
+        """
+        Stream handler not flushing every record, flushed by Listener once per batch
+        """
+
+        def emit(self, record: logging.LogRecord) -> None:
+            try:
+                self.stream.write(self.format(record) + self.terminator)
+            except RecursionError:
+                raise
+            except Exception:
+                self.handleError(record)
+
+    class BufferedFileHandler(logging.FileHandler):
+        """
+        File handler not flushing every record, flushed by Listener once per batch
+        """
+
+        def emit(self, record: logging.LogRecord) -> None:
+            if self.stream is None:
+                self.stream = self._open()
+            LogManager.BufferedStreamHandler.emit(self, record)
+
+    class Listener(threading.Thread):
+        """
+        Thread writing records enqueued by loggers: records are taken in batches
+            and handlers are flushed once per batch
+        """
+
+        BATCH = 512
+
+        def __init__(self, records: queue.SimpleQueue, handlers: List[logging.Handler]):
+            super().__init__(name=self.__class__.__name__, daemon=True)
+
+            self.__records = records
+            self.__handlers = handlers
+
+        def run(self) -> None:
+            stopped = False
+            while not stopped:
+                batch = [self.__records.get()]
+                try:
+                    while len(batch) < LogManager.Listener.BATCH:
+                        batch.append(self.__records.get_nowait())
+                except queue.Empty:
+                    pass
+
+                for record in batch:
+                    if record is None:
+                        stopped = True
+                        continue
+                    for handler in self.__handlers:
+                        if record.levelno >= handler.level:
+                            handler.handle(record)
+                for handler in self.__handlers:
+                    handler.flush()
+
+        def stop(self) -> None:
+            self.__records.put(None)
+            self.join()
+
     class MultipleInstancesException(Exception):
         """
 
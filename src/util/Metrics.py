@@ -0,0 +1,190 @@
+import bisect
+import threading
+from typing import Callable, Dict, Tuple
+
+from util.StageHooks import StageHooks
+
+
+class Metrics(object):
+    """
+    Process wide registry of counters, gauges and histograms, rendered in
+        Prometheus text exposition format.
+
+    Metrics are disabled by default. Once enabled, stages of the dispatch pipeline
+        are recorded through a StageHooks hook.
+    """
+
+    __INSTANCE = None
+    __LOCK = threading.Lock()
+
+    # histogram, seconds spent in each stage of a file (label: stage)
+    STAGE_SECONDS = "dispatcher_stage_seconds"
+    # counter, bytes copied (label: destination)
+    BYTES_COPIED = "dispatcher_bytes_copied_total"
+    # counter, dispatched files (label: result)
+    FILES = "dispatcher_files_total"
+    # counter, dispatching errors (label: rule)
+    ERRORS = "dispatcher_errors_total"
+    # gauge, files admitted by the queue
+    QUEUE_DEPTH = "dispatcher_queue_depth"
+    # gauge, files waiting for transfer completion or being dispatched
+    IN_FLIGHT = "dispatcher_in_flight"
+    # histogram, files dispatched together
+    BATCH_FILES = "dispatcher_batch_files"
+    # histogram, seconds spent by batches collecting files and dispatching them (label: phase)
+    BATCH_SECONDS = "dispatcher_batch_seconds"
+
+    COUNTER = "counter"
+    GAUGE = "gauge"
+    HISTOGRAM = "histogram"
+
+    DESCRIPTIONS = {
+        STAGE_SECONDS: (HISTOGRAM, "Seconds spent by files in each stage"),
+        BYTES_COPIED: (COUNTER, "Bytes copied to each destination"),
+        FILES: (COUNTER, "Files dispatched, by result"),
+        ERRORS: (COUNTER, "Dispatching errors, by rule"),
+        QUEUE_DEPTH: (GAUGE, "Files admitted by the dispatch queue"),
+        IN_FLIGHT: (GAUGE, "Files waiting for transfer completion or being dispatched"),
+        BATCH_FILES: (HISTOGRAM, "Files dispatched together in a batch"),
+        BATCH_SECONDS: (HISTOGRAM, "Seconds spent by batches in each phase")
+    }
+
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    # histograms not measuring seconds
+    HISTOGRAM_BUCKETS = {
+        BATCH_FILES: (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+    }
+
+    def __init__(self):
+        if Metrics.__INSTANCE is not None:
+            raise Metrics.MultipleInstancesException(Metrics)
+
+        super().__init__()
+
+        Metrics.__INSTANCE = self
+        self.__enabled = False
+        self.__lock = threading.Lock()
+        # (name, labels) -> value
+        self.__counters = {}
+        # (name, labels) -> [buckets counts, sum, count]
+        self.__histograms = {}
+        # name -> callback
+        self.__gauges = {}
+
+    @classmethod
+    def get_instance(cls) -> "Metrics":
+        if cls.__INSTANCE is None:
+            with cls.__LOCK:
+                if cls.__INSTANCE is None:
+                    Metrics()
+        return cls.__INSTANCE
+
+    def enable(self) -> None:
+        self.__enabled = True
+        StageHooks.register(self.record)
+
+    def record(self, context: StageHooks.Context) -> None:
+        """
+        Stage hook
+        """
+        self.observe(Metrics.STAGE_SECONDS, context.elapsed, stage=context.stage)
+        if context.stage == StageHooks.COPY:
+            if context.error is None:
+                self.inc(Metrics.BYTES_COPIED, context.labels.get("bytes", 0), destination=context.labels.get("destination"))
+        elif context.stage == StageHooks.DISPATCH:
+            self.inc(Metrics.FILES, result="success" if context.error is None else "error")
+            if context.error is not None:
+                for rule in context.labels.get("rules", ()):
+                    self.inc(Metrics.ERRORS, rule=rule)
+
+    @property
+    def enabled(self) -> bool:
+        return self.__enabled
+
+    @staticmethod
+    def __labels(labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        if not self.__enabled:
+            return
+        key = (name, Metrics.__labels(labels))
+        with self.__lock:
+            self.__counters[key] = self.__counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        if not self.__enabled:
+            return
+        key = (name, Metrics.__labels(labels))
+        buckets = Metrics.HISTOGRAM_BUCKETS.get(name, Metrics.BUCKETS)
+        bucket = bisect.bisect_left(buckets, value)
+        with self.__lock:
+            histogram = self.__histograms.get(key)
+            if histogram is None:
+                histogram = self.__histograms[key] = [[0] * len(buckets), 0.0, 0]
+            if bucket < len(buckets):
+                histogram[0][bucket] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def gauge(self, name: str, callback: Callable[[], float]) -> None:
+        """
+        Register a gauge, whose value is computed by callback when rendered
+        """
+        with self.__lock:
+            self.__gauges[name] = callback
+
+    @staticmethod
+    def __escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+    @staticmethod
+    def __format(name: str, labels: Tuple[Tuple[str, str], ...], value: float) -> str:
+        if len(labels) == 0:
+            return f"{name} {value}"
+        text = ",".join(f'{k}="{Metrics.__escape(v)}"' for k, v in labels)
+        return f"{name}{{{text}}} {value}"
+
+    def render(self) -> str:
+        with self.__lock:
+            counters = dict(self.__counters)
+            histograms = {key: (list(buckets), total, count) for key, (buckets, total, count) in self.__histograms.items()}
+            gauges = dict(self.__gauges)
+
+        samples = {}
+        for (name, labels), value in counters.items():
+            samples.setdefault(name, []).append(Metrics.__format(name, labels, value))
+        for (name, labels), (buckets, total, count) in histograms.items():
+            lines = samples.setdefault(name, [])
+            cumulative = 0
+            for bound, bucket in zip(Metrics.HISTOGRAM_BUCKETS.get(name, Metrics.BUCKETS), buckets):
+                cumulative += bucket
+                lines.append(Metrics.__format(f"{name}_bucket", labels + (("le", str(bound)),), cumulative))
+            lines.append(Metrics.__format(f"{name}_bucket", labels + (("le", "+Inf"),), count))
+            lines.append(Metrics.__format(f"{name}_sum", labels, total))
+            lines.append(Metrics.__format(f"{name}_count", labels, count))
+        for name, callback in gauges.items():
+            samples.setdefault(name, []).append(Metrics.__format(name, (), callback()))
+
+        lines = []
+        for name in sorted(samples):
+            metric_type, description = Metrics.DESCRIPTIONS.get(name, (Metrics.GAUGE if name in gauges else Metrics.COUNTER, name))
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.extend(samples[name])
+        return "\n".join(lines) + "\n"
+
+    class MultipleInstancesException(Exception):
+        """
+
+        """
+
+        def __init__(self, *args):
+            super().__init__(f"Singleton instance: a second instance of {args[0]} can not be created")
+
+        def __str__(self):
+            if len(self.args) == 0:
+                return ""
+            if len(self.args) == 1:
+                return str(self.args[0])
+            return str(self.args[0][0])
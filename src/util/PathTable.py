@@ -0,0 +1,99 @@
+import os
+import stat
+from concurrent.futures.thread import ThreadPoolExecutor
+from typing import Container, Dict, Iterable
+
+
+class PathTable(object):
+    """
+    Table of paths resolved once: real path, status and permissions of every path
+        are collected concurrently (on network file systems each lookup is a round trip),
+        then checks are answered from the table.
+    Checks raise the same exceptions of the corresponding Validation ones.
+    """
+
+    DEFAULT_THREADS = 16
+
+    class Entry(object):
+        """
+        Resolved path: stat is None if path does not exist
+        """
+
+        __slots__ = ("path", "realpath", "stat", "readable", "writable")
+
+        def __init__(self, path: str):
+            self.path = path
+            self.realpath = os.path.realpath(path)
+            try:
+                self.stat = os.stat(path)
+            except OSError:
+                self.stat = None
+            self.readable = self.stat is not None and os.access(path, os.R_OK)
+            self.writable = self.stat is not None and os.access(path, os.W_OK)
+
+        @property
+        def is_dir(self) -> bool:
+            return self.stat is not None and stat.S_ISDIR(self.stat.st_mode)
+
+    def __init__(self, paths: Iterable[str], threads: int = DEFAULT_THREADS):
+        """
+
+        :param paths: paths to resolve, duplicates are resolved once
+        :param threads: threads resolving paths
+        """
+        super().__init__()
+
+        paths = list(dict.fromkeys(paths))
+        self.__entries = {}
+        if len(paths) > 0:
+            with ThreadPoolExecutor(max_workers=max(1, min(threads, len(paths))), thread_name_prefix="PathTable") as pool:
+                for entry in pool.map(PathTable.Entry, paths):
+                    self.__entries[entry.path] = entry
+
+    def __getitem__(self, path: str) -> "PathTable.Entry":
+        entry = self.__entries.get(path)
+        if entry is None:
+            entry = self.__entries[path] = PathTable.Entry(path)
+        return entry
+
+    def refresh(self, path: str) -> "PathTable.Entry":
+        """
+        Resolve path again (e.g. once created)
+        """
+        entry = self.__entries[path] = PathTable.Entry(path)
+        return entry
+
+    def realpaths(self, paths: Iterable[str]) -> Dict[str, str]:
+        """
+        :return: real path -> path, for paths
+        """
+        return {self[path].realpath: path for path in paths}
+
+    def is_dir(self, path: str, msg: str = "") -> None:
+        if not self[path].is_dir:
+            raise NotADirectoryError(msg)
+
+    def can_read(self, path: str, msg: str = "") -> None:
+        if not self[path].readable:
+            raise PermissionError(msg)
+
+    def can_write(self, path: str, msg: str = "") -> None:
+        if not self[path].writable:
+            raise PermissionError(msg)
+
+    def is_dir_writeable(self, path: str, msg: str = "") -> None:
+        self.is_dir(path, msg)
+        self.can_write(path, msg)
+
+    def ancestor(self, path: str, realpaths: Container[str]) -> str:
+        """
+        :return: the nearest of realpaths containing the real path of path, None if no one does
+        """
+        parent = os.path.dirname(self[path].realpath)
+        while True:
+            if parent in realpaths:
+                return parent
+            grandparent = os.path.dirname(parent)
+            if grandparent == parent:
+                return None
+            parent = grandparent
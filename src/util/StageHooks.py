@@ -0,0 +1,111 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+
+class StageHooks(object):
+    """
+    Registry of hooks called at the end of every stage of the dispatch pipeline
+        (admission, stabilization, pool wait, match, copy for each destination,
+        link, move, delete and whole dispatching) with a timing Context.
+
+    Hooks run in the thread which completed the stage, so they must be fast and
+        thread safe; exceptions raised by hooks are ignored.
+    With no hook registered, stages cost only an attribute check.
+    """
+
+    ADMIT = "admit"
+    STABILIZE = "stabilize"
+    POOL = "pool"
+    MATCH = "match"
+    COPY = "copy"
+    LINK = "link"
+    MOVE = "move"
+    DELETE = "delete"
+    DISPATCH = "dispatch"
+    STAGES = (ADMIT, STABILIZE, POOL, MATCH, COPY, LINK, MOVE, DELETE, DISPATCH)
+
+    __LOCK = threading.Lock()
+    # copied on write, so emitting does not need the lock
+    __HOOKS = ()
+
+    class Context(object):
+        """
+        Timing context of a stage: error is the exception raised by the stage, if any,
+            labels carry stage specific information (e.g. destination and bytes for copies)
+        """
+
+        __slots__ = ("stage", "filename", "start", "elapsed", "error", "labels")
+
+        def __init__(self, stage: str, filename: str, start: float, elapsed: float = None,
+                     error: Exception = None, labels: Dict[str, object] = None):
+            self.stage = stage
+            self.filename = filename
+            self.start = start
+            self.elapsed = elapsed
+            self.error = error
+            self.labels = labels or {}
+
+        def __repr__(self):
+            return f"{self.__class__.__name__}({self.stage}, '{self.filename}', {self.elapsed}, {self.error}, {self.labels})"
+
+    @classmethod
+    def register(cls, hook: Callable[["StageHooks.Context"], None]) -> Callable[["StageHooks.Context"], None]:
+        """
+        Can be used as decorator
+        """
+        with cls.__LOCK:
+            if hook not in cls.__HOOKS:
+                cls.__HOOKS = cls.__HOOKS + (hook,)
+        return hook
+
+    @classmethod
+    def unregister(cls, hook: Callable[["StageHooks.Context"], None]) -> None:
+        with cls.__LOCK:
+            cls.__HOOKS = tuple(h for h in cls.__HOOKS if h is not hook)
+
+    @classmethod
+    def hooks(cls) -> List[Callable[["StageHooks.Context"], None]]:
+        return list(cls.__HOOKS)
+
+    @classmethod
+    def active(cls) -> bool:
+        return len(cls.__HOOKS) > 0
+
+    @classmethod
+    def emit(cls, stage: str, filename: str, elapsed: float, error: Exception = None, **labels) -> None:
+        """
+        Notify a stage timed by the caller
+        """
+        if len(cls.__HOOKS) == 0:
+            return
+        cls.__notify(StageHooks.Context(stage, filename, time.perf_counter() - elapsed, elapsed, error, labels))
+
+    @classmethod
+    @contextmanager
+    def stage(cls, stage: str, filename: str, **labels):
+        """
+        Time the block and notify it as stage; the Context is yielded (None if no hook
+            is registered) so the block can add labels
+        """
+        if len(cls.__HOOKS) == 0:
+            yield None
+            return
+        context = StageHooks.Context(stage, filename, time.perf_counter(), labels=labels)
+        try:
+            yield context
+        except Exception as e:
+            context.error = e
+            raise
+        finally:
+            context.elapsed = time.perf_counter() - context.start
+            cls.__notify(context)
+
+    @classmethod
+    def __notify(cls, context: "StageHooks.Context") -> None:
+        for hook in cls.__HOOKS:
+            try:
+                hook(context)
+            except Exception:
+                pass
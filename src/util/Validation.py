@@ -105,11 +105,6 @@ class Validation(object):
         if val in ("", None):
             raise ValueError(msg)
 
-    @staticmethod
-    def has_extension(val: str, msg: str = ""):
-        if '.' not in val:
-            raise ValidationException.MissingExtensionError(msg)
-
     @staticmethod
     def python_version(min_version: tuple, msg: str = "") -> None:
         actual_version = sys.version_info
@@ -159,8 +154,3 @@ class ValidationException(object):
 
         def __init__(self, *args, **kwargs):
             super().__init__(args, kwargs)
-
-    class MissingExtensionError(BaseException):
-
-        def __init__(self, *args, **kwargs):
-            super().__init__(args, kwargs)
@@ -1,6 +1,9 @@
 from util.Validation import Validation
 from util.Validation import ValidationException
 from util.Common import Common
+from util.PathTable import PathTable
 from util.LogManager import LogManager
+from util.StageHooks import StageHooks
+from util.Metrics import Metrics
 
-__all__ = ["Validation", "ValidationException", "Common", "LogManager"]
+__all__ = ["Validation", "ValidationException", "Common", "PathTable", "LogManager", "StageHooks", "Metrics"]
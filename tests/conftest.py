@@ -0,0 +1,9 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from util import LogManager  # noqa: E402
+
+if not LogManager.is_loaded():
+    LogManager.get_instance().load()
@@ -0,0 +1,258 @@
+import os
+import shutil
+import threading
+
+import pytest
+
+from control.dispatcher import DispatchJournal, FileDispatcher
+from model import RuleBuilder
+
+# records of a complete dispatch to two targets: intent, two targets written, source removed
+RECORDS = ["I", "W", "W", "R"]
+
+
+@pytest.fixture
+def tree(tmp_path):
+    for directory in ("S", "D1", "D2"):
+        (tmp_path / directory).mkdir()
+    source = tmp_path / "S" / "a.txt"
+    source.write_bytes(b"content")
+    return tmp_path, str(source), [str(tmp_path / "D1" / "a.txt"), str(tmp_path / "D2" / "a.txt")]
+
+
+def write_dispatch(journal_file, source, targets):
+    """
+    Journal a complete dispatch of source, writing targets as a dispatcher would
+    :return: lines of the journal
+    """
+    journal = DispatchJournal(journal_file)
+    dispatch_id = journal.begin(source, os.stat(source), targets)
+    for target in targets:
+        shutil.copyfile(source, target)
+        journal.written(dispatch_id, [target])
+    journal.removed(dispatch_id)
+    journal.close()
+    with open(journal_file, "rb") as file:
+        return file.readlines()
+
+
+def cut(journal_file, lines, records, torn=0):
+    """
+    Keep the first records lines of the journal, followed by torn bytes of the next one
+    """
+    with open(journal_file, "wb") as file:
+        file.writelines(lines[:records])
+        if torn > 0:
+            file.write(lines[records][:torn])
+
+
+class Resume(object):
+    """
+    Resume callback writing targets and removing source, as FileDispatcher.resume()
+    """
+
+    def __init__(self, error: Exception = None):
+        self.calls = []
+        self.error = error
+
+    def __call__(self, source, targets):
+        self.calls.append((source, targets))
+        if self.error is not None:
+            raise self.error
+        for target in targets:
+            shutil.copyfile(source, target)
+        os.unlink(source)
+
+
+def replay(journal_file, resume):
+    journal = DispatchJournal(journal_file)
+    try:
+        return journal.replay(resume), len(journal)
+    finally:
+        journal.close()
+
+
+def test_records(tree):
+    root, source, targets = tree
+    lines = write_dispatch(str(root / "journal"), source, targets)
+    assert [line.split(b" ", 1)[1][2:3].decode() for line in lines] == RECORDS
+
+
+@pytest.mark.parametrize("records", range(len(RECORDS) + 1))
+def test_replay_cut_at_each_record(tree, records):
+    root, source, targets = tree
+    journal_file = str(root / "journal")
+    lines = write_dispatch(journal_file, source, targets)
+    # crash after records: source is still in place until it is removed
+    cut(journal_file, lines, records)
+    resume = Resume()
+
+    outcomes, left = replay(journal_file, resume)
+
+    if records in (0, len(RECORDS)):
+        # nothing journaled, or dispatch completed
+        assert resume.calls == []
+        assert outcomes == {"completed": 0, "resumed": 0, "rolled back": 0}
+    else:
+        written = records - 1
+        assert resume.calls == [(source, targets[written:])]
+        assert outcomes == {"completed": 0, "resumed": 1, "rolled back": 0}
+        assert not os.path.exists(source)
+    assert all(os.path.exists(target) for target in targets)
+    assert left == 0
+    assert os.path.getsize(journal_file) == 0
+
+
+@pytest.mark.parametrize("records", range(len(RECORDS)))
+def test_replay_torn_record(tree, records):
+    root, source, targets = tree
+    journal_file = str(root / "journal")
+    lines = write_dispatch(journal_file, source, targets)
+    # last record torn by the crash: ignored, as if it was never written
+    cut(journal_file, lines, records, torn=len(lines[records]) - 1)
+    resume = Resume()
+
+    outcomes, _ = replay(journal_file, resume)
+
+    if records == 0:
+        assert resume.calls == []
+    else:
+        assert resume.calls == [(source, targets[records - 1:])]
+        assert outcomes["resumed"] == 1
+
+
+def test_replay_source_removed(tree):
+    root, source, targets = tree
+    journal_file = str(root / "journal")
+    cut(journal_file, write_dispatch(journal_file, source, targets), 2)
+    os.unlink(source)
+    resume = Resume()
+
+    outcomes, _ = replay(journal_file, resume)
+
+    assert resume.calls == []
+    assert outcomes == {"completed": 1, "resumed": 0, "rolled back": 0}
+
+
+def test_replay_source_changed(tree):
+    root, source, targets = tree
+    journal_file = str(root / "journal")
+    cut(journal_file, write_dispatch(journal_file, source, targets), 2)
+    with open(source, "ab") as file:
+        file.write(b" changed")
+    resume = Resume()
+
+    outcomes, _ = replay(journal_file, resume)
+
+    # new content is dispatched again, previous one is kept in targets
+    assert resume.calls == []
+    assert outcomes == {"completed": 0, "resumed": 0, "rolled back": 1}
+    assert os.path.exists(source)
+    assert os.path.exists(targets[0])
+
+
+def test_replay_resume_failed(tree):
+    root, source, targets = tree
+    journal_file = str(root / "journal")
+    cut(journal_file, write_dispatch(journal_file, source, targets), 2)
+    os.unlink(targets[1])
+    resume = Resume(OSError("destination not writable"))
+
+    outcomes, left = replay(journal_file, resume)
+
+    # targets written are removed, source keeps the content
+    assert outcomes == {"completed": 0, "resumed": 0, "rolled back": 1}
+    assert os.path.exists(source)
+    assert not os.path.exists(targets[0])
+    assert left == 0
+
+
+def test_open_dispatches_survive_restart(tree):
+    root, source, targets = tree
+    journal_file = str(root / "journal")
+    journal = DispatchJournal(journal_file)
+    first = journal.begin(source, os.stat(source), targets)
+    journal.written(first, targets[:1])
+    journal.close()
+
+    journal = DispatchJournal(journal_file)
+    # ids are not reused
+    assert journal.begin(source, os.stat(source), targets) > first
+    assert len(journal) == 2
+    journal.close()
+
+
+def test_compaction(tree):
+    root, source, targets = tree
+    journal_file = str(root / "journal")
+    journal = DispatchJournal(journal_file, compact_size=4096)
+    kept = journal.begin(source, os.stat(source), targets)
+    journal.written(kept, targets[:1])
+
+    def dispatch():
+        for _ in range(100):
+            dispatch_id = journal.begin(source, os.stat(source), targets)
+            journal.written(dispatch_id, targets)
+            journal.removed(dispatch_id)
+
+    threads = [threading.Thread(target=dispatch) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    journal.close()
+
+    # 400 dispatches of about 300 bytes were journaled
+    assert os.path.getsize(journal_file) < 2 * 4096
+    resume = Resume()
+    outcomes, _ = replay(journal_file, resume)
+    assert resume.calls == [(source, targets[1:])]
+    assert outcomes["resumed"] == 1
+
+
+def test_dispatcher_recover(tree):
+    root, source, targets = tree
+    journal_file = str(root / "journal")
+    cut(journal_file, write_dispatch(journal_file, source, targets), 2)
+    rules = RuleBuilder.build_index(
+        {"R1": {"formats": ["F1"], "sources": ["S"], "destinations": ["D1", "D2"]}},
+        {"F1": [".txt"]},
+        {"S": str(root / "S")},
+        {"D1": str(root / "D1"), "D2": str(root / "D2")}
+    )
+    os.unlink(targets[1])
+    dispatcher = FileDispatcher(rules, journal=DispatchJournal(journal_file))
+
+    assert dispatcher.recover() == {"completed": 0, "resumed": 1, "rolled back": 0}
+    dispatcher.shutdown()
+
+    assert not os.path.exists(source)
+    assert [open(target, "rb").read() for target in targets] == [b"content", b"content"]
+    assert FileDispatcher(rules).recover() is None
+
+
+@pytest.mark.parametrize("shards, orphans", [
+    (0, ["journal.0", "journal.1", "journal.10"]),
+    (1, ["journal", "journal.1", "journal.10"]),
+    (2, ["journal", "journal.10"]),
+    (11, ["journal"])
+])
+def test_orphans(tmp_path, shards, orphans):
+    for name in ("journal", "journal.0", "journal.1", "journal.10", "journal.1.123.tmp", "journal.x", "other.1"):
+        (tmp_path / name).write_bytes(b"")
+    journal_file = str(tmp_path / "journal")
+
+    assert DispatchJournal.orphans(journal_file, shards) == [str(tmp_path / name) for name in orphans]
+    assert DispatchJournal.orphans(str(tmp_path / "missing" / "journal"), shards) == []
+
+
+def test_dispatcher_recover_journal(tree):
+    root, source, targets = tree
+    # journal of a shard not running anymore
+    journal_file = str(root / "journal.2")
+    cut(journal_file, write_dispatch(journal_file, source, targets), 2)
+    rules = RuleBuilder.build_index({}, {}, {}, {})
+
+    assert FileDispatcher(rules).recover_journal(journal_file) == {"completed": 0, "resumed": 1, "rolled back": 0}
+    assert not os.path.exists(source)
+    assert not os.path.exists(journal_file)
@@ -0,0 +1,137 @@
+import os
+
+import pytest
+
+from control.dispatcher import FileDispatcher
+from control.transfer import FingerprintCache
+from model import File, RuleBuilder
+
+
+@pytest.fixture
+def digests(monkeypatch):
+    """
+    Files digested by FingerprintCache, in order
+    """
+    digested = []
+    digest = FingerprintCache.digest
+
+    def counting(filename):
+        digested.append(filename)
+        return digest(filename)
+
+    monkeypatch.setattr(FingerprintCache, "digest", staticmethod(counting))
+    return digested
+
+
+def write(path, content, mtime_ns=None):
+    path.write_bytes(content)
+    if mtime_ns is not None:
+        os.utime(str(path), ns=(mtime_ns, mtime_ns))
+    return str(path)
+
+
+def test_identical(tmp_path, digests):
+    source = write(tmp_path / "a.txt", b"content")
+    same = write(tmp_path / "same.txt", b"content")
+    different = write(tmp_path / "different.txt", b"CONTENT")
+    shorter = write(tmp_path / "shorter.txt", b"cont")
+    cache = FingerprintCache()
+
+    identical, digest = cache.identical(source, [same, different, shorter, str(tmp_path / "missing.txt")])
+
+    assert identical == {same}
+    assert digest == FingerprintCache.digest(source)
+    # files of different size are not read
+    assert shorter not in digests
+
+
+def test_same_size_and_mtime_compared_by_content(tmp_path, digests):
+    source = write(tmp_path / "a.txt", b"content", 10 ** 18)
+    # e.g. times copied from another file
+    target = write(tmp_path / "b.txt", b"CONTENT", 10 ** 18)
+    cache = FingerprintCache()
+
+    assert cache.identical(source, [target])[0] == set()
+    assert sorted(digests) == sorted([source, target])
+
+
+def test_hard_link_not_read(tmp_path, digests):
+    source = write(tmp_path / "a.txt", b"content")
+    os.link(source, str(tmp_path / "b.txt"))
+    cache = FingerprintCache()
+
+    assert cache.identical(source, [str(tmp_path / "b.txt")]) == ({str(tmp_path / "b.txt")}, None)
+    assert digests == []
+
+
+def test_cache_hit(tmp_path, digests):
+    source = write(tmp_path / "a.txt", b"content")
+    target = write(tmp_path / "b.txt", b"content")
+    cache = FingerprintCache()
+    cache.identical(source, [target])
+    digests.clear()
+
+    assert cache.identical(source, [target])[0] == {target}
+    # only the new source is read
+    assert digests == [source]
+
+    write(tmp_path / "b.txt", b"CONTENT", os.stat(target).st_mtime_ns + 1)
+    assert cache.identical(source, [target])[0] == set()
+    assert digests == [source, source, target]
+
+
+def test_eviction(tmp_path, digests):
+    source = write(tmp_path / "a.txt", b"content")
+    targets = [write(tmp_path / f"{n}.txt", b"content") for n in range(3)]
+    cache = FingerprintCache(entries=2)
+    cache.identical(source, targets[:2])
+    # least recently used is targets[1]
+    cache.identical(source, targets[:1])
+    cache.identical(source, targets[2:])
+    digests.clear()
+
+    cache.identical(source, targets[:1])
+    cache.identical(source, targets[1:2])
+
+    assert len(cache) == 2
+    assert digests == [source, source, targets[1]]
+
+
+def test_persistence(tmp_path, digests):
+    source = write(tmp_path / "a.txt", b"content")
+    target = write(tmp_path / "b.txt", b"content")
+    filename = str(tmp_path / "fingerprints.json")
+    cache = FingerprintCache(filename=filename)
+    cache.store(target, FingerprintCache.digest(target))
+    cache.save()
+    digests.clear()
+
+    loaded = FingerprintCache(filename=filename)
+
+    assert len(loaded) == 1
+    assert loaded.identical(source, [target])[0] == {target}
+    assert digests == [source]
+
+
+def test_dispatch(tmp_path):
+    for directory in ("S", "D1", "D2"):
+        (tmp_path / directory).mkdir()
+    rules = RuleBuilder.build_index(
+        {"R1": {"formats": ["F1"], "sources": ["S"], "destinations": ["D1", "D2"]}},
+        {"F1": [".txt"]},
+        {"S": str(tmp_path / "S")},
+        {"D1": str(tmp_path / "D1"), "D2": str(tmp_path / "D2")}
+    )
+    dispatcher = FileDispatcher(rules, fingerprints=FingerprintCache())
+    source = write(tmp_path / "S" / "a.txt", b"new content", 10 ** 18)
+    identical = write(tmp_path / "D1" / "a.txt", b"new content")
+    # edited file, with the same size and times
+    edited = write(tmp_path / "D2" / "a.txt", b"old content", 10 ** 18)
+    identical_ino = os.stat(identical).st_ino
+
+    dispatcher.dispatch(File(source))
+    dispatcher.shutdown()
+
+    assert not os.path.exists(source)
+    assert os.stat(identical).st_ino == identical_ino
+    assert open(edited, "rb").read() == b"new content"
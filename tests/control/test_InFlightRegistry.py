@@ -0,0 +1,103 @@
+import os
+import threading
+
+import pytest
+
+from control.InFlightRegistry import InFlightRegistry
+
+
+@pytest.fixture
+def filename(tmp_path):
+    path = tmp_path / "a.txt"
+    path.write_bytes(b"content")
+    return str(path)
+
+
+def test_admit_coalesces_pending(filename):
+    registry = InFlightRegistry()
+
+    assert registry.admit(filename)
+    assert not registry.admit(filename)
+    assert not registry.admit(filename)
+
+    assert registry.stats() == {"pending": 1, "claimed": 0, "admitted": 1, "coalesced": 2, "dropped": 0}
+    assert len(registry) == 1
+
+
+def test_admit_drops_claimed(filename):
+    registry = InFlightRegistry()
+    registry.admit(filename)
+
+    assert registry.claim(filename)
+    # same file being dispatched
+    assert not registry.admit(filename)
+    os.unlink(filename)
+    # moved away by its dispatching
+    assert not registry.admit(filename)
+
+    assert registry.stats() == {"pending": 0, "claimed": 1, "admitted": 1, "coalesced": 0, "dropped": 2}
+
+
+def test_admit_new_file_while_claimed(filename):
+    registry = InFlightRegistry()
+    registry.admit(filename)
+    registry.claim(filename)
+
+    # another file written at the same path during dispatching
+    replaced = filename + ".new"
+    with open(replaced, "wb") as file:
+        file.write(b"new content")
+    os.utime(replaced, ns=(1, 1))
+    os.replace(replaced, filename)
+
+    assert registry.admit(filename)
+    # dispatched after the first dispatching ends
+    assert not registry.claim(filename)
+    registry.release(filename)
+    assert registry.claim(filename)
+    assert registry.stats()["pending"] == 0
+
+
+def test_claim_once(filename):
+    registry = InFlightRegistry()
+    registry.admit(filename)
+
+    assert registry.claim(filename)
+    assert not registry.claim(filename)
+    registry.release(filename)
+
+    assert len(registry) == 0
+    assert registry.admit(filename)
+    assert registry.claim(filename)
+
+
+def test_discard(filename):
+    registry = InFlightRegistry()
+    registry.admit(filename)
+
+    registry.discard(filename)
+    # unknown files are ignored
+    registry.discard(filename + ".unknown")
+    registry.release(filename + ".unknown")
+
+    assert len(registry) == 0
+    assert registry.admit(filename)
+
+
+def test_claim_concurrently(filename):
+    registry = InFlightRegistry()
+    registry.admit(filename)
+    barrier = threading.Barrier(8)
+    claims = []
+
+    def claim():
+        barrier.wait()
+        claims.append(registry.claim(filename))
+
+    threads = [threading.Thread(target=claim) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(claims) == [False] * 7 + [True]
@@ -0,0 +1,77 @@
+import os
+import textwrap
+
+import pytest
+
+from control import ShardSupervisor
+from control.dispatcher import DispatchJournal
+from model import DispatcherConfig
+
+SOURCES = ["S1", "S2", "S3", "S4", "S5"]
+
+
+@pytest.fixture
+def root(tmp_path):
+    for directory in SOURCES + ["D1", "tmp"]:
+        (tmp_path / directory).mkdir()
+    return tmp_path
+
+
+def supervisor(root, processes):
+    sources = ", ".join(f"'{key}' : '{root / key}'" for key in SOURCES)
+    config_file = root / "conf.ini"
+    config_file.write_text(textwrap.dedent(f"""
+        [GENERAL]
+        log.async = false
+        tmp = {root / "tmp"}
+        journal.file = {root / "journal"}
+        processes = {processes}
+        [DISPATCHER]
+        formats = {{ 'F1' : [ '.txt' ] }}
+        sources = {{ {sources} }}
+        destinations = {{ 'D1' : '{root / "D1"}' }}
+        rules = {{ 'R1' : {{ 'formats' : [ 'F1' ], 'sources' : {SOURCES}, 'destinations' : [ 'D1' ] }} }}
+    """))
+    dispatcher_config = DispatcherConfig.get_instance()
+    dispatcher_config.load_from(str(config_file))
+    return ShardSupervisor(str(config_file), dispatcher_config)
+
+
+def interrupted(root, journal_file, name):
+    """
+    Journal the intent of dispatching a new file of S1, as a process killed before writing it
+    """
+    source = root / "S1" / name
+    source.write_bytes(name.encode())
+    journal = DispatchJournal(str(journal_file))
+    journal.begin(str(source), os.stat(str(source)), [str(root / "D1" / name)])
+    journal.close()
+    return str(source)
+
+
+@pytest.mark.parametrize("processes, shards", [
+    (1, [SOURCES]),
+    (2, [["S1", "S3", "S5"], ["S2", "S4"]]),
+    (3, [["S1", "S4"], ["S2", "S5"], ["S3"]]),
+    # no shard without sources
+    (8, [[key] for key in SOURCES])
+])
+def test_shards(root, processes, shards):
+    assert supervisor(root, processes).shards == shards
+
+
+def test_recover_journals(root):
+    # previous run with 4 processes, and before with a single one
+    sources = [interrupted(root, f"{root / 'journal'}.{shard}", f"{shard}.txt") for shard in range(4)]
+    single = interrupted(root, root / "journal", "single.txt")
+    # journal which can not be replayed
+    (root / "journal.5").mkdir()
+
+    supervisor(root, 2).recover_journals()
+
+    # journals of shards still running are replayed by them
+    assert [os.path.exists(source) for source in sources] == [True, True, False, False]
+    assert not os.path.exists(single)
+    assert sorted(os.listdir(str(root / "D1"))) == ["2.txt", "3.txt", "single.txt"]
+    assert sorted(name for name in os.listdir(str(root)) if name.startswith("journal")) == \
+        ["journal.0", "journal.1", "journal.5"]
@@ -0,0 +1,63 @@
+import errno
+import os
+
+import pytest
+
+from control.transfer import StagingArea
+
+
+def cross_mount(monkeypatch, tmp_dir):
+    """
+    Make renames from tmp_dir fail as across mounts (e.g. destination is a bind mount)
+    """
+    replace = os.replace
+
+    def fake_replace(src, dst, **kwargs):
+        if src.startswith(tmp_dir):
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV), src, None, dst)
+        return replace(src, dst, **kwargs)
+
+    monkeypatch.setattr(os, "replace", fake_replace)
+
+
+def test_stage_in_tmp_dir(tmp_path):
+    (tmp_path / "tmp").mkdir()
+    staging = StagingArea(str(tmp_path / "tmp"))
+    filename = str(tmp_path / "a.txt")
+
+    staged = staging.stage(filename)
+    assert os.path.dirname(staged) == str(tmp_path / "tmp")
+    with open(staged, "wb") as file:
+        file.write(b"content")
+    staging.publish(staged, filename)
+
+    assert os.listdir(str(tmp_path / "tmp")) == []
+    assert open(filename, "rb").read() == b"content"
+
+
+def test_publish_across_mounts(tmp_path, monkeypatch):
+    (tmp_path / "tmp").mkdir()
+    (tmp_path / "D1").mkdir()
+    staging = StagingArea(str(tmp_path / "tmp"))
+    cross_mount(monkeypatch, str(tmp_path / "tmp"))
+    filename = str(tmp_path / "D1" / "a.txt")
+
+    staged = staging.stage(filename)
+    with open(staged, "wb") as file:
+        file.write(b"content")
+    staging.publish(staged, filename)
+
+    assert os.listdir(str(tmp_path / "tmp")) == []
+    assert os.listdir(str(tmp_path / "D1")) == ["a.txt"]
+    assert open(filename, "rb").read() == b"content"
+    # next files are staged directly in destination
+    assert os.path.dirname(staging.stage(filename)) == str(tmp_path / "D1")
+    assert os.path.dirname(staging.stage(str(tmp_path / "b.txt"))) == str(tmp_path / "tmp")
+
+
+def test_publish_error(tmp_path):
+    staging = StagingArea(str(tmp_path))
+    staged = staging.stage(str(tmp_path / "a.txt"))
+
+    with pytest.raises(FileNotFoundError):
+        staging.publish(staged, str(tmp_path / "a.txt"))
@@ -0,0 +1,66 @@
+import struct
+
+import pytest
+
+from model import ContentSniffer
+
+
+def bmp(dib_size=40, reserved=0):
+    return b"BM" + struct.pack("<IIII", 1078, reserved, 54, dib_size) + b"\x00" * 64
+
+
+def riff(kind):
+    return b"RIFF" + struct.pack("<I", 1024) + kind + b"\x00" * 64
+
+
+@pytest.mark.parametrize("header, mime", [
+    (b"\xff\xd8\xff\xe0\x00\x10JFIF", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n\x00\x00", "image/png"),
+    (bmp(), "image/bmp"),
+    (bmp(12), "image/bmp"),
+    (bmp(124), "image/bmp"),
+    (riff(b"WEBP"), "image/webp"),
+    (riff(b"AVI "), "video/x-msvideo"),
+    (riff(b"WAVE"), "audio/wav"),
+    (b"\x00\x00\x00\x18ftypheic", "image/heic"),
+    (b"\x00\x00\x00\x18ftypisom", "video/mp4"),
+    (b"\x00\x00\x00\x18ftypqt  ", "video/quicktime"),
+    (b"ID3\x04\x00", "audio/mpeg"),
+    (b"%PDF-1.7\n", "application/pdf"),
+    (b"\x00" * 257 + b"ustar\x0000", "application/x-tar"),
+    ("plain text, é".encode("utf-8"), ContentSniffer.TEXT),
+    (b"", None),
+    (b"\x00\x01\x02", None)
+])
+def test_classify(header, mime):
+    assert ContentSniffer().classify(header) == mime
+
+
+@pytest.mark.parametrize("header", [
+    # text starting with signatures too short to be told apart from it
+    b"BMW 320d, 2014\n",
+    b"BM" + b"\x00" * 64,
+    bmp(reserved=1),
+    bmp(dib_size=7),
+    # frame sync of MPEG audio without ID3 tag
+    b"\xff\xfb\x90\x64" + b"\x00" * 64,
+    # RIFF types without RIFF container
+    b"LIST\x00\x04\x00\x00WAVE" + b"\x00" * 64,
+    b"12345678AVI \x00"
+])
+def test_classify_weak_signatures(header):
+    assert ContentSniffer().classify(header) in (None, ContentSniffer.TEXT)
+
+
+def test_classify_truncated_header():
+    assert ContentSniffer().classify(b"RIFF\x00\x04") is None
+    assert ContentSniffer().classify(bmp()[:16]) is None
+
+
+def test_sniff(tmp_path):
+    path = tmp_path / "image"
+    path.write_bytes(riff(b"WEBP"))
+    sniffer = ContentSniffer(header_size=16)
+
+    assert sniffer.sniff(str(path)) == "image/webp"
+    assert sniffer.sniff(str(tmp_path / "missing")) is None
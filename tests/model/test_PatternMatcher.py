@@ -0,0 +1,50 @@
+import pytest
+
+from model import PatternMatcher
+
+
+def match(patterns, name):
+    matcher = PatternMatcher(patterns)
+    return [matcher.patterns[pattern_id] for pattern_id in matcher.match(name)]
+
+
+def test_suffixes():
+    assert match([".jpg", ".tar.gz", ".gz"], "a.TAR.GZ") == [".tar.gz", ".gz"]
+    assert match([".jpg"], ".jpg") == []
+
+
+def test_combined_expressions():
+    patterns = ["glob:IMG_*.jpg", "re:^report-\\d+\\.csv$", "re:.*"]
+    assert match(patterns, "img_1.JPG") == ["glob:IMG_*.jpg", "re:.*"]
+    assert match(patterns, "report-12.csv") == ["re:^report-\\d+\\.csv$", "re:.*"]
+
+
+def test_global_inline_flags():
+    assert match(["re:(?x) foo \\. txt"], "foo.txt") == ["re:(?x) foo \\. txt"]
+    assert match(["re:(?i)foo", "re:x.*"], "FOO") == ["re:(?i)foo"]
+
+
+def test_back_references():
+    assert match(["re:(a)\\1\\.txt"], "aa.txt") == ["re:(a)\\1\\.txt"]
+    # back reference does not refer to groups of other patterns
+    assert match(["re:x.*", "re:(a)\\1\\.txt"], "aa.txt") == ["re:(a)\\1\\.txt"]
+    assert match(["re:x.*", "re:(a)\\1\\.txt"], "ab.txt") == []
+
+
+def test_named_groups():
+    patterns = ["re:x.*", "re:(?P<p1>a+)\\.txt", "re:(?P<p0>b)(?P=p0)"]
+    assert match(patterns, "aa.txt") == ["re:(?P<p1>a+)\\.txt"]
+    assert match(patterns, "bb") == ["re:(?P<p0>b)(?P=p0)"]
+    assert match(patterns, "xa.txt") == ["re:x.*"]
+
+
+def test_globs_with_many_wildcards():
+    patterns = ["glob:*_*_*.raw", "glob:*.*"]
+    assert match(patterns, "a_b_c.raw") == patterns
+    assert match(patterns, "a_b.raw") == ["glob:*.*"]
+
+
+@pytest.mark.parametrize("pattern", ["jpg", ".", "glob:", "re:", "re:(", "re:a)"])
+def test_invalid(pattern):
+    with pytest.raises(ValueError):
+        PatternMatcher([pattern])
@@ -0,0 +1,94 @@
+import itertools
+import os
+
+import pytest
+
+from model import RuleBuilder
+
+FORMATS = {
+    "F1": [".jpg", ".JPEG", ".png", ".gz"],
+    "F2": [".txt", ".pdf", ".jpg"],
+    "F3": [".mp4"]
+}
+
+RULES = {
+    "R1": {"formats": ["F1"], "sources": ["S2"], "destinations": ["D2"]},
+    "R2": {"formats": ["F2"], "sources": ["S1", "S2"], "destinations": ["D3"]},
+    "R3": {"formats": ["F1", "F2"], "sources": ["S1", "S2"], "destinations": ["D1", "D3"]},
+    "R4": {"formats": ["F3"], "sources": ["S3"], "destinations": []}
+}
+
+NAMES = [
+    "a.jpg", "a.JPG", "a.Jpeg", "a.png", "a.txt", "a.pdf", "a.mp4", "a.gz", "a.tar.gz",
+    "a.jpg.txt", "a.txt.jpg", "a.doc", "a", "a.", "jpg", ".a.txt", "a b.PDF"
+]
+
+
+@pytest.fixture
+def layout(tmp_path):
+    sources = {key: str(tmp_path / key) for key in ("S1", "S2", "S3")}
+    destinations = {key: str(tmp_path / key) for key in ("D1", "D2", "D3")}
+    directories = list(sources.values()) + [
+        str(tmp_path / "S1" / "sub"),
+        str(tmp_path / "other"),
+        # same sources, not normalized
+        str(tmp_path / "S1") + "/",
+        str(tmp_path / "S3" / ".." / "S2")
+    ]
+    return sources, destinations, directories
+
+
+def old_match(filename, rules):
+    """
+    Destinations of filename as computed by the loop over rules replaced by RuleIndex:
+        a rule matches if the extension of filename is one of its formats (ignoring case)
+        and the directory of filename is one of its sources
+    """
+    directory, ext = os.path.dirname(filename), os.path.splitext(filename)[1]
+    destinations = []
+    for rule in rules.values():
+        if not any(ext.lower() == frt.lower() for key in rule["formats"] for frt in FORMATS[key]):
+            continue
+        if any(os.path.normpath(directory) == os.path.normpath(src) for src in rule["sources"]):
+            destinations.extend(rule["destinations"])
+    return tuple(dict.fromkeys(destinations))
+
+
+def test_match_equivalent_to_rules_loop(layout):
+    sources, destinations, directories = layout
+    index = RuleBuilder.build_index(RULES, FORMATS, sources, destinations)
+    rules = {
+        name: {
+            "formats": rule["formats"],
+            "sources": [sources[src] for src in rule["sources"]],
+            "destinations": [destinations[dst] for dst in rule["destinations"]]
+        }
+        for name, rule in RULES.items()
+    }
+
+    for directory, name in itertools.product(directories, NAMES):
+        filename = os.path.join(directory, name)
+        expected = old_match(filename, rules)
+        assert index.match(filename) == (expected, ""), filename
+        assert index.accepts(filename) == (len(expected) > 0), filename
+
+
+def test_match_memoized(layout):
+    sources, destinations, directories = layout
+    index = RuleBuilder.build_index(RULES, FORMATS, sources, destinations)
+    filename = os.path.join(sources["S2"], "a.jpg")
+
+    first = index.match(filename)
+    assert index.match(filename)[0] is first[0]
+    assert index.rule_names(filename) == ("R1", "R2", "R3")
+
+
+def test_match_recursive(layout):
+    sources, destinations, _ = layout
+    index = RuleBuilder.build_index(RULES, FORMATS, sources, destinations, {"S1": "tree", "S2": "flat"})
+
+    assert index.match(os.path.join(sources["S1"], "x", "y", "a.txt")) == ((destinations["D3"], destinations["D1"]), "x/y")
+    assert index.match(os.path.join(sources["S2"], "x", "a.png")) == ((destinations["D2"], destinations["D1"], destinations["D3"]), "")
+    assert index.match(os.path.join(sources["S3"], "x", "a.mp4")) == ((), "")
+    assert index.is_recursive(sources["S1"] + "/")
+    assert not index.is_recursive(sources["S3"])